@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+from typing import Any, List, Optional, Tuple
+
+from fire import Fire
+
+from events import Event
+from interface import Compute, Env, Steps
+from interaction import InteractionRegion
+from main import Agent, set_logging
+from planner import NavigationPlanner
+from utils import Action, Pos2D
+
+
+def timed_step(controller: Any, api_action: dict) -> Tuple[Event, float, float]:
+    """
+    Sends api_action, returns the event and the time.perf_counter() it was sent at
+    and returned at, taken in the executor thread so waiting for the loop to pick
+    the result up isn't counted as simulator time
+    """
+    start = perf_counter()
+    event = controller.step(api_action)
+    return event, start, perf_counter()
+
+
+class AsyncEnv:
+    """
+    Drives an Env from an event loop, so one process can interleave the episodes of
+    many controllers: controller steps and the Compute requests of steps run in
+    executor threads, pacing sleeps with asyncio.sleep
+
+    All state stays in the wrapped Env, every attribute but the coroutines below is
+    read from and written to it. Its blocking methods (reset, snapshot,
+    analyze_frame, ...) remain available through env, run them with
+    run_in_executor from inside the loop.
+    """
+
+    def __init__(self, env: Env, executor: Optional[Executor] = None):
+        """executor: runs the controller steps, the loop's default executor if None"""
+        self.env = env
+        self.executor = executor
+
+    @classmethod
+    async def create(
+        cls, executor: Optional[Executor] = None, **kwargs
+    ) -> "AsyncEnv":
+        """Creates an Env with kwargs in the executor, starting a controller blocks"""
+        loop = asyncio.get_running_loop()
+        env = await loop.run_in_executor(executor, partial(Env, **kwargs))
+        return cls(env, executor)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.env, name)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in ("env", "executor"):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.env, name, value)
+
+    async def api_step(self, *args, **kwargs) -> Event:
+        env = self.env
+        api_action = env.get_api_action(*args, **kwargs)
+        sleep_time = env.pacer.sleep_time
+        await env.pacer.wait_async()
+        last_agent = env.event.metadata["agent"]
+        event, start, end = await asyncio.get_running_loop().run_in_executor(
+            self.executor, timed_step, env.controller, api_action
+        )
+        return env.record_step(
+            api_action,
+            event,
+            last_agent,
+            start,
+            end,
+            env.pacer.sleep_time - sleep_time,
+        )
+
+    async def step(self, action: Action) -> bool:
+        """Attempts to perform action, return if the action is successful"""
+        return await self.run(self.env.action_steps(action))
+
+    async def run(self, steps: Steps) -> Any:
+        """Env.run, awaiting every api action"""
+        loop = asyncio.get_running_loop()
+        try:
+            api_action = next(steps)
+            while True:
+                if isinstance(api_action, Compute):
+                    result = await loop.run_in_executor(self.executor, api_action.func)
+                elif isinstance(api_action, Future):
+                    await asyncio.wait([asyncio.wrap_future(api_action)])
+                    result = api_action
+                else:
+                    result = await self.api_step(api_action)
+                api_action = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def ensure_rendered(self) -> Event:
+        return await self.run(self.env.render_steps())
+
+    async def reset(self, full: bool = False):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.env.reset, full)
+
+
+class AsyncAgent(Agent):
+    """Agent whose skills are coroutines, running on an AsyncEnv"""
+
+    env: AsyncEnv
+
+    @classmethod
+    async def create(cls, env: AsyncEnv, **kwargs) -> "AsyncAgent":
+        """
+        Creates an agent on env with kwargs, computing the object distances its
+        bindings are chosen by in env's executor first
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(env.executor, getattr, env.env, "object_distances")
+        return cls(env, **kwargs)
+
+    async def execute(self, tasks: List[Tuple[str, str]]):
+        for func, arg in tasks:
+            await getattr(self, func)(arg)
+
+    async def go_to_obj(self, object_id: str) -> bool:
+        return await self.env.run(self.go_to_obj_steps(object_id))
+
+    async def navigate(
+        self, goal: Pos2D, region: Optional[InteractionRegion] = None
+    ) -> NavigationPlanner:
+        return await self.env.run(self.navigate_steps(goal, region))
+
+    async def look_at_obj(self, object_id: str) -> bool:
+        return await self.env.run(self.look_at_obj_steps(object_id))
+
+    async def pick_obj(self, object_id: str) -> bool:
+        return await self.env.run(self.pick_obj_steps(object_id))
+
+    async def put_obj(self, recep_id: str) -> bool:
+        return await self.env.run(self.put_obj_steps(recep_id))
+
+    async def cut_obj(self, object_id: str) -> bool:
+        return await self.env.run(self.cut_obj_steps(object_id))
+
+    async def go_to_pose(self, object_id: str) -> Optional[bool]:
+        return await self.env.run(self.go_to_pose_steps(object_id))
+
+    async def run_skill(self, skill: str, name: str) -> bool:
+        return await self.env.run(self.run_skill_steps(skill, name))
+
+    async def execute_step(self, step: str) -> bool:
+        return await self.env.run(self.execute_step_steps(step))
+
+    async def run_plan(self, plan_file: str) -> bool:
+        return await self.env.run(self.run_plan_steps(plan_file))
+
+
+async def run_episode(
+    env: AsyncEnv, plan_file: str, nav_mode: str = "field"
+) -> dict:
+    """Runs plan_file once on env, returns the episode results"""
+    result = dict(floorplan=env.floorplan, success=False, error=None)
+    start = perf_counter()
+    try:
+        env.path_length = 0
+        env.metrics.clear()
+        with await AsyncAgent.create(env, nav_mode=nav_mode) as agent:
+            result["success"] = await agent.run_plan(plan_file)
+        result.update(
+            path_length=env.path_length,
+            nav_expansions=agent.nav_expansions,
+            nav_steps=agent.nav_steps,
+            skills=[section.to_dict() for section in env.metrics.by_skill()],
+        )
+    except Exception as e:
+        logging.exception("episode in {} failed".format(env.floorplan))
+        result["error"] = repr(e)
+    result["time"] = perf_counter() - start
+    return result
+
+
+async def run_episodes(
+    plan_file: str,
+    floorplans: List[str],
+    nav_mode: str = "field",
+    pacing: str = "fixed",
+) -> List[dict]:
+    """Runs plan_file once per floorplan, all interleaved on the running loop"""
+    executor = ThreadPoolExecutor(max_workers=len(floorplans))
+    try:
+        envs = await asyncio.gather(
+            *(
+                AsyncEnv.create(executor, floorplan=floorplan, pacing=pacing)
+                for floorplan in floorplans
+            )
+        )
+        return await asyncio.gather(
+            *(run_episode(env, plan_file, nav_mode) for env in envs)
+        )
+    finally:
+        executor.shutdown(wait=False)
+
+
+def main(
+    plan_file: str,
+    floorplans: List[str],
+    nav_mode: str = "field",
+    pacing: str = "fixed",
+    output: str = "results_async.json",
+):
+    """
+    Runs plan_file on every floorplan concurrently from a single process, one
+    controller per floorplan (repeat a floorplan to run it several times), and
+    writes the results to output
+    """
+
+    set_logging("INFO")
+    if isinstance(floorplans, str):
+        floorplans = [floorplans]
+    start = perf_counter()
+    results = asyncio.run(run_episodes(plan_file, floorplans, nav_mode, pacing))
+    with open(output, "w") as f:
+        json.dump(
+            dict(
+                plan_file=plan_file,
+                nav_mode=nav_mode,
+                total_time=perf_counter() - start,
+                success_rate=sum(x["success"] for x in results) / max(len(results), 1),
+                episodes=results,
+            ),
+            f,
+            indent=2,
+        )
+    logging.info("wrote {} episodes to {}".format(len(results), output))
+
+
+if __name__ == "__main__":
+    Fire(main)
@@ -0,0 +1,289 @@
+import glob
+import json
+import logging
+import os
+import random
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from typing import List, Optional
+
+from fire import Fire
+
+from interface import Env
+from main import Agent, set_logging
+from traces import ReplayDivergence
+
+# one environment, hence one controller, per worker process
+_env: Optional[Env] = None
+_env_kwargs: dict = {}
+# set when an episode failed and left the scene in an unknown state
+_env_dirty: bool = False
+
+
+class EpisodeTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise EpisodeTimeout()
+
+
+def _init_worker(env_kwargs: dict, log_level: str):
+    global _env_kwargs
+    _env_kwargs = env_kwargs
+    set_logging(log_level)
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _discard_env():
+    """
+    Stops the worker's controller, the next episode starts a new one. For episodes
+    interrupted inside a controller step, whose connection is left mid request
+    """
+    global _env, _env_dirty
+    if _env is not None:
+        try:
+            _env.controller.stop()
+        except Exception:
+            logging.exception("stopping the controller failed")
+    _env = None
+    _env_dirty = False
+
+
+def _get_env(floorplan: str) -> Env:
+    """Returns the worker's environment, switched to floorplan and reset"""
+    global _env, _env_dirty
+    if _env is None:
+        _env = Env(floorplan=floorplan, **_env_kwargs)
+    elif _env.floorplan != floorplan:
+        _env.floorplan = floorplan
+        _env.reset(full=True)
+    else:
+        _env.reset(full=_env_dirty)
+    _env_dirty = False
+    return _env
+
+
+def set_start_pose(env: Env, seed: int):
+    """Teleports the agent to a random reachable position and yaw given by seed"""
+    rng = random.Random(seed)
+    env.api_step(
+        action="Teleport",
+        position=rng.choice(env.reachables),
+        rotation=dict(x=0, y=rng.choice([0, 90, 180, 270]), z=0),
+        horizon=0,
+    )
+
+
+def run_episode(
+    plan_file: str,
+    floorplan: str,
+    seed: Optional[int],
+    nav_mode: str,
+    timeout: Optional[int],
+) -> dict:
+    """Runs plan_file once in the worker, returns the episode results"""
+    global _env_dirty
+
+    result = dict(floorplan=floorplan, seed=seed, success=False, error=None)
+    start = perf_counter()
+    try:
+        if timeout:
+            signal.alarm(timeout)
+        env = _get_env(floorplan)
+        if seed is not None:
+            set_start_pose(env, seed)
+        env.path_length = 0
+        env.metrics.clear()
+        sim_time, sleep_time = env.pacer.sim_time, env.pacer.sleep_time
+
+        with Agent(env, nav_mode=nav_mode) as agent:
+            result["success"] = agent.run_plan(plan_file)
+        result.update(
+            path_length=env.path_length,
+            nav_expansions=agent.nav_expansions,
+            nav_steps=agent.nav_steps,
+            sim_time=env.pacer.sim_time - sim_time,
+            sleep_time=env.pacer.sleep_time - sleep_time,
+            skills=[section.to_dict() for section in env.metrics.by_skill()],
+        )
+    except EpisodeTimeout:
+        result["error"] = "timeout after {}s".format(timeout)
+        _discard_env()
+    except Exception as e:
+        logging.exception("episode {} {} failed".format(floorplan, seed))
+        result["error"] = repr(e)
+        _env_dirty = True
+    finally:
+        signal.alarm(0)
+    result["time"] = perf_counter() - start
+    return result
+
+
+def run_batch(
+    plan_file: str,
+    floorplans: Optional[List[str]] = None,
+    seeds: Optional[List[int]] = None,
+    workers: int = 2,
+    timeout: Optional[int] = 600,
+    nav_mode: str = "field",
+    output: str = "results.json",
+    pacing: str = "none",
+    worker_log_level: str = "WARNING",
+    retention: str = "lean",
+):
+    """
+    Runs plan_file on every floorplan and seed with a pool of workers, each driving its
+    own controller, and writes the results of all episodes to output
+
+    floorplans: defaults to every floorplan with a pose file in poses/
+    seeds: random agent start poses, the scene's default start pose if not given
+    timeout: per episode, in seconds
+    retention: how much of every event workers keep, see Env
+    """
+
+    set_logging("INFO")
+    if floorplans is None:
+        floorplans = sorted(
+            os.path.splitext(os.path.basename(path))[0]
+            for path in glob.glob("poses/*.json")
+        )
+    elif isinstance(floorplans, str):
+        floorplans = [floorplans]
+    if seeds is None:
+        seeds = [None]
+    elif isinstance(seeds, int):
+        seeds = [seeds]
+
+    # group episodes by floorplan so workers rarely need to switch scenes
+    episodes = [(floorplan, seed) for floorplan in floorplans for seed in seeds]
+    results = []
+    start = perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(dict(pacing=pacing, retention=retention), worker_log_level),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_episode, plan_file, floorplan, seed, nav_mode, timeout
+            ): (floorplan, seed)
+            for floorplan, seed in episodes
+        }
+        for future in as_completed(futures):
+            floorplan, seed = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker itself died, e.g. the simulator crashed
+                result = dict(floorplan=floorplan, seed=seed, success=False)
+                result["error"] = repr(e)
+            results.append(result)
+            logging.info(
+                "{} seed {}: success {}, path length {}, {:.1f}s".format(
+                    floorplan,
+                    seed,
+                    result["success"],
+                    result.get("path_length"),
+                    result.get("time", 0),
+                )
+            )
+
+    results.sort(key=lambda x: (x["floorplan"], str(x["seed"])))
+    with open(output, "w") as f:
+        json.dump(
+            dict(
+                plan_file=plan_file,
+                nav_mode=nav_mode,
+                workers=workers,
+                total_time=perf_counter() - start,
+                success_rate=sum(x["success"] for x in results) / max(len(results), 1),
+                episodes=results,
+            ),
+            f,
+            indent=2,
+        )
+    logging.info("wrote {} episodes to {}".format(len(results), output))
+
+
+def replay_episode(plan_file: str, trace_file: str, nav_mode: str) -> dict:
+    """Runs plan_file against a recorded trace, returns where it diverged if it did"""
+    result = dict(trace=trace_file, success=False, diverged=None, error=None)
+    start = perf_counter()
+    env = None
+    try:
+        env = Env(replay=trace_file)
+        with Agent(env, nav_mode=nav_mode) as agent:
+            result["success"] = agent.run_plan(plan_file)
+        if not env.controller.finished:
+            result["diverged"] = "stopped at step {}".format(env.controller.position)
+    except ReplayDivergence as e:
+        result["diverged"] = str(e)
+    except Exception as e:
+        logging.exception("replaying {} failed".format(trace_file))
+        result["error"] = repr(e)
+    finally:
+        if env is not None:
+            env.controller.stop()
+    result["time"] = perf_counter() - start
+    return result
+
+
+def replay_batch(
+    plan_file: str,
+    traces: str = "traces/*.jsonl",
+    workers: int = 1,
+    nav_mode: str = "field",
+    output: str = "replay.json",
+    worker_log_level: str = "WARNING",
+):
+    """
+    Replays plan_file against every recorded trace matching the glob traces, without
+    a simulator, and writes which episodes diverged from their recording to output
+    """
+
+    set_logging("INFO")
+    trace_files = sorted(glob.glob(traces))
+    start = perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=set_logging,
+        initargs=(worker_log_level,),
+    ) as executor:
+        results = list(
+            executor.map(
+                replay_episode,
+                [plan_file] * len(trace_files),
+                trace_files,
+                [nav_mode] * len(trace_files),
+            )
+        )
+
+    for result in results:
+        if result["diverged"] or result["error"]:
+            logging.info(
+                "{}: {}".format(result["trace"], result["diverged"] or result["error"])
+            )
+    diverged = sum(bool(result["diverged"]) for result in results)
+    with open(output, "w") as f:
+        json.dump(
+            dict(
+                plan_file=plan_file,
+                nav_mode=nav_mode,
+                total_time=perf_counter() - start,
+                diverged=diverged,
+                episodes=results,
+            ),
+            f,
+            indent=2,
+        )
+    logging.info(
+        "{} of {} replayed episodes diverged, wrote {}".format(
+            diverged, len(results), output
+        )
+    )
+
+
+if __name__ == "__main__":
+    Fire()
@@ -0,0 +1,189 @@
+import contextlib
+import io
+import json
+from functools import partial
+from time import perf_counter
+from typing import List, Optional, Sequence
+
+from fire import Fire
+
+from interface import Env
+from main import Agent, set_logging
+from mock_controller import MockController
+from planner import NavigationPlanner
+
+TARGETS = ("Knife", "Bread", "Tomato", "Lettuce", "SinkBasin", "Plate")
+
+
+def make_env(scale: float, **kwargs) -> Env:
+    """
+    Env over a MockController with the FloorPlan3 layout stretched by scale, the scene
+    is named so that Env finds no pose file to override the stretched layout with
+    """
+    return Env(
+        floorplan="MockFloorPlan3x{}".format(scale),
+        pacing="none",
+        scene_cache=None,
+        controller_class=partial(
+            MockController, pose_file="poses/FloorPlan3.json", scale=scale
+        ),
+        **kwargs
+    )
+
+
+def count_calls(env: Env) -> int:
+    return sum(env.controller.call_counts.values())
+
+
+def print_table(rows: List[dict], columns: Sequence[str]):
+    widths = [
+        max(len(column), *(len(format_value(row[column])) for row in rows))
+        for column in columns
+    ]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print(
+            "  ".join(
+                format_value(row[column]).rjust(width)
+                for column, width in zip(columns, widths)
+            )
+        )
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return "{:.4f}".format(value)
+    return str(value)
+
+
+def measure_navigation(
+    scales: Sequence[float] = (1, 2, 4),
+    nav_modes: Sequence[str] = ("field", "hierarchical", "astar", "lrta"),
+) -> List[dict]:
+    """
+    Times a go_to_obj to each of TARGETS from the scene's start pose, for every layout
+    scale and navigation mode. Every mode gets an environment of its own, so it pays
+    for the caches it builds instead of finding them warm. Targets are the first
+    instance of their type rather than an Agent's bindings, which would compute the
+    object distances and with them the goal fields before the clock starts
+    """
+    set_logging("WARNING")
+    rows = []
+    for scale in scales:
+        for nav_mode in nav_modes:
+            env = make_env(scale)
+            for target in TARGETS:
+                env.reset()
+                object_id = env.index.by_type[target][0]["objectId"]
+                calls = count_calls(env)
+                sim_time = env.pacer.sim_time
+                start = perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with env.rendering_disabled():
+                        planner = NavigationPlanner.go_to_obj(env, object_id, nav_mode)
+                elapsed = perf_counter() - start
+                sim_time = env.pacer.sim_time - sim_time
+                rows.append(
+                    dict(
+                        scale=scale,
+                        cells=len(env.reachables),
+                        nav_mode=nav_mode,
+                        target=target,
+                        reached=planner.reached,
+                        planner_time=elapsed - sim_time,
+                        sim_time=sim_time,
+                        expansions=planner.expansions,
+                        steps=planner.steps,
+                        calls=count_calls(env) - calls,
+                    )
+                )
+    return rows
+
+
+def measure_plan(
+    plan_file: str = "plan.txt",
+    scales: Sequence[float] = (1, 2, 4),
+    nav_modes: Sequence[str] = ("field", "hierarchical", "astar", "lrta"),
+    pipeline: bool = True,
+) -> List[dict]:
+    """
+    Times a full run of plan_file for every layout scale and navigation mode, each in
+    a fresh environment like measure_navigation
+    pipeline: plan paths in the background, see Agent
+    """
+    set_logging("WARNING")
+    rows = []
+    for scale in scales:
+        for nav_mode in nav_modes:
+            env = make_env(scale)
+            env.path_length = 0
+            env.controller.call_counts.clear()
+            sim_time = env.pacer.sim_time
+            start = perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                with Agent(env, nav_mode=nav_mode, pipeline=pipeline) as agent:
+                    success = agent.run_plan(plan_file)
+            elapsed = perf_counter() - start
+            sim_time = env.pacer.sim_time - sim_time
+            rows.append(
+                dict(
+                    scale=scale,
+                    cells=len(env.reachables),
+                    nav_mode=nav_mode,
+                    success=success,
+                    python_time=elapsed - sim_time,
+                    sim_time=sim_time,
+                    expansions=agent.nav_expansions,
+                    steps=agent.nav_steps,
+                    prefetched=agent.prefetcher.hits if agent.prefetcher else 0,
+                    calls=count_calls(env),
+                    path_length=env.path_length,
+                    call_counts=dict(env.controller.call_counts),
+                )
+            )
+    return rows
+
+
+def bench_navigation(
+    scales: Sequence[float] = (1, 2, 4),
+    nav_modes: Sequence[str] = ("field", "hierarchical", "astar", "lrta"),
+    output: Optional[str] = None,
+):
+    rows = measure_navigation(scales, nav_modes)
+    print_table(rows, list(rows[0].keys()))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+def bench_plan(
+    plan_file: str = "plan.txt",
+    scales: Sequence[float] = (1, 2, 4),
+    nav_modes: Sequence[str] = ("field", "hierarchical", "astar", "lrta"),
+    output: Optional[str] = None,
+    pipeline: bool = True,
+):
+    rows = measure_plan(plan_file, scales, nav_modes, pipeline)
+    print_table(rows, [column for column in rows[0] if column != "call_counts"])
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+def bench_all(
+    plan_file: str = "plan.txt",
+    scales: Sequence[float] = (1, 2, 4),
+    output: Optional[str] = None,
+):
+    navigation = measure_navigation(scales)
+    print_table(navigation, list(navigation[0].keys()))
+    print()
+    plan = measure_plan(plan_file, scales)
+    print_table(plan, [column for column in plan[0] if column != "call_counts"])
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(dict(navigation=navigation, plan=plan), f, indent=2)
+
+
+if __name__ == "__main__":
+    Fire()
@@ -0,0 +1,129 @@
+import heapq
+import logging
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from grid import ReachableGrid
+
+# size of the coarse cells navigation plans over before refining
+COARSE_CELL_SIZE = 0.25
+
+
+class CoarseGrid:
+    """
+    Abstraction of a ReachableGrid into coarse cells of `cell_size`, for planning long
+    range moves before refining them on the fine grid
+
+    Every coarse cell is split into nodes, the connected components of the reachable
+    positions inside of it, so a wall or counter through a cell never joins the
+    positions on both sides. Two nodes are connected when a move of the fine grid
+    crosses from one into the other; the fine positions on either side of such moves
+    are the portals between them. Edges cost the distance between the node centroids.
+
+    node_of: (N,) node of every reachable position
+    centroids: (M, 2) mean position of the reachable positions of every node
+    edges: node -> list of (neighbouring node, cost)
+    portals: (P, 2) reachable index pairs of the fine moves between nodes
+    """
+
+    def __init__(self, grid: ReachableGrid, cell_size: float = COARSE_CELL_SIZE):
+        start = perf_counter()
+        self.grid = grid
+        self.fingerprint = grid.fingerprint
+        self.factor = max(1, int(round(cell_size / grid.step_size)))
+        blocks = grid.cells // self.factor
+        block_ids = blocks[:, 0] * (int(blocks[:, 1].max(initial=0)) + 1) + blocks[:, 1]
+
+        # label every position with the smallest index of its component in its cell
+        neighbors = grid.neighbors
+        inner = (neighbors >= 0) & (
+            block_ids[np.maximum(neighbors, 0)] == block_ids[:, None]
+        )
+        labels = np.arange(len(grid))
+        while True:
+            succ_labels = np.where(inner, labels[np.maximum(neighbors, 0)], len(grid))
+            updated = np.minimum(labels, succ_labels.min(axis=1, initial=len(grid)))
+            # jump to the label of the label, merging long components faster
+            updated = updated[updated]
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+        _, self.node_of = np.unique(labels, return_inverse=True)
+        self.node_of = self.node_of.reshape(-1)
+        n_nodes = int(self.node_of.max(initial=-1)) + 1
+        sizes = np.bincount(self.node_of, minlength=n_nodes)
+        self.centroids = np.stack(
+            [
+                np.bincount(self.node_of, grid.positions[:, axis], n_nodes) / sizes
+                for axis in range(2)
+            ],
+            axis=1,
+        ).reshape(-1, 2)
+
+        sources, directions = np.nonzero((neighbors >= 0) & ~inner)
+        self.portals = np.stack([sources, neighbors[sources, directions]], axis=1)
+        # unique node pairs, encoded as single integers to sort them fast
+        pairs = self.node_of[self.portals]
+        pairs = np.unique(pairs[:, 0] * n_nodes + pairs[:, 1])
+        pairs = np.stack(np.divmod(pairs, n_nodes), axis=1)
+        costs = np.hypot(*(self.centroids[pairs[:, 0]] - self.centroids[pairs[:, 1]]).T)
+        self.edges: List[List[Tuple[int, float]]] = [[] for _ in range(n_nodes)]
+        for (a, b), cost in zip(pairs.tolist(), costs.tolist()):
+            self.edges[a].append((b, cost))
+        logging.info(
+            "built {} coarse nodes with {} edges over {} positions in {:.3f}s".format(
+                n_nodes, len(pairs), len(grid), perf_counter() - start
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    def search(
+        self, start: int, in_goal: np.ndarray, heuristics: np.ndarray
+    ) -> Tuple[Optional[List[int]], int]:
+        """
+        A* over the nodes, from the node of the reachable index start to the closest
+        node holding a position of the boolean mask in_goal. heuristics estimates the
+        distance from every node to the goal. Returns the path as a list of nodes and
+        the number of expansions, the path is None if the goal is unreachable
+        """
+        goal_nodes = set(np.unique(self.node_of[in_goal]).tolist())
+        heuristics = heuristics.tolist()
+        start = int(self.node_of[start])
+        g_values = {start: 0.0}
+        parents = {start: None}
+        closed = set()
+        frontier = [(heuristics[start], start)]
+        while frontier:
+            _, node = heapq.heappop(frontier)
+            if node in closed:
+                continue
+            closed.add(node)
+            if node in goal_nodes:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path[::-1], len(closed)
+            for succ, cost in self.edges[node]:
+                if succ in closed:
+                    continue
+                g_value = g_values[node] + cost
+                if g_value < g_values.get(succ, np.inf):
+                    g_values[succ] = g_value
+                    parents[succ] = node
+                    heapq.heappush(frontier, (g_value + heuristics[succ], succ))
+        return None, len(closed)
+
+    def corridor(self, path: List[int]) -> np.ndarray:
+        """
+        Boolean mask of the reachable positions in the nodes of path and the nodes
+        next to them, the room a fine path along the coarse one is refined in
+        """
+        nodes = set(path)
+        for node in path:
+            nodes.update(succ for succ, _ in self.edges[node])
+        return np.isin(self.node_of, list(nodes))
@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import OrderedDict
+from time import perf_counter
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+from grid import ReachableGrid
+from utils import ObjectIndex
+
+# navigation to an object stops within this distance of it
+APPROACH_RADIUS = 0.9
+
+
+def is_relevant(obj_info: dict) -> bool:
+    """Objects the agent may have to go to, the ones it can pick up or put onto"""
+    return bool(obj_info.get("pickupable") or obj_info.get("receptacle"))
+
+
+def field_key(grid: ReachableGrid, x: float, z: float, radius: float) -> tuple:
+    """FieldCache key of the distance field to the positions within radius of (x, z)"""
+    return (grid.fingerprint, round(x, 3), round(z, 3), radius)
+
+
+class ObjectDistances:
+    """
+    Shortest path distances over the reachable grid to the approach regions of the
+    objects of a scene, the reachable positions within APPROACH_RADIUS of an object
+
+    fields: (N, K) distance from every reachable position to the region of each of
+        the K objects
+    matrix: (K, K) distance from the closest position of the region of one object to
+        the region of another, 0 if they overlap
+    """
+
+    def __init__(self, object_ids: List[str], fields: np.ndarray, matrix: np.ndarray):
+        self.object_ids = object_ids
+        self.columns = {object_id: i for i, object_id in enumerate(object_ids)}
+        self.fields = fields
+        self.matrix = matrix
+
+    @classmethod
+    def compute(
+        cls,
+        grid: ReachableGrid,
+        index: ObjectIndex,
+        radius: float = APPROACH_RADIUS,
+    ) -> "ObjectDistances":
+        """Computes the distances to the relevant objects of index in one pass"""
+        start = perf_counter()
+        object_ids = [
+            object_id
+            for object_id, obj_info in index.by_id.items()
+            if is_relevant(obj_info)
+        ]
+        regions = []
+        for object_id in object_ids:
+            center = index.by_id[object_id]["axisAlignedBoundingBox"]["center"]
+            regions.append(grid.within(center["x"], center["z"], radius))
+
+        fields = grid.multi_source_distances(regions)
+        matrix = np.full((len(regions), len(regions)), np.inf)
+        for i, region in enumerate(regions):
+            if len(region) > 0:
+                matrix[i] = fields[region].min(axis=0)
+        logging.info(
+            "computed distances to {} objects over {} positions in {:.2f}s".format(
+                len(object_ids), len(grid), perf_counter() - start
+            )
+        )
+        return cls(object_ids, fields.astype(np.float32), matrix)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return dict(
+            object_ids=np.array(self.object_ids, dtype=str),
+            fields=self.fields,
+            matrix=self.matrix,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "ObjectDistances":
+        return cls(arrays["object_ids"].tolist(), arrays["fields"], arrays["matrix"])
+
+    def __contains__(self, object_id: str) -> bool:
+        return object_id in self.columns
+
+    def between(self, source_id: str, target_id: str) -> float:
+        """Travel from the region of source_id to the region of target_id"""
+        return float(self.matrix[self.columns[source_id], self.columns[target_id]])
+
+    def from_position(self, idx: int, target_id: str) -> float:
+        """Travel from the reachable position idx to the region of target_id"""
+        return float(self.fields[idx, self.columns[target_id]])
+
+    def nearest(self, idx: int, object_ids: Iterable[str]) -> Optional[str]:
+        """
+        Returns the object of object_ids with the shortest travel from the reachable
+        position idx, None if none of them is known
+        """
+        known = [object_id for object_id in object_ids if object_id in self.columns]
+        if len(known) == 0:
+            return None
+        # ties go to the last one, as metadata order did before
+        return min(
+            reversed(known), key=lambda object_id: self.from_position(idx, object_id)
+        )
+
+
+class FieldCache:
+    """
+    LRU cache of distance fields, dense arrays over the reachable positions, bounded
+    by the total size of the cached arrays
+
+    Keys should include ReachableGrid.fingerprint, so fields of a reachable set that
+    changed are never hit again and age out. Safe to share with a PathPrefetcher
+    thread.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.fields: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self.lock:
+            field = self.fields.get(key)
+            if field is None:
+                self.misses += 1
+                return None
+            self.fields.move_to_end(key)
+            self.hits += 1
+            return field
+
+    def put(self, key: Hashable, field: np.ndarray):
+        with self.lock:
+            if key in self.fields:
+                self.nbytes -= self.fields.pop(key).nbytes
+            if field.nbytes > self.max_bytes:
+                return
+            self.fields[key] = field
+            self.nbytes += field.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.fields.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.fields.clear()
+            self.nbytes = 0
@@ -0,0 +1,176 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+try:
+    from ai2thor.server import Event
+except ImportError:
+    # ai2thor is only needed to talk to the simulator, see MockController
+    Event = Any
+
+# how much of every event Env keeps, see LeanEvent
+RETENTION_POLICIES = ("full", "lean", "metadata")
+
+# the object metadata the agent, planners and scene snapshots read
+OBJECT_KEYS = (
+    "objectId",
+    "name",
+    "objectType",
+    "assetId",
+    "position",
+    "rotation",
+    "axisAlignedBoundingBox",
+    "visible",
+    "pickupable",
+    "moveable",
+    "receptacle",
+    "sliceable",
+    "isSliced",
+    "parentReceptacles",
+)
+
+
+class AgentPose(NamedTuple):
+    position: dict
+    rotation: dict
+    horizon: float
+
+
+class LeanEvent:
+    """
+    Compact stand-in for ai2thor.server.Event, keeping only the metadata the agent
+    reads and, unless dropped, the instance segmentation frame as a label image
+
+    The RGB frame, depth, class frames and per object instance masks of the
+    original event are not kept. Every pixel of labels indexes colors, the
+    segmentation colors present in the frame, so it takes one or two bytes instead
+    of three. instance_segmentation_frame and instance_masks are materialized from
+    it on access. metadata has the layout of the original event's, so code reading
+    it works with either kind of event.
+    """
+
+    # RGB frames are never kept, see has_frames
+    frame = None
+
+    def __init__(
+        self,
+        metadata: dict,
+        labels: Optional[np.ndarray] = None,
+        colors: Optional[np.ndarray] = None,
+        color_to_object_id: Optional[dict] = None,
+    ):
+        """
+        labels: (H, W) index into colors of every pixel of the segmentation frame
+        colors: (K, 3) RGB segmentation colors
+        color_to_object_id: object ids of the colors that are object instances
+        """
+        self.metadata = metadata
+        self.labels = labels
+        self.colors = colors
+        self.color_to_object_id = (
+            color_to_object_id if color_to_object_id is not None else {}
+        )
+        self._instance_masks: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def from_event(cls, event: Event, keep_frames: bool = True) -> "LeanEvent":
+        metadata = event.metadata
+        agent = metadata["agent"]
+        lean_metadata = dict(
+            lastActionSuccess=metadata["lastActionSuccess"],
+            errorMessage=metadata.get("errorMessage", ""),
+            actionReturn=metadata.get("actionReturn"),
+            agent=dict(
+                position=agent["position"],
+                rotation=agent["rotation"],
+                cameraHorizon=agent["cameraHorizon"],
+            ),
+            objects=[
+                {key: obj_info[key] for key in OBJECT_KEYS if key in obj_info}
+                for obj_info in metadata["objects"]
+            ],
+            inventoryObjects=[
+                dict(objectId=obj_info["objectId"])
+                for obj_info in metadata["inventoryObjects"]
+            ],
+        )
+        segmentation = getattr(event, "instance_segmentation_frame", None)
+        if not keep_frames or segmentation is None:
+            return cls(lean_metadata)
+        labels, colors = encode_segmentation(segmentation)
+        color_to_object_id = getattr(event, "color_to_object_id", None) or {}
+        present = {}
+        for color in map(tuple, colors.tolist()):
+            if color in color_to_object_id:
+                present[color] = color_to_object_id[color]
+        return cls(lean_metadata, labels, colors, present)
+
+    @property
+    def success(self) -> bool:
+        return self.metadata["lastActionSuccess"]
+
+    @property
+    def agent(self) -> AgentPose:
+        agent = self.metadata["agent"]
+        return AgentPose(agent["position"], agent["rotation"], agent["cameraHorizon"])
+
+    @property
+    def objects(self) -> List[dict]:
+        return self.metadata["objects"]
+
+    @property
+    def inventory(self) -> List[str]:
+        """Ids of the held objects"""
+        return [obj_info["objectId"] for obj_info in self.metadata["inventoryObjects"]]
+
+    @property
+    def has_frames(self) -> bool:
+        return self.labels is not None
+
+    @property
+    def instance_segmentation_frame(self) -> Optional[np.ndarray]:
+        """(H, W, 3) segmentation frame, decoded from labels on every access"""
+        if self.labels is None:
+            return None
+        return self.colors[self.labels]
+
+    @property
+    def instance_masks(self) -> Dict[str, np.ndarray]:
+        """Boolean mask of every object in the segmentation frame, built on access"""
+        if self._instance_masks is None:
+            self._instance_masks = {}
+            if self.labels is not None:
+                for label, color in enumerate(map(tuple, self.colors.tolist())):
+                    object_id = self.color_to_object_id.get(color)
+                    if object_id is not None:
+                        self._instance_masks[object_id] = self.labels == label
+        return self._instance_masks
+
+    def get_object(self, object_id: str) -> Optional[dict]:
+        for obj_info in self.metadata["objects"]:
+            if obj_info["objectId"] == object_id:
+                return obj_info
+        return None
+
+
+def encode_segmentation(segmentation: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits an (H, W, 3) segmentation frame into an (H, W) label image and the (K, 3)
+    colors its labels index, in one pass over the pixels
+    """
+    pixels = segmentation.astype(np.int32)
+    codes = pixels[..., 0] << 16 | pixels[..., 1] << 8 | pixels[..., 2]
+    codes, labels = np.unique(codes, return_inverse=True)
+    dtype = np.uint8 if len(codes) <= 256 else np.uint16
+    colors = np.stack([codes >> 16, codes >> 8 & 255, codes & 255], axis=1)
+    return (
+        labels.reshape(segmentation.shape[:2]).astype(dtype),
+        colors.astype(np.uint8),
+    )
+
+
+def has_frames(event: Event) -> bool:
+    """Checks if event carries the frames of the step it resulted from"""
+    if isinstance(event, LeanEvent):
+        return event.has_frames
+    return getattr(event, "frame", None) is not None
@@ -0,0 +1,329 @@
+import hashlib
+from typing import Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import NavigationState, quantize
+
+# 8-connected neighbourhood, axis aligned moves first
+OFFSETS = np.array(
+    [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+)
+
+
+class ReachableGrid:
+    """
+    Quantized occupancy grid over the reachable positions of a scene
+
+    Every reachable position is snapped to an integer cell of size `step_size`, the
+    occupancy grid stores the index of the reachable position in each cell (or -1),
+    which doubles as a bucket index for nearest neighbour queries
+    """
+
+    _fingerprint: Optional[str] = None
+
+    def __init__(self, reachables: List[dict], step_size: float = 0.05):
+
+        self.reachables = reachables
+        self.step_size = step_size
+        self.positions = np.array(
+            [(pos["x"], pos["z"]) for pos in reachables], dtype=np.float64
+        ).reshape(-1, 2)
+
+        cells = np.rint(self.positions / step_size).astype(np.int64)
+        if len(cells) > 0:
+            self.origin = cells.min(axis=0)
+            shape = tuple(cells.max(axis=0) - self.origin + 1)
+        else:
+            self.origin = np.zeros(2, dtype=np.int64)
+            shape = (0, 0)
+        self.cells = cells - self.origin
+        self.index = np.full(shape, -1, dtype=np.int64)
+        self.index[self.cells[:, 0], self.cells[:, 1]] = np.arange(len(cells))
+        self._neighbors = None
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Returns the arrays the grid is made of, see from_arrays"""
+        return dict(
+            step_size=np.array(self.step_size),
+            heights=np.array([pos["y"] for pos in self.reachables]),
+            positions=self.positions,
+            origin=self.origin,
+            cells=self.cells,
+            index=self.index,
+            neighbors=self.neighbors,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "ReachableGrid":
+        """Restores a grid from to_arrays without requantizing the positions"""
+        grid = cls.__new__(cls)
+        grid.step_size = float(arrays["step_size"])
+        grid.positions = arrays["positions"]
+        grid.reachables = [
+            dict(x=x, y=y, z=z)
+            for (x, z), y in zip(grid.positions.tolist(), arrays["heights"].tolist())
+        ]
+        grid.origin = arrays["origin"]
+        grid.cells = arrays["cells"]
+        grid.index = arrays["index"]
+        grid._neighbors = arrays["neighbors"]
+        return grid
+
+    def __len__(self) -> int:
+        return len(self.reachables)
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the reachable positions, changes whenever the reachable set does"""
+        if self._fingerprint is None:
+            positions = np.ascontiguousarray(self.positions, dtype=np.float64)
+            self._fingerprint = hashlib.sha1(positions.tobytes()).hexdigest()[:16]
+        return self._fingerprint
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.index.shape
+
+    @property
+    def occupancy(self) -> np.ndarray:
+        """Boolean occupancy grid, True for reachable cells"""
+        return self.index >= 0
+
+    @property
+    def neighbors(self) -> np.ndarray:
+        """
+        (N, 8) array of the reachable index of each neighbour in OFFSETS order, -1 if
+        unreachable. Diagonal moves are only allowed if both axis aligned moves are,
+        so paths never cut corners of obstacles
+        """
+        if self._neighbors is None:
+            padded = np.pad(self.index, 1, constant_values=-1)
+            rows = self.cells[:, 0] + 1
+            cols = self.cells[:, 1] + 1
+            neighbors = np.stack(
+                [padded[rows + di, cols + dj] for di, dj in OFFSETS], axis=1
+            )
+            for d in range(4, 8):
+                di, dj = OFFSETS[d]
+                straight_i = neighbors[:, 0 if di > 0 else 2]
+                straight_j = neighbors[:, 1 if dj > 0 else 3]
+                neighbors[(straight_i < 0) | (straight_j < 0), d] = -1
+            self._neighbors = neighbors
+        return self._neighbors
+
+    @property
+    def step_costs(self) -> np.ndarray:
+        """Length of a move along each of OFFSETS"""
+        return np.hypot(OFFSETS[:, 0], OFFSETS[:, 1]) * self.step_size
+
+    def within(self, x: float, z: float, radius: float) -> np.ndarray:
+        """Returns the indices of the reachable positions within radius of (x, z)"""
+        dists = np.hypot(self.positions[:, 0] - x, self.positions[:, 1] - z)
+        return np.nonzero(dists < radius)[0]
+
+    def distances(self, sources: Iterable[int]) -> np.ndarray:
+        """
+        Shortest path length along the 8-connected graph from the closest of sources
+        to every reachable position, inf where unreachable
+        """
+        return self.multi_source_distances([np.fromiter(sources, dtype=np.int64)])[:, 0]
+
+    def multi_source_distances(self, regions: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        (N, K) shortest path lengths along the 8-connected graph from every reachable
+        position to the closest position of each of K regions, inf where unreachable
+
+        All regions are expanded together in one vectorized pass of Dijkstra with
+        buckets as wide as the shortest move: every round settles the pending
+        (position, region) entries within step_size of the smallest pending distance,
+        which no other entry can still improve, and relaxes them at once. A move along
+        a fixed offset maps distinct entries to distinct entries, so each offset is a
+        plain vectorized minimum.
+        """
+        n, k = len(self.reachables), len(regions)
+        neighbors = self.neighbors
+        step_costs = self.step_costs
+        dists = np.full(n * k, np.inf)
+        # flat indices into dists, node * k + region
+        pending = [np.zeros(0, dtype=np.int64)]
+        for i, region in enumerate(regions):
+            pending.append(np.asarray(region, dtype=np.int64) * k + i)
+        pending = np.unique(np.concatenate(pending))
+        dists[pending] = 0.0
+        while len(pending) > 0:
+            values = dists[pending]
+            ready = values < values.min() + self.step_size
+            settled, pending = pending[ready], pending[~ready]
+            nodes, labels = np.divmod(settled, k)
+            improved = [pending]
+            for d, cost in enumerate(step_costs):
+                succ = neighbors[nodes, d]
+                valid = succ >= 0
+                targets = succ[valid] * k + labels[valid]
+                candidates = dists[settled[valid]] + cost
+                better = candidates < dists[targets]
+                dists[targets[better]] = candidates[better]
+                improved.append(targets[better])
+            pending = np.unique(np.concatenate(improved))
+        return dists.reshape(n, k)
+
+    def descend(
+        self, start: int, field: np.ndarray, blocked: Collection[int] = ()
+    ) -> Optional[List[int]]:
+        """
+        Follows the gradient of a distance field from the reachable index start down
+        to a position where it is 0, moving to the neighbour that lies on a shortest
+        path. Returns the path including start, or None if it runs into blocked
+        positions or the field is inf at start
+        """
+        neighbors = self.neighbors
+        step_costs = self.step_costs
+        if not np.isfinite(field[start]):
+            return None
+        path = [start]
+        idx = start
+        while field[idx] > 0:
+            succs = neighbors[idx]
+            values = np.where(succs >= 0, field[succs] + step_costs, np.inf)
+            for d in np.argsort(values, kind="stable"):
+                succ = int(succs[d])
+                if not np.isfinite(values[d]) or field[succ] >= field[idx]:
+                    return None
+                if succ not in blocked:
+                    break
+            else:
+                return None
+            path.append(succ)
+            idx = succ
+        return path
+
+    def turning_points(self, path: List[int]) -> List[int]:
+        """Drops the cells of a path that lie on a straight run between two others"""
+        if len(path) < 3:
+            return list(path)
+        offsets = np.diff(self.cells[path], axis=0)
+        turns = np.any(offsets[1:] != offsets[:-1], axis=1).nonzero()[0] + 1
+        return [path[0]] + [path[i] for i in turns] + [path[-1]]
+
+    def line_of_sight(self, a: int, b: int) -> bool:
+        """
+        Checks if the straight segment between the reachable positions a and b only
+        crosses reachable cells, without cutting the corners of unreachable ones
+        """
+        start, end = self.cells[a], self.cells[b]
+        # samples at most half a cell apart on either axis, so consecutive samples
+        # are in the same or adjacent cells
+        n = 2 * int(np.abs(end - start).max()) + 1
+        cells = np.rint(start + np.outer(np.linspace(0, 1, n), end - start))
+        cells = cells.astype(np.int64)
+        if np.any(self.index[cells[:, 0], cells[:, 1]] < 0):
+            return False
+        # like diagonal moves, crossing diagonally needs both cells beside it
+        diagonal = np.all(cells[1:] != cells[:-1], axis=1)
+        before, after = cells[:-1][diagonal], cells[1:][diagonal]
+        return bool(
+            np.all(self.index[before[:, 0], after[:, 1]] >= 0)
+            and np.all(self.index[after[:, 0], before[:, 1]] >= 0)
+        )
+
+    def shortcut(self, path: List[int]) -> List[int]:
+        """
+        Pulls a path taut: drops every position that the last one kept sees the next
+        one past, so the path becomes the few straight segments between the corners
+        it has to go around
+        """
+        # the corners are among the turning points, checking the positions of the
+        # straight runs between them as well barely ever drops one more
+        path = self.turning_points(path)
+        if len(path) < 3:
+            return path
+        corners = [path[0]]
+        for prev, idx in zip(path[1:-1], path[2:]):
+            if not self.line_of_sight(corners[-1], idx):
+                corners.append(prev)
+        corners.append(path[-1])
+        return corners
+
+    def to_cell(self, x: float, z: float) -> Tuple[int, int]:
+        """Returns the (possibly out of bounds) grid cell containing (x, z)"""
+        return (
+            quantize(x, self.step_size) - int(self.origin[0]),
+            quantize(z, self.step_size) - int(self.origin[1]),
+        )
+
+    def lookup_cell(self, i: int, j: int) -> int:
+        """
+        Returns the index of the reachable position in the global integer cell (i, j),
+        as used by NavigationState, or -1
+        """
+        i -= int(self.origin[0])
+        j -= int(self.origin[1])
+        if 0 <= i < self.index.shape[0] and 0 <= j < self.index.shape[1]:
+            return int(self.index[i, j])
+        return -1
+
+    def lookup(self, x: float, z: float) -> int:
+        """Returns the index of the reachable position in the cell of (x, z), or -1"""
+        return self.lookup_cell(
+            quantize(x, self.step_size), quantize(z, self.step_size)
+        )
+
+    def index_of(self, state: NavigationState) -> int:
+        """Returns the reachable index of the cell of state, or -1"""
+        return self.lookup_cell(state.i, state.j)
+
+    def contains(self, x: float, z: float, tol: float = 0.005) -> bool:
+        """Checks if (x, z) is a reachable position, up to `tol` on each axis"""
+        idx = self.lookup(x, z)
+        if idx < 0:
+            return False
+        return bool(np.all(np.abs(self.positions[idx] - (x, z)) <= tol))
+
+    def nearest(self, x: float, z: float) -> int:
+        """Returns the index of the reachable position closest to (x, z)"""
+        idx = self.lookup(x, z)
+        if idx < 0:
+            indices, _ = self.k_nearest(x, z, 1)
+            idx = int(indices[0]) if len(indices) > 0 else -1
+        return idx
+
+    def k_nearest(self, x: float, z: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the indices of the k reachable positions closest to (x, z) and their
+        distances, sorted by distance (ties broken by reachable order)
+
+        Only the buckets of a square window around (x, z) are scanned, the window is
+        grown until the k-th distance is guaranteed to lie inside of it
+        """
+        n = len(self.reachables)
+        k = min(k, n)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        ci, cj = self.to_cell(x, z)
+        rows, cols = self.index.shape
+        radius = max(1, int(np.ceil(np.sqrt(k) / 2)) + 1)
+        while True:
+            window = self.index[
+                max(ci - radius, 0) : max(ci + radius + 1, 0),
+                max(cj - radius, 0) : max(cj + radius + 1, 0),
+            ]
+            candidates = window[window >= 0]
+            covers_all = (
+                ci - radius <= 0
+                and cj - radius <= 0
+                and ci + radius >= rows - 1
+                and cj + radius >= cols - 1
+            )
+            if len(candidates) >= k or covers_all:
+                candidates = np.sort(candidates)
+                dists = np.hypot(
+                    self.positions[candidates, 0] - x,
+                    self.positions[candidates, 1] - z,
+                )
+                order = np.argsort(dists, kind="stable")[:k]
+                # the window is only exhaustive within its inscribed circle
+                if covers_all or dists[order[-1]] <= (radius - 0.5) * self.step_size:
+                    return candidates[order], dists[order]
+            radius *= 2
@@ -0,0 +1,118 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from distances import APPROACH_RADIUS, is_relevant
+from grid import ReachableGrid
+from utils import ObjectIndex, Pos2D
+
+# height of the camera above the agent position
+CAMERA_HEIGHT = 0.675
+# camera horizon limits of the simulator, positive is looking down
+MIN_HORIZON = -30.0
+MAX_HORIZON = 60.0
+
+
+class InteractionPose(NamedTuple):
+    """Agent pose to pick up, cut or put onto an object from"""
+
+    idx: int
+    position: dict
+    yaw: float
+    horizon: float
+
+    def teleport(self) -> dict:
+        """The single action that puts the agent into the pose"""
+        return dict(
+            action="Teleport",
+            position=self.position,
+            rotation=dict(x=0, y=self.yaw, z=0),
+            horizon=self.horizon,
+        )
+
+
+class InteractionRegion(NamedTuple):
+    """
+    The reachable positions within the approach radius of an object from which the
+    camera can face it within the horizon limits, with the yaw and horizon to do so
+    """
+
+    center: Pos2D
+    indices: np.ndarray
+    yaws: np.ndarray
+    horizons: np.ndarray
+
+    def pose(self, grid: ReachableGrid, idx: int) -> Optional[InteractionPose]:
+        """Returns the pose at the reachable index idx, None if it is not in region"""
+        found = np.nonzero(self.indices == idx)[0]
+        if len(found) == 0:
+            return None
+        i = int(found[0])
+        return InteractionPose(
+            idx=idx,
+            position=dict(grid.reachables[idx]),
+            yaw=float(self.yaws[i]),
+            horizon=float(self.horizons[i]),
+        )
+
+
+def get_interaction_region(
+    grid: ReachableGrid, obj_info: dict, radius: float = APPROACH_RADIUS
+) -> Optional[InteractionRegion]:
+    """
+    Computes the interaction region of an object, the yaw and horizon of each pose
+    are the ones handle_look_at would turn to. None if the region is empty
+    """
+    center = obj_info["axisAlignedBoundingBox"]["center"]
+    target = obj_info["position"]
+    candidates = grid.within(center["x"], center["z"], radius)
+
+    heights = np.array([grid.reachables[i]["y"] for i in candidates])
+    dx = target["x"] - grid.positions[candidates, 0]
+    dz = target["z"] - grid.positions[candidates, 1]
+    dy = target["y"] - heights - CAMERA_HEIGHT
+    dists = np.hypot(dx, dz)
+    horizons = np.degrees(np.arctan2(-dy, dists))
+    valid = (horizons >= MIN_HORIZON) & (horizons <= MAX_HORIZON) & (dists > 0)
+    if not valid.any():
+        return None
+
+    return InteractionRegion(
+        center=Pos2D(center["x"], center["z"]),
+        indices=candidates[valid],
+        yaws=np.degrees(np.arctan2(dx[valid], dz[valid])) % 360,
+        horizons=horizons[valid],
+    )
+
+
+class InteractionPoses:
+    """
+    Table of the interaction regions of the objects the agent may have to go to,
+    computed on first use and recomputed for objects that moved since
+    """
+
+    def __init__(self, grid: ReachableGrid, radius: float = APPROACH_RADIUS):
+        self.grid = grid
+        self.radius = radius
+        # object id -> (object pose the region was computed for, region)
+        self.regions: Dict[str, Tuple[tuple, Optional[InteractionRegion]]] = {}
+
+    def update(self, index: ObjectIndex):
+        """Computes the regions of all relevant objects of index that are outdated"""
+        for object_id, obj_info in index.by_id.items():
+            if is_relevant(obj_info):
+                self.get(index, object_id)
+
+    def get(self, index: ObjectIndex, object_id: str) -> Optional[InteractionRegion]:
+        obj_info = index.get(object_id)
+        if obj_info is None:
+            return None
+        key = tuple(obj_info["position"].values()) + tuple(
+            obj_info["axisAlignedBoundingBox"]["center"].values()
+        )
+        cached = self.regions.get(object_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        region = get_interaction_region(self.grid, obj_info, self.radius)
+        self.regions[object_id] = (key, region)
+        return region
@@ -1,23 +1,90 @@
-import json
 import logging
-import os
+import math
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from functools import partial
 from pprint import pformat
-from time import sleep
-from typing import List
+from time import perf_counter
+from typing import Any, Callable, Generator, Iterator, List, NamedTuple, Optional
 
-from ai2thor import controller
-from ai2thor.server import Event
+try:
+    from ai2thor.controller import Controller
+except ImportError:
+    # without the simulator, Env only runs on stand-ins such as MockController
+    Controller = None
 
-from utils import Action
+from coarse import CoarseGrid
+from distances import APPROACH_RADIUS, FieldCache, ObjectDistances, field_key
+from events import RETENTION_POLICIES, Event, LeanEvent, has_frames
+from grid import ReachableGrid
+from interaction import InteractionPoses
+from metrics import Metrics
+from pacing import Pacer
+from scene_cache import SceneCache, SceneData, load_poses
+from traces import RecordingController, ReplayController, get_scene
+from utils import Action, FrameAnalysis, ObjectIndex
 
 # from utils_initial import Action
 
+# restore moves up to this many objects back one by one, more all at once
+MAX_OBJECT_TELEPORTS = 3
+# how far a position (m) and a rotation (degrees) may be off to count as restored
+POSITION_TOLERANCE = 0.001
+ROTATION_TOLERANCE = 0.1
+
+# generator of api actions that is sent the resulting events, see Env.run
+Steps = Generator[dict, Event, Any]
+
+
+class Compute(NamedTuple):
+    """
+    Blocking work such as planning that steps yield instead of an api action and are
+    sent the result of. Env.run calls func, AsyncEnv.run calls it in its executor so
+    it doesn't hold up the event loop. Steps can also yield a concurrent Future, and
+    are sent it back once it is done
+    """
+
+    func: Callable[[], Any]
+
+
+def same_pose(obj_info: dict, pose: dict) -> bool:
+    """Whether the position and rotation of obj_info are the ones of pose"""
+    for axis in "xyz":
+        offset = obj_info["position"][axis] - pose["position"][axis]
+        if abs(offset) > POSITION_TOLERANCE:
+            return False
+        delta = abs(obj_info["rotation"][axis] - pose["rotation"][axis]) % 360
+        if min(delta, 360 - delta) > ROTATION_TOLERANCE:
+            return False
+    return True
+
+
+class SceneSnapshot(NamedTuple):
+    object_poses: List[dict]
+    object_ids: frozenset
+    agent_position: dict
+    agent_rotation: dict
+    agent_horizon: float
+    held_object: Optional[str]
+
 
 class Env:
-    controller: controller.Controller
+    controller: Any
     event: Event
     interval: float = 0.15
     reachables: list
+    grid: ReachableGrid
+    _index: ObjectIndex = None
+    _object_distances: Optional[ObjectDistances] = None
+    _interaction_poses: Optional[InteractionPoses] = None
+    _coarse_grid: Optional[CoarseGrid] = None
+    # whether steps render frames, and whether the current event has frames
+    rendering: bool = True
+    rendered: bool = True
+    # downsampling of the analysis the next step is rendered for, see analysis_steps
+    _analysis_requested: Optional[int] = None
+    # analysis of the current event's frame, see analyze_frame
+    _frame_analysis: Optional[FrameAnalysis] = None
 
     def __init__(
         self,
@@ -25,13 +92,64 @@ class Env:
         height: int = 600,
         log_file: str = "log",
         floorplan: str = "FloorPlan3",
+        pacing: str = "fixed",
+        fine_grained: bool = False,
+        scene_cache: Optional[str] = ".scene_cache",
+        controller_class: Optional[Callable[..., Any]] = None,
+        retention: str = "full",
+        record: Optional[str] = None,
+        replay: Optional[str] = None,
     ):
+        """
+        fine_grained: send rotations in Action.rotate_angle steps and every logical
+            action separately, e.g. for recording, instead of coalescing them
+        scene_cache: directory of the scene cache, None to always query the simulator
+        controller_class: stand-in for ai2thor's Controller, e.g. MockController.
+            Its scenes differ from the simulator's, so it never uses the scene cache
+        retention: how much of every event to keep as the current event, one of
+            full: the event as it is
+            lean: a LeanEvent with the metadata the agent reads and the
+                segmentation frame as a label image, without the RGB frame
+            metadata: a LeanEvent without frames, analyze_frame renders the scene
+                again and keeps only the analysis of its frames
+        record: trace file to record every controller step into, see traces
+        replay: trace file to serve the controller steps from instead of a
+            simulator, in its recorded floorplan and without pacing. Recording and
+            replaying bypass the scene cache, so traces hold every step
+        """
 
+        if retention not in RETENTION_POLICIES:
+            raise ValueError(
+                "unknown retention policy {}, expected one of {}".format(
+                    retention, RETENTION_POLICIES
+                )
+            )
+        self.retention = retention
+        if replay is not None:
+            controller_class = partial(ReplayController, replay)
+            floorplan = get_scene(replay)
+            pacing = "none"
+        if controller_class is not None or record is not None or replay is not None:
+            scene_cache = None
         self.floorplan = floorplan
         self.width = width
         self.height = height
+        self.pacer = Pacer(pacing, self.interval)
+        self.metrics = Metrics()
+        # distance fields of navigation goals, keyed by grid fingerprint and goal
+        self.goal_fields = FieldCache()
+        self.fine_grained = fine_grained
+        self.scene_cache = SceneCache(scene_cache) if scene_cache is not None else None
 
-        self.controller = controller.Controller(
+        if controller_class is None:
+            if Controller is None:
+                raise ImportError(
+                    "ai2thor is not installed, pass a controller_class or a replay"
+                )
+            controller_class = Controller
+        if record is not None:
+            controller_class = partial(RecordingController, controller_class, record)
+        self.controller = controller_class(
             scene=floorplan,
             width=width,
             height=height,
@@ -41,23 +159,25 @@ class Env:
             renderInstanceSegmentation=True,
         )
 
-        if os.path.isfile("poses/{}.json".format(floorplan)):
-            self.event = self.controller.step(
-                action="SetObjectPoses",
-                objectPoses=json.load(open("poses/{}.json".format(floorplan))),
-            )
-
-        self.reachables = self.controller.step(action="GetReachablePositions").metadata[
-            "actionReturn"
-        ]
-
-        self.event = self.controller.step(action="Done")
+        self.setup_scene()
+        self.initial_snapshot = self.snapshot()
         self.path_length = 0
         logging.info("environment started")
         logging.debug("all objects: \n {}".format(pformat(self.objects, indent=2)))
 
-    def reset(self):
-        self.controller.reset(
+    def reset(self, full: bool = False):
+        """
+        Puts the scene back into its initial state, by restoring the snapshot taken
+        after setup. If the scene changed structurally, e.g. by slicing, it is
+        reloaded and the snapshot restored onto it, as the reachable positions and
+        the caches built on them still hold. Unless full is set, then the scene is
+        set up from scratch
+        """
+        if not full and self.restore(self.initial_snapshot):
+            logging.info("environment restored")
+            return
+
+        event = self.controller.reset(
             scene=self.floorplan,
             width=self.width,
             height=self.height,
@@ -66,59 +186,400 @@ class Env:
             fieldOfView=60,
             renderInstanceSegmentation=True,
         )
-        if os.path.isfile("poses/{}.json".format(self.floorplan)):
-            self.event = self.controller.step(
-                action="SetObjectPoses",
-                objectPoses=json.load(open("poses/{}.json".format(self.floorplan))),
-            )
-        self.reachables = self.controller.step(action="GetReachablePositions").metadata[
-            "actionReturn"
-        ]
-
-        self.event = self.controller.step(action="Done")
+        if not full:
+            self.event = self.retain(event)
+            self._frame_analysis = None
+            self.rendered = True
+            if self.restore(self.initial_snapshot):
+                logging.info("environment reloaded")
+                return
+        self.setup_scene()
+        self.initial_snapshot = self.snapshot()
         logging.info("environment reset")
         logging.debug("all objects: \n {}".format(pformat(self.objects, indent=2)))
 
+    def snapshot(self) -> SceneSnapshot:
+        """Captures the movable object poses, the agent pose and the held object"""
+        agent = self.event.metadata["agent"]
+        inventory = self.event.metadata["inventoryObjects"]
+        return SceneSnapshot(
+            object_poses=[
+                dict(
+                    objectName=obj_info["name"],
+                    position=dict(obj_info["position"]),
+                    rotation=dict(obj_info["rotation"]),
+                )
+                for obj_info in self.event.metadata["objects"]
+                if obj_info["moveable"] or obj_info["pickupable"]
+            ],
+            object_ids=frozenset(self.index.by_id),
+            agent_position=dict(agent["position"]),
+            agent_rotation=dict(agent["rotation"]),
+            agent_horizon=agent["cameraHorizon"],
+            held_object=inventory[0]["objectId"] if len(inventory) > 0 else None,
+        )
+
+    def restore(self, snapshot: SceneSnapshot) -> bool:
+        """
+        Restores a snapshot with as few calls as possible, moving back only the
+        objects and the agent if they moved, returns False without touching the
+        scene if objects were added or removed since, e.g. by slicing
+        """
+        if frozenset(self.index.by_id) != snapshot.object_ids:
+            return False
+
+        inventory = self.event.metadata["inventoryObjects"]
+        held_object = inventory[0]["objectId"] if len(inventory) > 0 else None
+        with self.rendering_disabled():
+            if held_object is not None and held_object != snapshot.held_object:
+                if not self.restore_step(
+                    dict(action="DropHandObject", forceAction=True)
+                ):
+                    return False
+
+            objects = self.event.metadata["objects"]
+            current = {obj_info["name"]: obj_info for obj_info in objects}
+            moved = [
+                pose
+                for pose in snapshot.object_poses
+                if not same_pose(current[pose["objectName"]], pose)
+                # an object kept in hand moved along with the agent
+                and not (
+                    held_object == snapshot.held_object
+                    and current[pose["objectName"]]["objectId"] == held_object
+                )
+            ]
+            calls = []
+            if len(moved) > MAX_OBJECT_TELEPORTS:
+                calls.append(
+                    dict(action="SetObjectPoses", objectPoses=snapshot.object_poses)
+                )
+            else:
+                calls.extend(
+                    dict(
+                        action="TeleportObject",
+                        objectId=current[pose["objectName"]]["objectId"],
+                        position=pose["position"],
+                        rotation=pose["rotation"],
+                        forceAction=True,
+                    )
+                    for pose in moved
+                )
+            agent = self.event.metadata["agent"]
+            agent_pose = dict(
+                position=snapshot.agent_position, rotation=snapshot.agent_rotation
+            )
+            horizon = agent["cameraHorizon"] - snapshot.agent_horizon
+            if not same_pose(agent, agent_pose) or abs(horizon) > ROTATION_TOLERANCE:
+                calls.append(
+                    dict(
+                        action="Teleport",
+                        position=snapshot.agent_position,
+                        rotation=snapshot.agent_rotation,
+                        horizon=snapshot.agent_horizon,
+                    )
+                )
+            if snapshot.held_object is not None and held_object != snapshot.held_object:
+                calls.append(
+                    dict(
+                        action="PickupObject",
+                        objectId=snapshot.held_object,
+                        forceAction=True,
+                    )
+                )
+            return all(self.restore_step(call) for call in calls)
+
+    def restore_step(self, call: dict) -> bool:
+        """Sends a call of restore, returns if it succeeded"""
+        event = self.api_step(call)
+        if not event.metadata["lastActionSuccess"]:
+            logging.warning(
+                "restoring snapshot failed at {}: {}".format(
+                    call["action"], event.metadata["errorMessage"]
+                )
+            )
+            return False
+        return True
+
+    def setup_scene(self):
+        """
+        Applies the object poses of the floorplan and gets its reachable positions,
+        from the scene cache when possible
+        """
+        pose_file = "poses/{}.json".format(self.floorplan)
+        scene = None
+        if self.scene_cache is not None:
+            scene = self.scene_cache.load(self.floorplan, pose_file)
+        poses = scene.poses if scene is not None else load_poses(pose_file)
+
+        if len(poses) > 0:
+            self.event = self.retain(
+                self.controller.step(action="SetObjectPoses", objectPoses=poses)
+            )
+
+        fingerprint = self.grid.fingerprint if hasattr(self, "grid") else None
+        if scene is not None:
+            self.reachables = scene.reachables
+            self.grid = scene.grid
+        else:
+            self.reachables = self.controller.step(
+                action="GetReachablePositions"
+            ).metadata["actionReturn"]
+            self.grid = ReachableGrid(self.reachables)
+            if self.scene_cache is not None:
+                self.scene_cache.save(
+                    self.floorplan,
+                    pose_file,
+                    SceneData(poses, self.reachables, self.grid),
+                )
+
+        self.event = self.retain(self.controller.step(action="Done"))
+        self.initial_index = self.index
+        # distances only depend on the reachable set and the initial layout, which
+        # come with the floorplan
+        if self.grid.fingerprint != fingerprint:
+            self.goal_fields.clear()
+            self._object_distances = None
+            self._interaction_poses = None
+            self._coarse_grid = None
+
+    @property
+    def object_distances(self) -> ObjectDistances:
+        """
+        Navigation distances between the objects as placed by setup_scene, computed
+        on first use or loaded from the scene cache
+        """
+        if self._object_distances is None:
+            pose_file = "poses/{}.json".format(self.floorplan)
+            if self.scene_cache is not None:
+                self._object_distances = self.scene_cache.load_distances(
+                    self.floorplan, pose_file, self.grid
+                )
+            if self._object_distances is None:
+                self._object_distances = ObjectDistances.compute(
+                    self.grid, self.initial_index
+                )
+                if self.scene_cache is not None:
+                    self.scene_cache.save_distances(
+                        self.floorplan, pose_file, self._object_distances, self.grid
+                    )
+            # navigating to an object that did not move reuses its field
+            for i, object_id in enumerate(self._object_distances.object_ids):
+                obj_info = self.initial_index.get(object_id)
+                if obj_info is None:
+                    continue
+                center = obj_info["axisAlignedBoundingBox"]["center"]
+                self.goal_fields.put(
+                    field_key(self.grid, center["x"], center["z"], APPROACH_RADIUS),
+                    self._object_distances.fields[:, i],
+                )
+        return self._object_distances
+
+    @property
+    def interaction_poses(self) -> InteractionPoses:
+        """
+        Poses to interact with the objects from, computed for every relevant object
+        on first use and kept up to date with the objects' positions by get
+        """
+        if self._interaction_poses is None:
+            self._interaction_poses = InteractionPoses(self.grid)
+            self._interaction_poses.update(self.index)
+        return self._interaction_poses
+
+    @property
+    def coarse_grid(self) -> CoarseGrid:
+        """Coarse cells and portals of the reachable grid, built on first use"""
+        if self._coarse_grid is None:
+            self._coarse_grid = CoarseGrid(self.grid)
+        return self._coarse_grid
+
+    @property
+    def index(self) -> ObjectIndex:
+        """Object metadata lookup tables, rebuilt once for every new event"""
+        if self._index is None or self._index.event is not self.event:
+            self._index = ObjectIndex(self.event)
+        return self._index
+
     @property
     def objects(self) -> List[str]:
         """Return all object ids in the environment"""
-        return [obj_info["objectId"] for obj_info in self.event.metadata["objects"]]
+        return list(self.index.by_id)
 
     @property
     def objects_visible(self) -> List[str]:
         """Return all visible object ids in the environment"""
-        return [
-            obj_info["objectId"]
-            for obj_info in self.event.metadata["objects"]
-            if obj_info["visible"]
-        ]
+        return list(self.index.visible_ids)
+
+    @contextmanager
+    def rendering_disabled(self) -> Iterator[None]:
+        """Steps taken inside of the context don't render any frames"""
+        rendering = self.rendering
+        self.rendering = False
+        try:
+            yield
+        finally:
+            self.rendering = rendering
+
+    def ensure_rendered(self) -> Event:
+        """
+        Makes sure the current event carries frames, visibility and segmentation,
+        re-rendering it only if it was produced with rendering disabled
+        """
+        return self.run(self.render_steps())
+
+    def render_steps(self) -> Steps:
+        """ensure_rendered as steps, see run"""
+        if not self.rendered:
+            yield dict(action="Done")
+        return self.event
+
+    def analyze_frame(self, downsample: int = 1) -> FrameAnalysis:
+        """
+        Instances in the segmentation frame of the current event, rendering it. The
+        analysis is reused until the next step
+        """
+        analysis = self._frame_analysis
+        if analysis is None or analysis.downsample != downsample:
+            analysis = self.run(self.analysis_steps(downsample))
+        return analysis
+
+    def analysis_steps(self, downsample: int = 1) -> Steps:
+        """
+        analyze_frame as steps, rendering the current event again if its frames were
+        not rendered or not retained. Under the metadata policy, the frames of that
+        step are analyzed as they arrive, before they are dropped
+        """
+        if not self.rendered or not has_frames(self.event):
+            if self.retention == "metadata":
+                self._analysis_requested = downsample
+            yield dict(action="Done")
+        analysis = self._frame_analysis
+        if analysis is None or analysis.downsample != downsample:
+            analysis = self._frame_analysis = FrameAnalysis(self.event, downsample)
+        return analysis
+
+    def retain(self, event: Event) -> Event:
+        """The part of event to keep as the current event, see retention"""
+        if self.retention == "full":
+            return event
+        return LeanEvent.from_event(event, keep_frames=self.retention == "lean")
 
     def api_step(self, *args, **kwargs) -> Event:
-        sleep(self.interval)
-        self.event = self.controller.step(*args, **kwargs)
-        if (
-            len(args) > 0
-            and isinstance(args[0], dict)
-            and args[0].get("action", "").startswith("Move")
-        ):
-            self.path_length += args[0]["moveMagnitude"]
-        if kwargs.get("action", "").startswith("Move"):
-            self.path_length += kwargs["moveMagnitude"]
+        api_action = self.get_api_action(*args, **kwargs)
+        sleep_time = self.pacer.sleep_time
+        self.pacer.wait()
+        last_agent = self.event.metadata["agent"]
+        start = perf_counter()
+        event = self.controller.step(api_action)
+        end = perf_counter()
+        return self.record_step(
+            api_action,
+            event,
+            last_agent,
+            start,
+            end,
+            self.pacer.sleep_time - sleep_time,
+        )
+
+    def get_api_action(self, *args, **kwargs) -> dict:
+        """The action api_step sends, given the same arguments"""
+        api_action = {}
+        if len(args) > 0 and isinstance(args[0], dict):
+            api_action.update(args[0])
+        api_action.update(kwargs)
+        if not self.rendering:
+            api_action["renderImage"] = False
+        return api_action
+
+    def record_step(
+        self,
+        api_action: dict,
+        event: Event,
+        last_agent: dict,
+        start: float,
+        end: float,
+        sleep_time: float,
+    ) -> Event:
+        """
+        Makes event the current event and adds it to the metrics. It is the result
+        of api_action, sent at time.perf_counter() start and returned at end after
+        pacing for sleep_time while the agent was last_agent
+        """
+        self.pacer.record(start, end)
+        downsample, self._analysis_requested = self._analysis_requested, None
+        self._frame_analysis = None
+        if downsample is not None and has_frames(event):
+            self._frame_analysis = FrameAnalysis(event, downsample)
+        self.event = self.retain(event)
+        self.rendered = self.rendering
+
+        action = api_action.get("action", "")
+        success = self.event.metadata["lastActionSuccess"]
+        agent = self.event.metadata["agent"]
+        path_length = 0.0
+        if action.startswith("Move"):
+            path_length = api_action["moveMagnitude"]
+        if action == "Teleport" and "position" in api_action and success:
+            path_length = math.hypot(
+                agent["position"]["x"] - last_agent["position"]["x"],
+                agent["position"]["z"] - last_agent["position"]["z"],
+            )
+        self.path_length += path_length
+        yaw = abs(agent["rotation"]["y"] - last_agent["rotation"]["y"]) % 360
+        pitch = abs(agent["cameraHorizon"] - last_agent["cameraHorizon"])
+        self.metrics.record(
+            action,
+            success,
+            end - start,
+            sleep_time,
+            min(yaw, 360 - yaw) + pitch,
+            path_length,
+        )
         return self.event
 
     def step(self, action: Action) -> bool:
         """Attempts to perform action, return if the action is successful"""
-        for api_action in action.api_actions:
+        return self.run(self.action_steps(action))
+
+    def action_steps(self, action: Action) -> Steps:
+        """step as steps, see run"""
+        if self.fine_grained:
+            api_actions, sources = action.api_actions, action.sources
+        else:
+            api_actions, sources = action.coalesced()
+        for api_action, source in zip(api_actions, sources):
             logging.debug("executing {}".format(api_action))
-            self.event = self.api_step(api_action)
-            if not self.event.metadata["lastActionSuccess"]:
+            event = yield api_action
+            if not event.metadata["lastActionSuccess"]:
                 logging.info(
-                    "last action unsuccessful: \n {}".format(
-                        pformat(api_action, indent=2)
+                    "last action unsuccessful: \n {}\n while executing: \n {}".format(
+                        pformat(api_action, indent=2),
+                        pformat([action.actions[i] for i in source], indent=2),
                     )
                 )
                 logging.warning(
-                    "{}".format(pformat(self.event.metadata["errorMessage"], indent=2))
+                    "{}".format(pformat(event.metadata["errorMessage"], indent=2))
                 )
                 return False
         return True
+
+    def run(self, steps: Steps) -> Any:
+        """
+        Runs steps, a generator that yields the api actions to send and is sent the
+        event each of them results in, and returns what it returns. Skills written
+        as steps run the same on AsyncEnv, see Compute for the other requests steps
+        can yield
+        """
+        try:
+            api_action = next(steps)
+            while True:
+                if isinstance(api_action, Compute):
+                    result = api_action.func()
+                elif isinstance(api_action, Future):
+                    wait([api_action])
+                    result = api_action
+                else:
+                    result = self.api_step(api_action)
+                api_action = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
@@ -1,11 +1,24 @@
 import logging
+from functools import partial
 from pprint import pformat
-from typing import List, Tuple
+from typing import Generator, List, Optional, Tuple
 
 from fire import Fire
 
-from interface import Env
-from planner import NavigationPlanner, handle_look_at, handle_put_obj
+import utils
+from events import Event
+from interaction import InteractionRegion
+from interface import Compute, Env, Steps
+from planner import (
+    NavigationPlanner,
+    PathPrefetcher,
+    handle_look_at,
+    look_at_steps,
+    put_obj_steps,
+)
+from reorder import reorder_plan
+from symbolic import load_domain, load_plan
+from utils import Pos2D
 
 
 def set_logging(level: str = "INFO"):
@@ -20,8 +33,31 @@ set_logging("INFO")
 
 
 class Agent:
-    def __init__(self, env: Env):
+    def __init__(
+        self,
+        env: Env,
+        nav_mode: str = "field",
+        reorder: bool = True,
+        pipeline: bool = True,
+        lrta_k: int = 20,
+    ):
+        """
+        reorder: reorder the independent steps of plans to travel less
+        pipeline: plan the path of the next skill in the background while the
+            current one runs, in all navigation modes but lrta
+        lrta_k: successors lrta mode scores per step, see NavigationPlanner.plan
+        """
         self.env = env
+        self.nav_mode = nav_mode
+        self.lrta_k = lrta_k
+        self.reorder = reorder
+        self.nav_expansions = 0
+        self.nav_steps = 0
+        self.prefetcher = None
+        if pipeline and nav_mode != "lrta":
+            self.prefetcher = PathPrefetcher(env, nav_mode)
+        # the next step of the running plan that needs the robot
+        self.next_step: Optional[str] = None
 
         self.bindings = {
             "Bread": None,
@@ -33,119 +69,351 @@ class Agent:
             "Pot": None,
             "SinkBasin": None,
         }
-        for obj_info in self.env.event.metadata["objects"]:
-            if obj_info["objectType"] in self.bindings.keys():
-                self.bindings[obj_info["objectType"]] = obj_info["name"]
-                if obj_info["objectType"] in {"Bread", "Lettuce", "Tomato"}:
-                    for i in range(1, 4):
-                        self.bindings[
-                            obj_info["objectType"][0] + "S" + str(i)
-                        ] = obj_info["assetId"] + "_Slice_{}".format(i + 1)
+        # slice symbol -> symbol of the object it is cut from
+        self.sliced_from = {}
+        # bind the instance of each type with the shortest travel from the agent
+        agent = self.env.event.metadata["agent"]["position"]
+        start = self.env.grid.nearest(agent["x"], agent["z"])
+        for object_type in list(self.bindings.keys()):
+            if object_type not in self.env.index.by_type:
+                continue
+            instances = self.env.index.by_type[object_type]
+            object_id = self.env.object_distances.nearest(
+                start, [obj_info["objectId"] for obj_info in instances]
+            )
+            obj_info = self.env.index.get(object_id) or instances[-1]
+            self.bindings[object_type] = obj_info["name"]
+            if object_type in {"Bread", "Lettuce", "Tomato"}:
+                for i in range(1, 4):
+                    symbol = object_type[0] + "S" + str(i)
+                    self.bindings[symbol] = "{}_Slice_{}".format(
+                        obj_info["assetId"], i + 1
+                    )
+                    self.sliced_from[symbol] = object_type
         self.bindings["plate"] = self.bindings["Plate"]
         logging.debug("got bindings: \n{}".format(pformat(self.bindings, indent=2)))
 
+    def __enter__(self) -> "Agent":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stops the thread paths are prefetched in, if the agent pipelines"""
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+
     def execute(self, tasks: List[Tuple[str, str]]):
         for func, arg in tasks:
             getattr(self, func)(arg)
 
-    def go_to_obj(self, object_id: str):
+    def go_to_obj(self, object_id: str) -> bool:
         """Assumes the object is reachable"""
-        NavigationPlanner.go_to_obj(self.env, object_id)
+        return self.env.run(self.go_to_obj_steps(object_id))
+
+    def go_to_obj_steps(self, object_id: str) -> Steps:
+        goal = utils.get_obj_loc(self.env.index, object_id)
+        if goal is None:
+            return False
+        planner = yield from self.navigate_steps(goal)
+        return planner.reached
+
+    def navigate(
+        self, goal: Pos2D, region: Optional[InteractionRegion] = None
+    ) -> NavigationPlanner:
+        return self.env.run(self.navigate_steps(goal, region))
+
+    def navigate_steps(
+        self, goal: Pos2D, region: Optional[InteractionRegion] = None
+    ) -> Generator[dict, Event, NavigationPlanner]:
+        """
+        Navigates to goal, or onto region. When pipelining, the path is the one
+        prefetched for it if the agent is where it was planned from, and the path of
+        the next step is prefetched from where this one ends before executing it
+        """
+        indices = region.indices if region is not None else None
+        path = None
+        if self.prefetcher is not None:
+            agent = self.env.event.metadata["agent"]["position"]
+            start = self.env.grid.nearest(agent["x"], agent["z"])
+            path, expansions = yield from self.prefetcher.take_steps(
+                goal, indices, start
+            )
+            if path is None:
+                path, expansions = yield Compute(
+                    partial(self.prefetcher.plan, goal, indices, start)
+                )
+            self.nav_expansions += expansions
+            self.prefetch_next(path[-1] if path else start)
+
+        planner = NavigationPlanner(
+            self.env,
+            goal,
+            self.nav_mode,
+            indices,
+            path=path,
+            execute=False,
+            k=self.lrta_k,
+        )
+        with self.env.rendering_disabled():
+            yield from planner.navigate(self.env.event)
+        self.nav_expansions += planner.expansions
+        self.nav_steps += planner.steps
+        return planner
+
+    def prefetch_next(self, start: int):
+        """Starts planning the navigation of next_step from the reachable index start"""
+        target = self.get_target(self.next_step) if self.next_step else None
+        if target is None:
+            return
+        object_id = self.name_to_id(self.bindings[target[1]])
+        if object_id is None:
+            # slices that are yet to be cut
+            return
+        region = self.env.interaction_poses.get(self.env.index, object_id)
+        if region is not None:
+            self.prefetcher.submit(region.center, region.indices, start)
+        else:
+            goal = utils.get_obj_loc(self.env.index, object_id)
+            self.prefetcher.submit(goal, None, start)
 
-    def look_at_obj(self, object_id: str):
+    def look_at_obj(self, object_id: str) -> bool:
         """Assumes the agent is reasonable close to object"""
-        handle_look_at(self.env, object_id)
+        return handle_look_at(self.env, object_id)
 
-    def pick_obj(self, object_id: str):
+    def look_at_obj_steps(self, object_id: str) -> Steps:
+        return look_at_steps(self.env, object_id)
+
+    def pick_obj(self, object_id: str) -> bool:
         """Assumes the agent has the object in the frame"""
+        return self.env.run(self.pick_obj_steps(object_id))
+
+    def pick_obj_steps(self, object_id: str) -> Steps:
 
-        if object_id in self.env.objects_visible:
-            self.env.api_step(action="PickupObject", objectId=object_id)
+        yield from self.env.render_steps()
+        if object_id in self.env.index.visible_ids:
+            event = yield dict(action="PickupObject", objectId=object_id)
+            return event.metadata["lastActionSuccess"]
         else:
             logging.warning("{} not found in scene".format(object_id))
+            return False
 
-    def put_obj(self, recep_id: str):
+    def put_obj(self, recep_id: str) -> bool:
         """
         Assumes the agent is holding the object to be put down and has the recepticle in
         the frame
         Manually handle sliced object
         """
-        handle_put_obj(self.env, recep_id)
+        return self.env.run(self.put_obj_steps(recep_id))
 
-    def cut_obj(self, object_id: str):
+    def put_obj_steps(self, recep_id: str) -> Steps:
+        yield from self.env.render_steps()
+        return (yield from put_obj_steps(self.env, recep_id))
+
+    def cut_obj(self, object_id: str) -> bool:
         """
         Assumes the agent is holding a knife and has the object to be cut in the frame
         """
+        return self.env.run(self.cut_obj_steps(object_id))
+
+    def cut_obj_steps(self, object_id: str) -> Steps:
 
-        if object_id in self.env.objects_visible:
-            self.env.api_step(action="SliceObject", objectId=object_id)
+        yield from self.env.render_steps()
+        if object_id in self.env.index.visible_ids:
+            event = yield dict(action="SliceObject", objectId=object_id)
+            return event.metadata["lastActionSuccess"]
         else:
             logging.warning("{} not found in scene".format(object_id))
+            return False
 
     def name_to_id(self, name: str) -> str:
 
-        for obj_info in self.env.event.metadata["objects"]:
-            if obj_info["name"] == name:
-                return obj_info["objectId"]
+        obj_info = self.env.index.by_name.get(name)
+        if obj_info is not None:
+            return obj_info["objectId"]
 
     def parse(self, string: str) -> Tuple[str]:
 
         string = string[string.index("(") + 1 : string.index(")")]
         return tuple(string.split(","))
 
-    def run_plan(self, plan_file: str):
+    def go_to_pose(self, object_id: str) -> Optional[bool]:
+        """
+        Goes onto the interaction region of the object and turns into it with a
+        single teleport, returns None if the object has no interaction region
+        """
+        return self.env.run(self.go_to_pose_steps(object_id))
+
+    def go_to_pose_steps(self, object_id: str) -> Steps:
+        region = self.env.interaction_poses.get(self.env.index, object_id)
+        if region is None:
+            return None
+        planner = yield from self.navigate_steps(region.center, region)
+        if not planner.reached:
+            return False
+        position = self.env.event.metadata["agent"]["position"]
+        pose = region.pose(
+            self.env.grid, self.env.grid.lookup(position["x"], position["z"])
+        )
+        if pose is None:
+            return False
+        event = yield pose.teleport()
+        return event.metadata["lastActionSuccess"]
+
+    def run_skill(self, skill: str, name: str) -> bool:
+        """
+        Goes to the object bound to name, looks at it and applies the skill on it,
+        from its interaction pose if it has one
+        """
+        return self.env.run(self.run_skill_steps(skill, name))
+
+    def run_skill_steps(self, skill: str, name: str) -> Steps:
+        object_id = self.name_to_id(name)
+        posed = yield from self.go_to_pose_steps(object_id)
+        if posed:
+            reached = looked = True
+        else:
+            reached = yield from self.go_to_obj_steps(object_id)
+            looked = yield from self.look_at_obj_steps(object_id)
+        done = yield from getattr(self, skill + "_steps")(object_id)
+        return reached and looked and done
 
-        plan = open(plan_file).readlines()
-        plan = plan[plan.index("Plan:\n") + 1 :]
-        logging.info("got plan: \n{}".format(pformat(plan, indent=2)))
+    def get_target(self, step: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the skill for one line of the plan and the symbol of the object it is
+        applied on, None for steps that don't need the robot
+        """
+        if step.startswith("PickKnife"):
+            return "pick_obj", "Knife"
+        elif step.startswith("CutBread"):
+            return "cut_obj", "Bread"
+        elif step.startswith("CutTomato"):
+            return "cut_obj", "Tomato"
+        elif step.startswith("CutLettuce"):
+            return "cut_obj", "Lettuce"
+        elif step.startswith("PutKnife"):
+            return "put_obj", "SinkBasin"
+        elif step.startswith("PickSlice"):
+            symbol = self.parse(step)[0]
+            # if symbol not in self.bindings.keys():
+            #     object_type = {
+            #         "BS": "BreadSliced",
+            #         "LS": "LettuceSliced",
+            #         "TS": "TomatoSliced",
+            #     }[symbol[:2]]
+            #     for obj_info in self.env.event.metadata["objects"]:
+            #         if (
+            #             obj_info["objectType"] == object_type
+            #             and obj_info["name"] not in self.bindings.values()
+            #         ):
+            #             self.bindings[symbol] = obj_info["name"]
+            #             break
+            return "pick_obj", symbol
+        elif step.startswith("PutSlice"):
+            return "put_obj", self.parse(step)[-1]
+        return None
+
+    def target_id(self, symbol: str) -> Optional[str]:
+        """
+        Returns the id of the object bound to symbol, slices that were not cut yet are
+        substituted by the object they are cut from
+        """
+        object_id = self.name_to_id(self.bindings.get(symbol))
+        if object_id is None and symbol in self.sliced_from:
+            object_id = self.name_to_id(self.bindings[self.sliced_from[symbol]])
+        return object_id
+
+    def execute_step(self, step: str) -> bool:
+        """Executes one line of the plan, returns if it was successful"""
+        return self.env.run(self.execute_step_steps(step))
+
+    def execute_step_steps(self, step: str) -> Steps:
+        target = self.get_target(step)
+        if target is None:
+            return True
+        skill, symbol = target
+        return (yield from self.run_skill_steps(skill, self.bindings[symbol]))
+
+    def reorder_plan(self, plan_file: str, plan: List[str]) -> List[str]:
+        """
+        Reorders the steps of plan that don't depend on each other to minimize the
+        estimated travel between the objects they go to
+        """
+        domain = load_domain(plan_file)
+        if domain is None:
+            logging.warning("no domain for {}, keeping its order".format(plan_file))
+            return plan
 
+        targets = []
         for step in plan:
+            target = self.get_target(step)
+            targets.append(self.target_id(target[1]) if target is not None else None)
+        agent = self.env.event.metadata["agent"]["position"]
+        return reorder_plan(
+            domain,
+            plan,
+            self.env.object_distances,
+            self.env.grid.nearest(agent["x"], agent["z"]),
+            targets,
+        )
+
+    def run_plan(self, plan_file: str) -> bool:
+        """
+        Executes the plan in plan_file, or the plan for it if it is a domain file,
+        returns if every step was successful
+        """
+        return self.env.run(self.run_plan_steps(plan_file))
+
+    def run_plan_steps(self, plan_file: str) -> Steps:
+
+        plan = load_plan(plan_file)
+        if self.reorder:
+            plan = yield Compute(partial(self.reorder_plan, plan_file, plan))
+        logging.info("got plan: \n{}".format(pformat(plan, indent=2)))
+
+        success = True
+        for i, step in enumerate(plan):
             logging.debug("executing {}".format(step))
-            if step.startswith("PickKnife"):
-                self.go_to_obj(self.name_to_id(self.bindings["Knife"]))
-                self.look_at_obj(self.name_to_id(self.bindings["Knife"]))
-                self.pick_obj(self.name_to_id(self.bindings["Knife"]))
-            elif step.startswith("CutBread"):
-                self.go_to_obj(self.name_to_id(self.bindings["Bread"]))
-                self.look_at_obj(self.name_to_id(self.bindings["Bread"]))
-                self.cut_obj(self.name_to_id(self.bindings["Bread"]))
-            elif step.startswith("CutTomato"):
-                self.go_to_obj(self.name_to_id(self.bindings["Tomato"]))
-                self.look_at_obj(self.name_to_id(self.bindings["Tomato"]))
-                self.cut_obj(self.name_to_id(self.bindings["Tomato"]))
-            elif step.startswith("CutLettuce"):
-                self.go_to_obj(self.name_to_id(self.bindings["Lettuce"]))
-                self.look_at_obj(self.name_to_id(self.bindings["Lettuce"]))
-                self.cut_obj(self.name_to_id(self.bindings["Lettuce"]))
-            elif step.startswith("PutKnife"):
-                self.go_to_obj(self.name_to_id(self.bindings["SinkBasin"]))
-                self.look_at_obj(self.name_to_id(self.bindings["SinkBasin"]))
-                self.put_obj(self.name_to_id(self.bindings["SinkBasin"]))
-            elif step.startswith("PickSlice"):
-                symbol = self.parse(step)[0]
-                # if symbol not in self.bindings.keys():
-                #     object_type = {
-                #         "BS": "BreadSliced",
-                #         "LS": "LettuceSliced",
-                #         "TS": "TomatoSliced",
-                #     }[symbol[:2]]
-                #     for obj_info in self.env.event.metadata["objects"]:
-                #         if (
-                #             obj_info["objectType"] == object_type
-                #             and obj_info["name"] not in self.bindings.values()
-                #         ):
-                #             self.bindings[symbol] = obj_info["name"]
-                #             break
-                self.go_to_obj(self.name_to_id(self.bindings[symbol]))
-                self.look_at_obj(self.name_to_id(self.bindings[symbol]))
-                self.pick_obj(self.name_to_id(self.bindings[symbol]))
-            elif step.startswith("PutSlice"):
-                symbol = self.parse(step)[-1]
-                self.go_to_obj(self.name_to_id(self.bindings[symbol]))
-                self.look_at_obj(self.name_to_id(self.bindings[symbol]))
-                self.put_obj(self.name_to_id(self.bindings[symbol]))
+            self.next_step = next(
+                (later for later in plan[i + 1 :] if self.get_target(later)), None
+            )
+            with self.env.metrics.section(step.strip()) as section:
+                section.success = yield from self.execute_step_steps(step)
+            if not section.success:
+                logging.warning("step {} failed".format(step.strip()))
+                success = False
 
         logging.info("total path length: {}".format(self.env.path_length))
+        logging.info(
+            "time in simulator: {:.2f}s, sleeping: {:.2f}s".format(
+                self.env.pacer.sim_time, self.env.pacer.sleep_time
+            )
+        )
+        logging.info(
+            "total navigation ({}): {} expansions, {} steps".format(
+                self.nav_mode, self.nav_expansions, self.nav_steps
+            )
+        )
+        if self.prefetcher is not None:
+            logging.info(
+                "prefetched paths: {} used, {} replanned".format(
+                    self.prefetcher.hits, self.prefetcher.misses
+                )
+            )
+        for section in self.env.metrics.by_skill():
+            logging.info(
+                "{}: {} calls, {} failed, {:.2f}s total, {:.2f}s in simulator, "
+                "{:.2f}s in python".format(
+                    section.name,
+                    sum(section.calls.values()),
+                    sum(section.failures.values()),
+                    section.wall_time,
+                    section.sim_time,
+                    section.python_time,
+                )
+            )
+        return success
 
 
 def test():
@@ -174,11 +442,44 @@ def test():
     event = env.api_step(action="Done")  # noqa
 
 
-def run_plan(plan_file: str, floorplan: str = "FloorPlan3"):
+def run_plan(
+    plan_file: str,
+    floorplan: str = "FloorPlan3",
+    nav_mode: str = "field",
+    pacing: str = "fixed",
+    fine_grained: bool = False,
+    metrics: Optional[str] = None,
+    reorder: bool = True,
+    pipeline: bool = True,
+    record: Optional[str] = None,
+    replay: Optional[str] = None,
+    lrta_k: int = 20,
+):
+    """
+    plan_file: plan as written by planner.cpp or a domain file like Sandwich.txt
+    metrics: file to export the per step metrics to, as CSV if it ends with .csv
+    reorder: reorder independent plan steps to travel less
+    pipeline: plan the next skill's path while the simulator runs the current one
+    record: trace file to record the episode into
+    replay: trace file to replay the episode from, without a simulator
+    lrta_k: successors lrta mode scores per step
+    """
 
     set_logging("DEBUG")
-    env = Env(floorplan=floorplan)
-    Agent(env).run_plan(plan_file)
+    env = Env(
+        floorplan=floorplan,
+        pacing=pacing,
+        fine_grained=fine_grained,
+        record=record,
+        replay=replay,
+    )
+    env.metrics.clear()
+    with Agent(
+        env, nav_mode=nav_mode, reorder=reorder, pipeline=pipeline, lrta_k=lrta_k
+    ) as agent:
+        agent.run_plan(plan_file)
+    if metrics is not None:
+        env.metrics.save(metrics)
 
 
 if __name__ == "__main__":
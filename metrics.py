@@ -0,0 +1,184 @@
+import csv
+import json
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator, List, Optional
+
+
+class SectionMetrics:
+    """Simulator calls and time spent during one section of an episode, e.g. a step"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = Counter()
+        self.failures = Counter()
+        self.wall_time = 0.0
+        self.sim_time = 0.0
+        self.sleep_time = 0.0
+        # degrees turned, looking up and down included
+        self.rotation = 0.0
+        self.teleports = 0
+        self.path_length = 0.0
+        self.success: Optional[bool] = None
+
+    @property
+    def skill(self) -> str:
+        """Name of the plan action, e.g. PickSlice for PickSlice(BS1)"""
+        return self.name.split("(")[0]
+
+    @property
+    def python_time(self) -> float:
+        """Wall time neither spent in the simulator nor sleeping, mostly planning"""
+        return max(0.0, self.wall_time - self.sim_time - self.sleep_time)
+
+    def add(self, other: "SectionMetrics"):
+        self.calls.update(other.calls)
+        self.failures.update(other.failures)
+        self.wall_time += other.wall_time
+        self.sim_time += other.sim_time
+        self.sleep_time += other.sleep_time
+        self.rotation += other.rotation
+        self.teleports += other.teleports
+        self.path_length += other.path_length
+        if other.success is not None:
+            self.success = self.success is not False and other.success
+
+    def to_dict(self) -> dict:
+        return dict(
+            name=self.name,
+            skill=self.skill,
+            success=self.success,
+            calls=sum(self.calls.values()),
+            failures=sum(self.failures.values()),
+            wall_time=self.wall_time,
+            sim_time=self.sim_time,
+            sleep_time=self.sleep_time,
+            python_time=self.python_time,
+            rotation=self.rotation,
+            teleports=self.teleports,
+            path_length=self.path_length,
+            calls_by_action=dict(self.calls),
+            failures_by_action=dict(self.failures),
+        )
+
+
+class Metrics:
+    """
+    Per section instrumentation of simulator steps, filled in by Env.api_step
+
+    Steps taken outside of any section are counted towards the "other" section.
+    """
+
+    csv_columns = (
+        "name",
+        "skill",
+        "success",
+        "calls",
+        "failures",
+        "wall_time",
+        "sim_time",
+        "sleep_time",
+        "python_time",
+        "rotation",
+        "teleports",
+        "path_length",
+    )
+
+    def __init__(self):
+        self.sections: List[SectionMetrics] = []
+        self.other = SectionMetrics("other")
+        self.current: Optional[SectionMetrics] = None
+
+    def clear(self):
+        self.__init__()
+
+    @contextmanager
+    def section(self, name: str) -> Iterator[SectionMetrics]:
+        """Attributes the steps taken inside of the context to a new section name"""
+        parent = self.current
+        self.current = SectionMetrics(name)
+        self.sections.append(self.current)
+        start = perf_counter()
+        try:
+            yield self.current
+        finally:
+            self.current.wall_time = perf_counter() - start
+            self.current = parent
+
+    def record(
+        self,
+        action: str,
+        success: bool,
+        sim_time: float,
+        sleep_time: float,
+        rotation: float,
+        path_length: float,
+    ):
+        """Records one simulator step"""
+        section = self.current if self.current is not None else self.other
+        section.calls[action] += 1
+        if not success:
+            section.failures[action] += 1
+        section.sim_time += sim_time
+        section.sleep_time += sleep_time
+        section.rotation += rotation
+        section.path_length += path_length
+        if action == "Teleport" and success:
+            section.teleports += 1
+        if self.current is None:
+            # steps outside of sections don't have a surrounding clock
+            section.wall_time += sim_time + sleep_time
+
+    def by_skill(self) -> List[SectionMetrics]:
+        """Sections summed up per skill, in order of first appearance"""
+        skills = {}
+        for section in self.sections:
+            if section.skill not in skills:
+                skills[section.skill] = SectionMetrics(section.skill)
+            skills[section.skill].add(section)
+        return list(skills.values())
+
+    def total(self) -> SectionMetrics:
+        total = SectionMetrics("total")
+        for section in self.sections + [self.other]:
+            total.add(section)
+        return total
+
+    def rows(self) -> List[dict]:
+        return [
+            section.to_dict() for section in self.sections + [self.other, self.total()]
+        ]
+
+    def to_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(
+                dict(
+                    steps=[section.to_dict() for section in self.sections],
+                    skills=[section.to_dict() for section in self.by_skill()],
+                    other=self.other.to_dict(),
+                    total=self.total().to_dict(),
+                ),
+                f,
+                indent=2,
+            )
+
+    def to_csv(self, path: str):
+        """One row per section with the call counts of every action type as columns"""
+        rows = self.rows()
+        actions = sorted({action for row in rows for action in row["calls_by_action"]})
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(self.csv_columns) + actions)
+            for row in rows:
+                writer.writerow(
+                    [row[column] for column in self.csv_columns]
+                    + [row["calls_by_action"].get(action, 0) for action in actions]
+                )
+
+    def save(self, path: str):
+        """Writes CSV if path ends with .csv, JSON otherwise"""
+        if path.endswith(".csv"):
+            self.to_csv(path)
+        else:
+            self.to_json(path)
@@ -0,0 +1,445 @@
+import copy
+import itertools
+import json
+import math
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+PICKUPABLE_TYPES = {
+    "Apple",
+    "Bowl",
+    "Bread",
+    "ButterKnife",
+    "Cup",
+    "DishSponge",
+    "Egg",
+    "Fork",
+    "Knife",
+    "Lettuce",
+    "Mug",
+    "Pan",
+    "PepperShaker",
+    "Plate",
+    "Pot",
+    "Potato",
+    "SaltShaker",
+    "SoapBottle",
+    "Spatula",
+    "Spoon",
+    "Tomato",
+}
+SLICEABLE_TYPES = {"Apple", "Bread", "Lettuce", "Potato", "Tomato"}
+RECEPTACLE_TYPES = {
+    "Bowl",
+    "Cabinet",
+    "CoffeeMachine",
+    "CounterTop",
+    "DiningTable",
+    "Drawer",
+    "Fridge",
+    "GarbageCan",
+    "Microwave",
+    "Pan",
+    "Plate",
+    "Pot",
+    "Shelf",
+    "SideTable",
+    "SinkBasin",
+    "StoveBurner",
+    "Toaster",
+}
+# types that don't block the agent
+FLAT_TYPES = {"Floor", "Blinds", "Window", "Mirror", "LightSwitch"}
+
+
+class MockEvent:
+    """Stand-in for ai2thor.server.Event, frames only exist if the step rendered"""
+
+    def __init__(
+        self,
+        metadata: dict,
+        frame: Optional[np.ndarray] = None,
+        instance_segmentation_frame: Optional[np.ndarray] = None,
+        color_to_object_id: Optional[dict] = None,
+    ):
+        self.metadata = metadata
+        self.frame = frame
+        self.instance_segmentation_frame = instance_segmentation_frame
+        self.color_to_object_id = (
+            color_to_object_id if color_to_object_id is not None else {}
+        )
+        self._instance_masks = None
+
+    @property
+    def instance_masks(self) -> dict:
+        """Boolean mask of every object in the segmentation frame, built on access"""
+        if self._instance_masks is None:
+            self._instance_masks = {}
+            for color, object_id in self.color_to_object_id.items():
+                mask = np.all(self.instance_segmentation_frame == color, axis=-1)
+                if mask.any():
+                    self._instance_masks[object_id] = mask
+        return self._instance_masks
+
+    def get_object(self, object_id: str) -> Optional[dict]:
+        for obj_info in self.metadata["objects"]:
+            if obj_info["objectId"] == object_id:
+                return obj_info
+        return None
+
+
+def get_object_id(object_type: str, position: dict) -> str:
+    return "{}|{:+06.2f}|{:+06.2f}|{:+06.2f}".format(
+        object_type, position["x"], position["y"], position["z"]
+    )
+
+
+class MockController:
+    """
+    Deterministic stand-in for ai2thor.controller.Controller, to run the planners and
+    skills without launching Unity
+
+    Objects come from a pose file, their layout can be stretched by `scale` and the
+    reachable positions are a synthetic grid of spacing gridSize over the scene
+    bounds, minus a `clearance` around every object. Scaling the layout grows the
+    number of reachable cells quadratically, which is what benchmarks sweep over.
+    SetObjectPoses takes poses as they are, so a stretched layout should be used with
+    a scene name that has no pose file for Env to apply.
+
+    Supported actions: Teleport, RotateLeft/Right, LookUp/Down, PickupObject,
+    SliceObject, PutObject, DropHandObject, SetObjectPoses, GetReachablePositions
+    and Done. Any other action succeeds without effect
+    """
+
+    visibility_distance: float = 1.5
+    agent_height: float = 0.9
+
+    def __init__(
+        self,
+        scene: str = "FloorPlan3",
+        width: int = 600,
+        height: int = 600,
+        gridSize: float = 0.05,
+        fieldOfView: float = 60,
+        pose_file: str = "poses/FloorPlan3.json",
+        scale: float = 1.0,
+        clearance: float = 0.3,
+        margin: float = 0.5,
+        **kwargs
+    ):
+        self.width = width
+        self.height = height
+        self.grid_size = gridSize
+        self.field_of_view = fieldOfView
+        self.scale = scale
+        self.clearance = clearance
+        self.margin = margin
+        with open(pose_file) as f:
+            self.poses = json.load(f)
+        self.call_counts = Counter()
+        self.reset(scene=scene)
+
+    def reset(self, scene: Optional[str] = None, **kwargs):
+        if scene is not None:
+            self.scene = scene
+        self.objects = [self.make_object(pose) for pose in self.poses]
+        self.reachables = self.make_reachables()
+        start = self.reachables[len(self.reachables) // 2]
+        self.agent = dict(
+            position=dict(start),
+            rotation=dict(x=0.0, y=0.0, z=0.0),
+            cameraHorizon=0.0,
+        )
+        self.inventory = []
+        self.last_event = self.make_event(True, "", None, render=True)
+        return self.last_event
+
+    def stop(self):
+        pass
+
+    def make_object(self, pose: dict) -> dict:
+        name = pose["objectName"]
+        object_type = name.split("_")[0]
+        position = dict(pose["position"])
+        position["x"] *= self.scale
+        position["z"] *= self.scale
+        if object_type == "SinkBasin":
+            object_id = get_object_id("Sink", position) + "|SinkBasin"
+        else:
+            object_id = get_object_id(object_type, position)
+        obj_info = dict(
+            objectId=object_id,
+            name=name,
+            objectType=object_type,
+            assetId=object_type + "_1",
+            position=position,
+            rotation=dict(pose["rotation"]),
+            visible=False,
+            pickupable=object_type in PICKUPABLE_TYPES,
+            moveable=False,
+            receptacle=object_type in RECEPTACLE_TYPES,
+            sliceable=object_type in SLICEABLE_TYPES,
+            isSliced=False,
+            parentReceptacles=None,
+        )
+        self.set_bbox(obj_info, 0.15 if obj_info["pickupable"] else 0.6)
+        return obj_info
+
+    @staticmethod
+    def set_bbox(obj_info: dict, size: float):
+        center = dict(obj_info["position"])
+        half = size / 2
+        obj_info["axisAlignedBoundingBox"] = dict(
+            center=center,
+            size=dict(x=size, y=size, z=size),
+            cornerPoints=[
+                [center[axis] + sign * half for axis, sign in zip("xyz", signs)]
+                for signs in itertools.product((-1, 1), repeat=3)
+            ],
+        )
+
+    def make_reachables(self) -> List[dict]:
+        obstacles = np.array(
+            [
+                (obj_info["position"]["x"], obj_info["position"]["z"])
+                for obj_info in self.objects
+                if obj_info["objectType"] not in FLAT_TYPES
+            ]
+        )
+        low = np.floor((obstacles.min(axis=0) - self.margin) / self.grid_size)
+        high = np.ceil((obstacles.max(axis=0) + self.margin) / self.grid_size)
+        xs = np.arange(low[0], high[0] + 1) * self.grid_size
+        zs = np.arange(low[1], high[1] + 1) * self.grid_size
+        cells = np.stack(np.meshgrid(xs, zs, indexing="ij"), axis=-1).reshape(-1, 2)
+        free = np.ones(len(cells), dtype=bool)
+        for obstacle in obstacles:
+            free &= np.hypot(*(cells - obstacle).T) > self.clearance
+        return [
+            dict(x=round(x, 4), y=self.agent_height, z=round(z, 4))
+            for x, z in cells[free].tolist()
+        ]
+
+    def get_object(self, object_id: str) -> Optional[dict]:
+        for obj_info in self.objects:
+            if obj_info["objectId"] == object_id:
+                return obj_info
+        return None
+
+    def get_view_angles(self, obj_info: dict):
+        """Returns the distance, yaw and pitch offsets of an object from the camera"""
+        position = self.agent["position"]
+        dx = obj_info["position"]["x"] - position["x"]
+        dz = obj_info["position"]["z"] - position["z"]
+        dy = obj_info["position"]["y"] - position["y"] - 0.675
+        distance = math.hypot(dx, dz)
+        yaw = math.degrees(math.atan2(dx, dz)) - self.agent["rotation"]["y"]
+        yaw = (yaw + 180) % 360 - 180
+        pitch = math.degrees(math.atan2(-dy, distance)) - self.agent["cameraHorizon"]
+        return distance, yaw, pitch
+
+    def update_visibility(self):
+        held = {obj_info["objectId"] for obj_info in self.inventory}
+        for obj_info in self.objects:
+            distance, yaw, pitch = self.get_view_angles(obj_info)
+            obj_info["visible"] = (
+                obj_info["objectId"] not in held
+                and distance <= self.visibility_distance
+                and abs(yaw) <= self.field_of_view / 2
+                and abs(pitch) <= self.field_of_view / 2
+            )
+
+    def render(self):
+        """
+        Draws every visible object as a square of its own color into the instance
+        segmentation frame, nearer objects over farther ones
+        """
+        frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        segmentation = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        color_to_object_id = {}
+        half_fov = self.field_of_view / 2
+        views = []
+        for i, obj_info in enumerate(self.objects):
+            if obj_info["visible"]:
+                views.append((self.get_view_angles(obj_info), i + 1, obj_info))
+        for (distance, yaw, pitch), code, obj_info in sorted(
+            views, key=lambda view: -view[0][0]
+        ):
+            color = (code >> 16 & 255, code >> 8 & 255, code & 255)
+            color_to_object_id[color] = obj_info["objectId"]
+            row = int((pitch / half_fov + 1) / 2 * (self.height - 1))
+            col = int((yaw / half_fov + 1) / 2 * (self.width - 1))
+            radius = max(1, int(0.05 / max(distance, 0.1) * self.width))
+            segmentation[
+                max(row - radius, 0) : row + radius + 1,
+                max(col - radius, 0) : col + radius + 1,
+            ] = color
+        return frame, segmentation, color_to_object_id
+
+    def make_event(
+        self, success: bool, error: str, action_return, render: bool
+    ) -> MockEvent:
+        self.update_visibility()
+        metadata = dict(
+            lastActionSuccess=success,
+            errorMessage=error,
+            actionReturn=action_return,
+            agent=copy.deepcopy(self.agent),
+            objects=copy.deepcopy(self.objects),
+            inventoryObjects=copy.deepcopy(self.inventory),
+        )
+        if render:
+            return MockEvent(metadata, *self.render())
+        return MockEvent(metadata)
+
+    def step(self, action=None, **kwargs) -> MockEvent:
+        if isinstance(action, dict):
+            kwargs = dict(action, **kwargs)
+        elif action is not None:
+            kwargs["action"] = action
+        name = kwargs["action"]
+        self.call_counts[name] += 1
+
+        handler = getattr(self, "handle_" + name, None)
+        if handler is None:
+            success, error, action_return = True, "", None
+        else:
+            success, error, action_return = handler(**kwargs)
+        self.last_event = self.make_event(
+            success, error, action_return, kwargs.get("renderImage", True)
+        )
+        return self.last_event
+
+    def handle_GetReachablePositions(self, **kwargs):
+        return True, "", copy.deepcopy(self.reachables)
+
+    def handle_Teleport(self, position=None, rotation=None, horizon=None, **kwargs):
+        if position is not None:
+            self.agent["position"] = dict(
+                x=position["x"], y=self.agent_height, z=position["z"]
+            )
+        if rotation is not None:
+            yaw = rotation["y"] if isinstance(rotation, dict) else rotation
+            self.agent["rotation"] = dict(x=0.0, y=yaw % 360, z=0.0)
+        if horizon is not None:
+            self.agent["cameraHorizon"] = horizon
+        return True, "", None
+
+    def rotate(self, degrees: float):
+        self.agent["rotation"]["y"] = (self.agent["rotation"]["y"] + degrees) % 360
+        return True, "", None
+
+    def handle_RotateRight(self, degrees: float = 90, **kwargs):
+        return self.rotate(degrees)
+
+    def handle_RotateLeft(self, degrees: float = 90, **kwargs):
+        return self.rotate(-degrees)
+
+    def look(self, degrees: float):
+        horizon = self.agent["cameraHorizon"] + degrees
+        if not -30 - 1e-6 <= horizon <= 60 + 1e-6:
+            return False, "horizon out of range", None
+        self.agent["cameraHorizon"] = horizon
+        return True, "", None
+
+    def handle_LookDown(self, degrees: float = 30, **kwargs):
+        return self.look(degrees)
+
+    def handle_LookUp(self, degrees: float = 30, **kwargs):
+        return self.look(-degrees)
+
+    def check_interactable(self, object_id: str, force: bool):
+        obj_info = self.get_object(object_id)
+        if obj_info is None:
+            return None, "{} not in scene".format(object_id)
+        if not force and not obj_info["visible"]:
+            return None, "{} is not visible".format(object_id)
+        return obj_info, ""
+
+    def handle_PickupObject(self, objectId: str, forceAction: bool = False, **kwargs):
+        obj_info, error = self.check_interactable(objectId, forceAction)
+        if obj_info is None:
+            return False, error, None
+        if len(self.inventory) > 0:
+            return False, "agent is already holding an object", None
+        if not obj_info["pickupable"]:
+            return False, "{} is not pickupable".format(objectId), None
+        self.inventory = [dict(objectId=objectId, objectType=obj_info["objectType"])]
+        return True, "", None
+
+    def handle_SliceObject(self, objectId: str, forceAction: bool = False, **kwargs):
+        obj_info, error = self.check_interactable(objectId, forceAction)
+        if obj_info is None:
+            return False, error, None
+        if not obj_info["sliceable"] or obj_info["isSliced"]:
+            return False, "{} can't be sliced".format(objectId), None
+        held_types = {held["objectType"] for held in self.inventory}
+        if not held_types & {"Knife", "ButterKnife"}:
+            return False, "agent is not holding a knife", None
+
+        obj_info["isSliced"] = True
+        obj_info["visible"] = False
+        for i in range(4):
+            slice_info = copy.deepcopy(obj_info)
+            slice_info.update(
+                objectId="{}|{}Sliced_{}".format(objectId, obj_info["objectType"], i),
+                name="{}_Slice_{}".format(obj_info["assetId"], i + 1),
+                objectType=obj_info["objectType"] + "Sliced",
+                sliceable=False,
+                isSliced=False,
+            )
+            slice_info["position"]["x"] += (i - 1.5) * 0.02
+            self.set_bbox(slice_info, 0.1)
+            self.objects.append(slice_info)
+        self.objects.remove(obj_info)
+        return True, "", None
+
+    def handle_PutObject(self, objectId: str, forceAction: bool = False, **kwargs):
+        recep_info, error = self.check_interactable(objectId, forceAction)
+        if recep_info is None:
+            return False, error, None
+        if len(self.inventory) == 0:
+            return False, "agent is not holding an object", None
+        if not recep_info["receptacle"]:
+            return False, "{} is not a receptacle".format(objectId), None
+        obj_info = self.get_object(self.inventory[0]["objectId"])
+        obj_info["position"] = dict(recep_info["position"])
+        obj_info["position"]["y"] += recep_info["axisAlignedBoundingBox"]["size"]["y"]
+        obj_info["parentReceptacles"] = [objectId]
+        self.set_bbox(obj_info, obj_info["axisAlignedBoundingBox"]["size"]["x"])
+        self.inventory = []
+        return True, "", None
+
+    def handle_DropHandObject(self, **kwargs):
+        if len(self.inventory) == 0:
+            return False, "agent is not holding an object", None
+        self.inventory = []
+        return True, "", None
+
+    def handle_TeleportObject(
+        self,
+        objectId: str,
+        position: dict,
+        rotation: Optional[dict] = None,
+        forceAction: bool = False,
+        **kwargs
+    ):
+        obj_info = self.get_object(objectId)
+        if obj_info is None:
+            return False, "{} not found".format(objectId), None
+        obj_info["position"] = dict(position)
+        if rotation is not None:
+            obj_info["rotation"] = dict(rotation)
+        self.set_bbox(obj_info, obj_info["axisAlignedBoundingBox"]["size"]["x"])
+        return True, "", None
+
+    def handle_SetObjectPoses(self, objectPoses: List[dict], **kwargs):
+        by_name = {obj_info["name"]: obj_info for obj_info in self.objects}
+        for pose in objectPoses:
+            obj_info = by_name.get(pose["objectName"])
+            if obj_info is not None:
+                obj_info["position"] = dict(pose["position"])
+                obj_info["rotation"] = dict(pose["rotation"])
+                self.set_bbox(obj_info, obj_info["axisAlignedBoundingBox"]["size"]["x"])
+        return True, "", None
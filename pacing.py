@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+
+class Pacer:
+    """
+    Throttles simulator steps, keeping the time spent sleeping apart from the time
+    spent waiting on the simulator
+
+    Modes:
+        none: never sleeps, for batch runs
+        fixed: sleeps `interval` before every step
+        adaptive: only sleeps what is left of `interval` since the previous step was
+            sent, so a viewer gets at most one frame per interval while simulator and
+            planning time count towards it instead of being paid on top of it
+    """
+
+    modes = ("none", "fixed", "adaptive")
+
+    def __init__(self, mode: str = "fixed", interval: float = 0.15):
+        if mode not in self.modes:
+            raise ValueError(
+                "unknown pacing mode {}, expected one of {}".format(mode, self.modes)
+            )
+        self.mode = mode
+        self.interval = interval
+        self.sleep_time = 0.0
+        self.sim_time = 0.0
+        self.last_step = None
+
+    def delay(self) -> float:
+        """Returns how long to wait before the next step"""
+        if self.mode == "fixed":
+            return self.interval
+        if self.mode == "adaptive" and self.last_step is not None:
+            return max(0.0, self.interval - (time.perf_counter() - self.last_step))
+        return 0.0
+
+    def wait(self):
+        """Sleeps before the next step as required by the mode"""
+        delay = self.delay()
+        if delay > 0:
+            start = time.perf_counter()
+            time.sleep(delay)
+            self.sleep_time += time.perf_counter() - start
+
+    async def wait_async(self):
+        """Like wait, but sleeps without blocking the running event loop"""
+        delay = self.delay()
+        if delay > 0:
+            start = time.perf_counter()
+            await asyncio.sleep(delay)
+            self.sleep_time += time.perf_counter() - start
+
+    def record(self, start: float, end: float):
+        """
+        Records a simulator step that started at time.perf_counter() start and
+        returned at end
+        """
+        self.last_step = start
+        self.sim_time += end - start
@@ -1,12 +1,15 @@
+import heapq
 import logging
-import math
-from typing import Iterator, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Collection, Generator, List, Optional, Tuple
 
 import numpy as np
-from ai2thor.server import Event
 
 import utils
-from interface import Env
+from distances import APPROACH_RADIUS, field_key
+from events import Event
+from interface import Compute, Env, Steps
 from utils import Action, NavigationState, Pos2D
 
 # import utils_initial as utils
@@ -15,201 +18,382 @@ from utils import Action, NavigationState, Pos2D
 
 
 class NavigationPlanner:
-    def __init__(self, env: Env, goal: Pos2D):
+    goal_radius: float = APPROACH_RADIUS
+    modes = ("lrta", "astar", "field", "hierarchical")
+
+    def __init__(
+        self,
+        env: Env,
+        goal: Pos2D,
+        mode: str = "astar",
+        region: Optional[np.ndarray] = None,
+        path: Optional[List[int]] = None,
+        execute: bool = True,
+        k: int = 20,
+    ):
+        """
+        region: reachable indices to get onto instead of anywhere within goal_radius
+            of goal, they have to be within goal_radius of goal
+        path: precomputed path to follow (all but lrta mode), replanned if it
+            does not start at the agent's position
+        execute: navigate right away, otherwise the planner is only used to find
+            paths
+        k: successors scored per step in lrta mode
+        """
         self.env = env
         self.goal = NavigationState(*goal)
-        self.heuristics = {}
-
-        # self.plan2(env.event, 1)
-        self.plan(env.event)
+        self.region = region
+        self.path = path
+        self.k = k
+        self.mode = mode
+        self.expansions = 0
+        self.steps = 0
+        self.reached = False
+        self.replanned = False
+        if mode not in self.modes:
+            raise ValueError(
+                "unknown navigation mode {}, expected one of {}".format(
+                    mode, self.modes
+                )
+            )
+        if execute:
+            env.run(self.navigate(env.event))
+
+    def navigate(self, event: Event) -> Steps:
+        """Navigates to the goal with the planner's mode, as steps, see Env.run"""
+        if self.mode == "lrta":
+            yield from self.plan(event, self.k)
+        elif self.mode in ("astar", "hierarchical", "field"):
+            yield from self.plan_path(event)
+        else:
+            raise ValueError("unknown navigation mode {}".format(self.mode))
+        logging.info(
+            "navigation ({}) to {}: {} expansions, {} steps".format(
+                self.mode, self.goal, self.expansions, self.steps
+            )
+        )
 
     @staticmethod
-    def go_to_obj(env: Env, object_id: str):
-
-        goal = utils.get_obj_loc(env.event, object_id)
-        NavigationPlanner(env, goal)
-
-    def get_heuristics(self, state: Optional[NavigationState]) -> float:
-
-        try:
-            return self.heuristics[state]
-        except KeyError:
-            if state:
-                self.heuristics[state] = state - self.goal
-                return self.heuristics[state]
-            else:
-                return None
-
-    def is_valid(self, state: NavigationState) -> bool:
-        for position in self.reachable_positions:
-            if math.isclose(position["x"], state.x, abs_tol=0.005) and math.isclose(
-                position["z"], state.z, abs_tol=0.005
-            ):
-                return True
-        return False
+    def go_to_obj(
+        env: Env, object_id: str, mode: str = "astar"
+    ) -> Optional["NavigationPlanner"]:
+
+        goal = utils.get_obj_loc(env.index, object_id)
+        if goal is None:
+            return None
+        return NavigationPlanner(env, goal, mode)
+
+    def is_goal(self, state: NavigationState) -> bool:
+        """
+        Whether the reachable position nearest to state is within goal_radius of the
+        goal, or on the region if there is one. Decided on the grid like the goal
+        mask of the searches, so a state the searches start from at the goal is one
+        """
+        grid = self.env.grid
+        idx = grid.nearest(state.x, state.z)
+        if idx < 0:
+            return False
+        if self.region is None:
+            x, z = grid.positions[idx]
+            return bool(np.hypot(x - self.goal.x, z - self.goal.z) < self.goal_radius)
+        return bool(np.isin(idx, self.region))
 
-    def get_k_successors(
-        self, state: NavigationState, k: int
-    ) -> Iterator[Tuple["NavigationState", Action]]:
-        position_dist = []
-        for position in self.env.reachables:
-            d = state - position
-            position_dist.append((position, d))
-        position_dist.sort(key=lambda x: x[1])
-        res = []
-        i = 0
-        while i < k and len(position_dist) > 0:
-            res.append(position_dist.pop(0))
-            i += 1
-
-        for (pos, d) in res:
+    @staticmethod
+    def get_move(
+        state: NavigationState, pos: dict, target_theta: Optional[float] = None
+    ) -> Tuple[NavigationState, Action]:
+        """Returns the state reached by facing and teleporting to pos, and the action"""
+        if target_theta is None:
             dx = pos["x"] - state.x
             dz = pos["z"] - state.z
             target_theta = np.arctan2(dx, dz) / np.pi * 180
 
-            actions = []
-            actions.append(
-                dict(action="Teleport", rotation=dict(x=0, y=target_theta, z=0))
-            )
-            actions.append(dict(action="Teleport", position=pos))
-            yield (
-                NavigationState(pos["x"], pos["z"], target_theta),
-                Action(actions),
-            )
-
-    def plan(self, event: Event):
-        """LRTA* with K=1"""
+        actions = []
+        actions.append(dict(action="Teleport", rotation=dict(x=0, y=target_theta, z=0)))
+        actions.append(dict(action="Teleport", position=pos))
+        return NavigationState(pos["x"], pos["z"], target_theta), Action(actions)
+
+    def score_successors(
+        self, state: NavigationState, k: int, heuristics: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Scores the k nearest reachable positions as successors of state in one batch,
+        returns their reachable indices, headings and f values. The move to each of
+        them is a rotation teleport followed by a position teleport
+        """
+        indices, _ = self.env.grid.k_nearest(state.x, state.z, k)
+        offsets = self.env.grid.positions[indices] - (state.x, state.z)
+        headings = np.arctan2(offsets[:, 0], offsets[:, 1]) / np.pi * 180
+        costs = np.full(len(indices), 2 * Action.teleport_cost)
+        return indices, headings, heuristics[indices] + costs
+
+    def plan(self, event: Event, k: int = 20) -> Steps:
+        """LRTA* with K=1, scoring k successors per step"""
 
         snap_action = NavigationState.snap_action(event)
-        self.env.step(snap_action)
+        yield from self.env.action_steps(snap_action)
         current = NavigationState.from_event(self.env.event)
+        # the heuristics are a dense array over the cells of the reachable positions
+        current_idx = self.env.grid.index_of(current)
+        if current_idx < 0:
+            current_idx = self.env.grid.nearest(current.x, current.z)
         print("CURRENT: ", current)
         print("GOAL: ", self.goal)
 
+        # learned heuristics, initialized with the distance to the goal
+        heuristics = np.hypot(
+            self.env.grid.positions[:, 0] - self.goal.x,
+            self.env.grid.positions[:, 1] - self.goal.z,
+        )
+
         while True:
 
-            successor = None
-            successor_action = None
-            successor_f = None
-            for succ, action in self.get_k_successors(current, 20):
-                heuristic = self.get_heuristics(succ)
-                f_value = heuristic + action.cost
-                if successor_f is None or f_value < successor_f:
-                    successor = succ
-                    successor_action = action
-                    successor_f = f_value
-
-            if successor is None:
+            self.expansions += 1
+            indices, headings, f_values = self.score_successors(
+                current, k, heuristics
+            )
+
+            if len(indices) == 0:
                 print("Successor None")
                 return
 
-            if current - self.goal < 0.9:
+            if self.is_goal(current):
                 # goal check
                 print("Goal Reached")
+                self.reached = True
                 return
 
-            if self.env.step(successor_action):
-                self.heuristics[current] = successor_f
+            best = int(np.argmin(f_values))
+            successor_idx = int(indices[best])
+            successor, successor_action = self.get_move(
+                current, self.env.reachables[successor_idx], float(headings[best])
+            )
+
+            self.steps += 1
+            if (yield from self.env.action_steps(successor_action)):
+                heuristics[current_idx] = f_values[best]
                 current = successor
+                current_idx = successor_idx
+
+    def get_lower_bounds(self, positions: np.ndarray) -> np.ndarray:
+        """Distance from positions to the goal region, admissible and consistent"""
+        goal_dist = np.hypot(
+            positions[:, 0] - self.goal.x, positions[:, 1] - self.goal.z
+        )
+        return np.maximum(goal_dist - self.goal_radius, 0)
+
+    def get_goal_mask(self) -> np.ndarray:
+        """Whether each of the reachable positions is a goal"""
+        grid = self.env.grid
+        if self.region is None:
+            goal_dist = np.hypot(
+                grid.positions[:, 0] - self.goal.x, grid.positions[:, 1] - self.goal.z
+            )
+            return goal_dist < self.goal_radius
+        in_goal = np.zeros(len(grid), dtype=bool)
+        in_goal[self.region] = True
+        return in_goal
+
+    def search(
+        self,
+        start: int,
+        blocked: Collection[int] = (),
+        allowed: Optional[np.ndarray] = None,
+    ) -> Optional[List[int]]:
+        """
+        A* over the 8-connected graph of reachable positions, from the reachable index
+        start to the closest index within goal_radius of the goal. Returns the path as
+        a list of reachable indices including start, or None if the goal is unreachable
+
+        allowed: boolean mask of the reachable positions the path may go through
+        """
+        grid = self.env.grid
+        neighbors = grid.neighbors
+        step_costs = grid.step_costs.tolist()
+        heuristics = self.get_lower_bounds(grid.positions)
+        in_goal = self.get_goal_mask()
+        if allowed is not None:
+            # search the subgraph of the allowed positions, renumbered in order, the
+            # extra last entry maps the -1 of missing neighbours to -1
+            nodes = np.nonzero(allowed)[0]
+            local = np.full(len(grid) + 1, -1)
+            local[nodes] = np.arange(len(nodes))
+            if local[start] < 0:
+                return None
+            neighbors = local[neighbors[nodes]]
+            heuristics, in_goal = heuristics[nodes], in_goal[nodes]
+            blocked = set(local[list(blocked)].tolist()) if blocked else ()
+            path = self.search_graph(
+                int(local[start]), neighbors, step_costs, heuristics, in_goal, blocked
+            )
+            return nodes[path].tolist() if path is not None else None
+        return self.search_graph(
+            start, neighbors, step_costs, heuristics, in_goal, blocked
+        )
+
+    def search_graph(
+        self,
+        start: int,
+        neighbors: np.ndarray,
+        step_costs: List[float],
+        heuristics: np.ndarray,
+        in_goal: np.ndarray,
+        blocked: Collection[int],
+    ) -> Optional[List[int]]:
+        """A* over a graph given as an (N, 8) neighbour array, see search"""
+        neighbors = neighbors.tolist()
+        heuristics, in_goal = heuristics.tolist(), in_goal.tolist()
+
+        g_values = {start: 0.0}
+        parents = {start: None}
+        closed = set()
+        frontier = [(heuristics[start], start)]
+        while frontier:
+            _, idx = heapq.heappop(frontier)
+            if idx in closed:
+                continue
+            closed.add(idx)
+            self.expansions += 1
+            if in_goal[idx]:
+                path = []
+                while idx is not None:
+                    path.append(idx)
+                    idx = parents[idx]
+                return path[::-1]
+
+            for succ, cost in zip(neighbors[idx], step_costs):
+                if succ < 0 or succ in blocked or succ in closed:
+                    continue
+                g_value = g_values[idx] + cost
+                if g_value < g_values.get(succ, np.inf):
+                    g_values[succ] = g_value
+                    parents[succ] = idx
+                    heapq.heappush(frontier, (g_value + heuristics[succ], succ))
+        return None
+
+    def plan_path(self, event: Event) -> Steps:
+        """
+        Finds the whole path with the planner's mode (see find_path), then executes
+        it one teleport per straight run. Positions that fail to be reached are
+        blocked and the path is replanned from there. Blocked positions aren't part
+        of the cached fields of field mode, so the path around them is searched with
+        A*
+        """
 
-    def plan2(self, event: Event, k: int):
-        """LRTA* with K=k"""
         snap_action = NavigationState.snap_action(event)
-        self.env.step(snap_action)
+        yield from self.env.action_steps(snap_action)
         current = NavigationState.from_event(self.env.event)
+        blocked = set()
 
-        while True:
-            # print(current)
-            """Dictionary to store information of states"""
-            expanded_state_dict = {
-                current: dict(
-                    parent_state=None,
-                    parent_action=None,
-                    all_expanded=False,
-                    goal_reached=False,
-                )
-            }
-            """List to track the order of states being expanded"""
-            expanded_state_order = []
-            expanded_state_order.append(current)
-            expanding_id = 0
-            count = 0
-
-            if current - self.goal <= 1.0:
+        while not self.is_goal(current):
+            start = self.env.grid.nearest(current.x, current.z)
+            path = yield from self.next_path(start, blocked)
+            if path is None:
+                logging.warning("no path found to {}".format(self.goal))
                 return
-
-            """Expand k states and store corresponding information into dictionary"""
-            while count < k:
-                expanding_state = expanded_state_order[expanding_id]
-                if expanded_state_dict[expanding_state]["goal_reached"]:
-                    break
-
-                total_succ_count = 0
-                invalid_succ_count = 0
-                for succ, action in expanding_state.get_successors():
-                    total_succ_count += 1
-                    if count >= k:
-                        break
-                    if succ is None:
-                        break
-                    if succ in expanded_state_dict:
-                        continue
-                    if not self.is_valid(succ):
-                        NavigationState.add_invalid(succ)
-                        invalid_succ_count += 1
-                        continue
-
-                    expanded_state_info = dict(
-                        parent_state=expanding_state,
-                        parent_action=action,
-                        all_expanded=False,
-                        goal_reached=False,
-                    )
-                    expanded_state_dict[succ] = expanded_state_info
-                    expanded_state_order.append(succ)
-                    count += 1
-                    if succ - self.goal <= 1.0:
-                        expanded_state_dict[succ]["goal_reached"] = True
-                if total_succ_count == invalid_succ_count:
-                    break
-
-                expanding_id += 1
-                expanded_state_dict[expanding_state]["all_expanded"] = True
-
-            min_f = np.inf
-            min_f_state = None
-            for state in expanded_state_order[::-1]:
-                if expanded_state_dict[state]["all_expanded"]:
-                    break
-                if expanded_state_dict[state]["goal_reached"]:
-                    min_f_state = state
-                    self.heuristics[state] = 0.0
-                    break
-
-                for succ, action in state.get_successors():
-                    if succ in expanded_state_dict:
-                        continue
-                    if self.is_valid(succ):
-                        heuristic = self.get_heuristics(succ)
-                        f_value = heuristic + action.cost
-                        if f_value <= min_f:
-                            min_f = f_value
-                            min_f_state = state
-
-            self.heuristics[min_f_state] = min_f
-            next_state = min_f_state
-            next_state_parent = expanded_state_dict[next_state]["parent_state"]
-            while expanded_state_dict[next_state_parent]["parent_state"] is not None:
-                backtrack_state = expanded_state_dict[next_state]["parent_state"]
-                self.heuristics[backtrack_state] = (
-                    self.heuristics[next_state]
-                    + expanded_state_dict[next_state]["parent_action"].cost
-                )
-                next_state = backtrack_state
-                next_state_parent = expanded_state_dict[next_state]["parent_state"]
-
-            current = next_state
-            self.env.step(expanded_state_dict[current]["parent_action"])
+            current = yield from self.execute_path(current, path, blocked)
+        self.reached = True
+
+    def search_hierarchical(
+        self, start: int, blocked: Collection[int] = ()
+    ) -> Optional[List[int]]:
+        """
+        A* over the coarse grid of the scene, then A* on the fine grid restricted to
+        the corridor around the coarse path, so long range moves only expand the
+        positions along the way instead of every position closer to the goal. Falls
+        back to an unrestricted search if the corridor is cut off by blocked positions
+        """
+        coarse = self.env.coarse_grid
+        nodes, expansions = coarse.search(
+            start, self.get_goal_mask(), self.get_lower_bounds(coarse.centroids)
+        )
+        self.expansions += expansions
+        if nodes is None:
+            return None
+        path = self.search(start, blocked, coarse.corridor(nodes))
+        if path is None:
+            logging.debug("corridor to {} is blocked, searching all".format(self.goal))
+            path = self.search(start, blocked)
+        return path
+
+    def find_path(
+        self, start: int, blocked: Collection[int] = ()
+    ) -> Optional[List[int]]:
+        """
+        Path from the reachable index start to the goal, searched with A*, along the
+        coarse grid in hierarchical mode, or, in field mode, descended along the
+        goal's distance field. Only reads the grid and the scene's caches, so it can
+        run while another thread steps the simulator
+        """
+        if self.mode == "hierarchical":
+            return self.search_hierarchical(start, blocked)
+        if self.mode != "field":
+            return self.search(start, blocked)
+        path = self.env.grid.descend(start, self.get_field(), blocked)
+        if path is None or len(path) < 2:
+            # blocked, or the field was cached for a goal a hair away
+            return self.search(start, blocked)
+        if self.region is not None and not np.isin(path[-1], self.region):
+            # the field leads into the approach area, the region is a hop away
+            hop = self.search(path[-1], blocked)
+            if hop is None:
+                return None
+            path = path + hop[1:]
+        return path
+
+    def next_path(
+        self, start: int, blocked: set
+    ) -> Generator[Compute, Any, Optional[List[int]]]:
+        """
+        The precomputed path if it starts at start and avoids blocked, otherwise a
+        path found from start, as steps computing it
+        """
+        path, self.path = self.path, None
+        if path is not None:
+            if len(path) > 0 and path[0] == start and blocked.isdisjoint(path):
+                return path
+            logging.debug("precomputed path diverged from {}, replanning".format(start))
+            self.replanned = True
+        return (yield Compute(partial(self.find_path, start, blocked)))
+
+    def get_field(self) -> np.ndarray:
+        """
+        Distance field to the goal region over the reachable positions, from the
+        environment's field cache when the same goal, up to a millimeter, was
+        navigated to before or is an object that did not move since setup
+        """
+        grid = self.env.grid
+        key = field_key(grid, self.goal.x, self.goal.z, self.goal_radius)
+        field = self.env.goal_fields.get(key)
+        if field is None:
+            region = grid.within(self.goal.x, self.goal.z, self.goal_radius)
+            field = grid.distances(region).astype(np.float32)
+            self.env.goal_fields.put(key, field)
+            self.expansions += len(field)
+        return field
+
+    def execute_path(
+        self, current: NavigationState, path: List[int], blocked: set
+    ) -> Generator[dict, Event, NavigationState]:
+        """
+        Teleports along path, one rotation and one teleport per straight segment in
+        line of sight (see ReachableGrid.shortcut). Stops at the first position that
+        fails to be reached, which is added to blocked. Returns the state the agent
+        ends up in
+        """
+        path = self.env.grid.shortcut(path)
+        # the agent is already on the first position unless that is all there is,
+        # then it is teleported exactly onto it so the next step makes progress
+        if len(path) > 1 and self.env.grid.contains(current.x, current.z):
+            path = path[1:]
+        for idx in path:
+            succ, action = self.get_move(current, self.env.reachables[idx])
+            self.steps += 1
+            if not (yield from self.env.action_steps(action)):
+                blocked.add(idx)
+                return NavigationState.from_event(self.env.event)
+            current = succ
+        return current
 
 
 # class VisualSearchPlanner:
@@ -218,13 +402,84 @@ class NavigationPlanner:
 #         self.object_id = object_id
 
 
-def handle_look_at(env: Env, object_id: str):
+class PathPrefetcher:
+    """
+    Plans the path of the next navigation in a background thread, from the position
+    the agent is predicted to be in once the current skill is done, so planning it
+    overlaps with the simulator executing the current skill
+
+    A prefetched path is only handed out for the same goal and start it was planned
+    for, otherwise it is dropped and the caller plans from the actual position.
+    """
+
+    def __init__(self, env: Env, mode: str = "field"):
+        self.env = env
+        self.mode = mode
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # (goal, region, start, future of (path, expansions))
+        self.pending: Optional[tuple] = None
+        self.hits = 0
+        self.misses = 0
+
+    def plan(
+        self, goal: Pos2D, region: Optional[np.ndarray], start: int
+    ) -> Tuple[Optional[List[int]], int]:
+        planner = NavigationPlanner(self.env, goal, self.mode, region, execute=False)
+        return planner.find_path(start), planner.expansions
+
+    def submit(self, goal: Pos2D, region: Optional[np.ndarray], start: int):
+        """Starts planning from the reachable index start to goal, or onto region"""
+        future = self.executor.submit(self.plan, goal, region, start)
+        self.pending = (goal, region, start, future)
+
+    def take_steps(
+        self, goal: Pos2D, region: Optional[np.ndarray], start: int
+    ) -> Generator[Future, Future, Tuple[Optional[List[int]], int]]:
+        """
+        Returns the prefetched path to goal and the expansions it took, as steps
+        that wait for it by yielding its future. The path is None if nothing was
+        prefetched for this goal and start
+        """
+        if self.pending is None:
+            return None, 0
+        pending_goal, pending_region, pending_start, future = self.pending
+        self.pending = None
+        if pending_goal != goal or pending_region is not region:
+            logging.debug("prefetched path to {} is not needed".format(pending_goal))
+            self.misses += 1
+            return None, 0
+        if pending_start != start:
+            logging.debug("agent is not where {} was planned from".format(goal))
+            self.misses += 1
+            return None, 0
+        error = (yield future).exception()
+        if error is not None:
+            logging.warning("prefetching path to {} failed: {}".format(goal, error))
+            self.misses += 1
+            return None, 0
+        self.hits += 1
+        return future.result()
+
+    def shutdown(self):
+        """Drops the pending path if it is still queued and waits for the thread"""
+        self.pending = None
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def handle_look_at(env: Env, object_id: str) -> bool:
+    return env.run(look_at_steps(env, object_id))
+
+
+def look_at_steps(env: Env, object_id: str) -> Steps:
+    """handle_look_at as steps, see Env.run"""
 
     # rotate
     print("TRY LOOK AT", object_id)
     current = NavigationState.from_event(env.event)
-    object_pos = utils.get_obj_loc3d(env.event, object_id)
+    object_pos = utils.get_obj_loc3d(env.index, object_id)
     print(object_pos)
+    if object_pos is None:
+        return False
     dx = object_pos.x - current.x
     dy = object_pos.y - env.event.metadata["agent"]["position"]["y"] - 0.675
     dz = object_pos.z - current.z
@@ -235,18 +490,25 @@ def handle_look_at(env: Env, object_id: str):
     print("current: ", current.theta)
     action_dict = utils.get_rotation(target_theta - current.theta)
     logging.debug("generated action dict: {}".format(action_dict))
-    env.step(utils.Action([action_dict]))
+    rotated = yield from env.action_steps(utils.Action([action_dict]))
 
     # update horizon
     target_horizon = np.arctan(-dy / np.sqrt(dx ** 2 + dz ** 2)) / np.pi * 180
     change = target_horizon - env.event.metadata["agent"]["cameraHorizon"]
     if target_horizon < 0:
-        env.step(utils.Action([dict(action="LookUp", degrees=-change)]))
+        look = dict(action="LookUp", degrees=-change)
     else:
-        env.step(utils.Action([dict(action="LookDown", degrees=change)]))
+        look = dict(action="LookDown", degrees=change)
+    looked = yield from env.action_steps(utils.Action([look]))
+    return rotated and looked
 
 
 def set_object_pose(env: Env, positions: dict, rotations: dict):
+    env.run(set_object_pose_steps(env, positions, rotations))
+
+
+def set_object_pose_steps(env: Env, positions: dict, rotations: dict) -> Steps:
+    """set_object_pose as steps, see Env.run"""
 
     objects = [
         dict(
@@ -257,23 +519,32 @@ def set_object_pose(env: Env, positions: dict, rotations: dict):
         for x in env.event.metadata["objects"]
         if x["moveable"] or x["pickupable"]
     ]
-    env.api_step(action="SetObjectPoses", objectPoses=objects)
-    env.api_step(action="Done")
+    yield dict(action="SetObjectPoses", objectPoses=objects)
+    yield dict(action="Done")
+
 
+def handle_put_obj(env: Env, recep_id: str) -> bool:
+    """
+    Manually handle putting down sliced objects, returns if the object in hand was put
+    down
+    """
+    return env.run(put_obj_steps(env, recep_id))
 
-def handle_put_obj(env: Env, recep_id: str):
-    """Manually handle putting down sliced objects"""
+
+def put_obj_steps(env: Env, recep_id: str) -> Steps:
+    """handle_put_obj as steps, see Env.run"""
 
     try:
         object_in_hand = env.event.metadata["inventoryObjects"][0]["objectId"]
     except IndexError:
         logging.warning("agent has no object in hand to be put down")
+        return False
     else:
-        event = env.api_step(action="PutObject", objectId=recep_id)
+        event = yield dict(action="PutObject", objectId=recep_id)
         if event.metadata["lastActionSuccess"]:
             if "Slice" in object_in_hand:
-                current_object = event.get_object(object_in_hand)
-                target_object = event.get_object(recep_id)
+                current_object = env.index.get(object_in_hand)
+                target_object = env.index.get(recep_id)
                 target_bbox = target_object["axisAlignedBoundingBox"]
                 rotation = current_object["rotation"]
                 position = current_object["position"]
@@ -282,14 +553,15 @@ def handle_put_obj(env: Env, recep_id: str):
                     max(pt[1] for pt in target_bbox["cornerPoints"])
                     + target_bbox["size"]["y"] / 2
                 )
-                set_object_pose(
+                yield from set_object_pose_steps(
                     env,
                     {object_in_hand: position},
                     {object_in_hand: rotation},
                 )
+            return True
         elif "Slice" in object_in_hand:
-            current_object = event.get_object(object_in_hand)
-            target_object = event.get_object(recep_id)
+            current_object = env.index.get(object_in_hand)
+            target_object = env.index.get(recep_id)
             target_bbox = target_object["axisAlignedBoundingBox"]
             rotation = current_object["rotation"]
             position = target_bbox["center"]
@@ -298,13 +570,15 @@ def handle_put_obj(env: Env, recep_id: str):
                 max(pt[1] for pt in target_bbox["cornerPoints"])
                 + target_bbox["size"]["y"]
             )
-            set_object_pose(
+            yield from set_object_pose_steps(
                 env,
                 {object_in_hand: position},
                 {object_in_hand: dict(x=90, y=0, z=0)},
             )
-            env.api_step(action="DropHandObject", forceAction=True)
+            event = yield dict(action="DropHandObject", forceAction=True)
+            return event.metadata["lastActionSuccess"]
         else:
             logging.warning(
                 "putting {} onto {} failed".format(object_in_hand, recep_id)
             )
+            return False
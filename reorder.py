@@ -0,0 +1,147 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from distances import ObjectDistances
+from symbolic import Domain, GroundedAction, SymbolicPlanner
+
+
+def interferes(a: GroundedAction, b: GroundedAction) -> bool:
+    """
+    Checks if swapping two adjacent steps could change the outcome of the plan, i.e.
+    if either one's effects touch the other's preconditions or their effects conflict
+    """
+    effects_a = a.add | a.delete
+    effects_b = b.add | b.delete
+    return bool(
+        effects_a & (b.pre_true | b.pre_false)
+        or effects_b & (a.pre_true | a.pre_false)
+        or a.add & b.delete
+        or a.delete & b.add
+    )
+
+
+def get_predecessors(actions: Sequence[Optional[GroundedAction]]) -> List[int]:
+    """
+    Returns for every step the bitset of earlier steps that have to stay before it,
+    steps that are not grounded actions of the domain keep their place
+    """
+    predecessors = []
+    for j, b in enumerate(actions):
+        mask = 0
+        for i, a in enumerate(actions[:j]):
+            if a is None or b is None or interferes(a, b):
+                mask |= 1 << i
+        predecessors.append(mask)
+    return predecessors
+
+
+def get_travel_costs(
+    distances: ObjectDistances, start: int, targets: Sequence[str]
+) -> np.ndarray:
+    """
+    Estimated travel between the reachable position start (index 0) and the objects
+    of targets (index 1 and on)
+    """
+    costs = np.zeros((len(targets) + 1, len(targets) + 1))
+    for j, target_id in enumerate(targets, 1):
+        costs[0, j] = distances.from_position(start, target_id)
+        for i, source_id in enumerate(targets, 1):
+            costs[i, j] = distances.between(source_id, target_id)
+    return costs
+
+
+def get_travel(locations: Sequence[Optional[int]], costs: np.ndarray) -> float:
+    """Estimated travel when visiting locations in order, starting at location 0"""
+    travel, current = 0.0, 0
+    for location in locations:
+        if location is not None:
+            travel += costs[current, location]
+            current = location
+    return travel
+
+
+def order_steps(
+    predecessors: Sequence[int],
+    locations: Sequence[Optional[int]],
+    costs: np.ndarray,
+    max_states: int = 100000,
+) -> List[int]:
+    """
+    Finds the order of steps respecting predecessors with the least travel, where a
+    step at location l (an index into costs, None for steps that don't move) is
+    reached from the location of the last step that moved, starting at location 0
+
+    Dynamic programming over the sets of steps done so far. Ties keep the original
+    order, and so does running into max_states.
+    """
+    n = len(predecessors)
+    # (done steps, location) -> (travel, order)
+    layer: Dict[Tuple[int, int], Tuple[float, Tuple[int, ...]]] = {(0, 0): (0.0, ())}
+    states = 0
+    for _ in range(n):
+        next_layer = {}
+        for (done, location), (travel, order) in layer.items():
+            for step in range(n):
+                if done >> step & 1 or predecessors[step] & ~done:
+                    continue
+                target = locations[step]
+                if target is None:
+                    key, value = (done | 1 << step, location), (travel, order + (step,))
+                else:
+                    value = (travel + costs[location, target], order + (step,))
+                    key = (done | 1 << step, target)
+                best = next_layer.get(key)
+                if best is None or value[0] < best[0] - 1e-9 or (
+                    value[0] <= best[0] + 1e-9 and value[1] < best[1]
+                ):
+                    next_layer[key] = value
+        states += len(next_layer)
+        if states > max_states:
+            logging.warning("too many orders to compare, keeping the plan's order")
+            return list(range(n))
+        layer = next_layer
+
+    travel, order = min(layer.values())
+    logging.debug("least travel {:.2f} with order {}".format(travel, order))
+    return list(order)
+
+
+def reorder_plan(
+    domain: Domain,
+    plan: Sequence[str],
+    distances: ObjectDistances,
+    start: int,
+    targets: Sequence[Optional[str]],
+) -> List[str]:
+    """
+    Reorders the independent steps of plan, given the id of the object each step
+    goes to (None if it doesn't move), to minimize the estimated travel from the
+    reachable position start
+    """
+    actions = {str(action): action for action in SymbolicPlanner(domain).actions}
+    predecessors = get_predecessors(
+        [actions.get(step.replace(" ", "")) for step in plan]
+    )
+
+    unique_targets = []
+    locations = []
+    for target in targets:
+        if target is None or target not in distances:
+            locations.append(None)
+            continue
+        if target not in unique_targets:
+            unique_targets.append(target)
+        locations.append(unique_targets.index(target) + 1)
+
+    costs = get_travel_costs(distances, start, unique_targets)
+    order = order_steps(predecessors, locations, costs)
+
+    logging.info(
+        "reordered plan, estimated travel {:.2f} instead of {:.2f}".format(
+            get_travel([locations[i] for i in order], costs),
+            get_travel(locations, costs),
+        )
+    )
+    return [plan[i] for i in order]
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from distances import ObjectDistances
+from grid import ReachableGrid
+
+# bump whenever the layout of the cached arrays changes
+CACHE_VERSION = 1
+
+
+class SceneData(NamedTuple):
+    poses: List[dict]
+    reachables: List[dict]
+    grid: ReachableGrid
+
+
+def get_pose_hash(pose_file: str) -> str:
+    """Hashes the pose file content, "none" if there is no pose file"""
+    if not os.path.isfile(pose_file):
+        return "none"
+    with open(pose_file, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def load_poses(pose_file: str) -> List[dict]:
+    if not os.path.isfile(pose_file):
+        return []
+    with open(pose_file) as f:
+        return json.load(f)
+
+
+class SceneCache:
+    """
+    On-disk cache of the per floorplan scene setup, the object poses to apply and the
+    reachable positions with their grid, keyed by floorplan and pose file hash, and
+    of the object distances over that grid
+    """
+
+    def __init__(self, root: str = ".scene_cache"):
+        self.root = root
+
+    def get_path(self, floorplan: str, pose_file: str) -> str:
+        return os.path.join(
+            self.root,
+            "{}-{}-v{}.npz".format(floorplan, get_pose_hash(pose_file), CACHE_VERSION),
+        )
+
+    def load(self, floorplan: str, pose_file: str) -> Optional[SceneData]:
+        path = self.get_path(floorplan, pose_file)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as arrays:
+                arrays = dict(arrays)
+        except (OSError, ValueError) as e:
+            logging.warning("ignoring unreadable scene cache {}: {}".format(path, e))
+            return None
+        if int(arrays.pop("version")) != CACHE_VERSION:
+            return None
+
+        poses = [
+            dict(
+                objectName=name,
+                position=dict(x=px, y=py, z=pz),
+                rotation=dict(x=rx, y=ry, z=rz),
+            )
+            for name, (px, py, pz), (rx, ry, rz) in zip(
+                arrays.pop("pose_names").tolist(),
+                arrays.pop("pose_positions").tolist(),
+                arrays.pop("pose_rotations").tolist(),
+            )
+        ]
+        grid = ReachableGrid.from_arrays(arrays)
+        logging.info("loaded scene {} from {}".format(floorplan, path))
+        return SceneData(poses, grid.reachables, grid)
+
+    def save(self, floorplan: str, pose_file: str, data: SceneData):
+        path = self.get_path(floorplan, pose_file)
+        os.makedirs(self.root, exist_ok=True)
+        axes = ("x", "y", "z")
+        arrays = data.grid.to_arrays()
+        arrays.update(
+            version=np.array(CACHE_VERSION),
+            pose_names=np.array([pose["objectName"] for pose in data.poses], dtype=str),
+            pose_positions=np.array(
+                [[pose["position"][a] for a in axes] for pose in data.poses]
+            ).reshape(-1, 3),
+            pose_rotations=np.array(
+                [[pose["rotation"][a] for a in axes] for pose in data.poses]
+            ).reshape(-1, 3),
+        )
+        # write then rename, so concurrent readers never see a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        logging.info("saved scene {} to {}".format(floorplan, path))
+
+    def get_distances_path(self, floorplan: str, pose_file: str) -> str:
+        return self.get_path(floorplan, pose_file)[: -len(".npz")] + "-distances.npz"
+
+    def load_distances(
+        self, floorplan: str, pose_file: str, grid: ReachableGrid
+    ) -> Optional[ObjectDistances]:
+        """
+        Loads the object distances over grid, a file computed over another grid, as
+        left behind when the scene was cached again, is removed
+        """
+        path = self.get_distances_path(floorplan, pose_file)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as arrays:
+                arrays = dict(arrays)
+        except (OSError, ValueError) as e:
+            logging.warning("ignoring unreadable distance cache {}: {}".format(path, e))
+            return None
+        fingerprint = str(arrays.pop("fingerprint", ""))
+        if fingerprint != grid.fingerprint or len(arrays["fields"]) != len(grid):
+            logging.info("removing stale distance cache {}".format(path))
+            os.remove(path)
+            return None
+        logging.info("loaded object distances of {} from {}".format(floorplan, path))
+        return ObjectDistances.from_arrays(arrays)
+
+    def save_distances(
+        self,
+        floorplan: str,
+        pose_file: str,
+        distances: ObjectDistances,
+        grid: ReachableGrid,
+    ):
+        """Saves the object distances over grid, see load_distances"""
+        path = self.get_distances_path(floorplan, pose_file)
+        os.makedirs(self.root, exist_ok=True)
+        arrays = distances.to_arrays()
+        arrays.update(fingerprint=np.array(grid.fingerprint))
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        logging.info("saved object distances of {} to {}".format(floorplan, path))
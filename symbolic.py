@@ -0,0 +1,378 @@
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fire import Fire
+
+# bump whenever the planner may return different plans for the same domain
+PLANNER_VERSION = 1
+
+CONDITION_REGEX = re.compile(r"(!?[A-Z][a-zA-Z_]*)\(([a-zA-Z0-9_,]+)\)")
+
+# (predicate, args), e.g. ("On", ("BS1", "plate"))
+Atom = Tuple[str, Tuple[str, ...]]
+
+
+class Literal(NamedTuple):
+    truth: bool
+    atom: Atom
+
+
+class ActionSchema(NamedTuple):
+    name: str
+    params: Tuple[str, ...]
+    preconditions: Tuple[Literal, ...]
+    effects: Tuple[Literal, ...]
+
+
+class Domain(NamedTuple):
+    symbols: Tuple[str, ...]
+    initial: Tuple[Literal, ...]
+    goal: Tuple[Literal, ...]
+    actions: Tuple[ActionSchema, ...]
+
+    def get_hash(self) -> str:
+        """Hash of the parsed domain, independent of its formatting"""
+        content = json.dumps(
+            dict(
+                version=PLANNER_VERSION,
+                symbols=sorted(self.symbols),
+                initial=sorted(self.initial),
+                goal=sorted(self.goal),
+                actions=sorted(self.actions),
+            )
+        )
+        return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+class GroundedAction(NamedTuple):
+    name: str
+    args: Tuple[str, ...]
+    # bitsets over the atoms of the grounded problem
+    pre_true: int
+    pre_false: int
+    add: int
+    delete: int
+
+    def __str__(self) -> str:
+        return "{}({})".format(self.name, ",".join(self.args))
+
+
+def parse_literals(string: str) -> Tuple[Literal, ...]:
+    return tuple(
+        Literal(not predicate.startswith("!"), (predicate.lstrip("!"), tuple(args)))
+        for predicate, args in (
+            (predicate, args.split(","))
+            for predicate, args in CONDITION_REGEX.findall(string)
+        )
+    )
+
+
+def substitute(literals: Iterable[Literal], mapping: Dict[str, str]) -> List[Literal]:
+    """Replaces the action parameters in literals by the symbols they are bound to"""
+    return [
+        Literal(truth, (predicate, tuple(mapping.get(arg, arg) for arg in args)))
+        for truth, (predicate, args) in literals
+    ]
+
+
+def parse_domain(domain_file: str) -> Domain:
+    """
+    Parses a domain in the format of Sandwich.txt, the same format planner.cpp reads:
+    symbols, initial and goal conditions, then actions with their preconditions and
+    effects, where ! negates a condition
+    """
+    symbols, initial, goal, actions = (), (), (), []
+    name = params = preconditions = None
+    with open(domain_file) as f:
+        lines = [line.replace(" ", "").strip() for line in f]
+
+    for line in lines:
+        lower = line.lower()
+        if line == "" or lower == "actions:":
+            continue
+        if lower.startswith("symbols:"):
+            symbols = tuple(s for s in line[len("symbols:") :].split(",") if s)
+        elif lower.startswith("initialconditions:"):
+            initial = parse_literals(line)
+        elif lower.startswith("goalconditions:"):
+            goal = parse_literals(line)
+        elif lower.startswith("precondition"):
+            preconditions = parse_literals(line[line.index(":") :])
+        elif lower.startswith("effect"):
+            if name is None or preconditions is None:
+                raise ValueError("effects without action in {}".format(domain_file))
+            effects = parse_literals(line[line.index(":") :])
+            actions.append(ActionSchema(name, params, preconditions, effects))
+            name = params = preconditions = None
+        else:
+            match = CONDITION_REGEX.fullmatch(line)
+            if match is None:
+                raise ValueError(
+                    "cannot parse line {} of {}".format(repr(line), domain_file)
+                )
+            name, params = match.group(1), tuple(match.group(2).split(","))
+
+    if len(symbols) == 0:
+        raise ValueError("no symbols specified in {}".format(domain_file))
+    return Domain(symbols, initial, goal, tuple(actions))
+
+
+class SymbolicPlanner:
+    """
+    Grounds the actions of a domain once, then plans with A* over states represented
+    as integer bitsets of the grounded atoms
+
+    Only actions reachable from the initial conditions in the delete relaxation are
+    kept, which also limits the atoms to the ones that can ever hold.
+    """
+
+    def __init__(self, domain: Domain):
+        self.domain = domain
+        self.atoms: Dict[Atom, int] = {}
+        self.actions: List[GroundedAction] = []
+        self.ground()
+
+    def get_bit(self, atom: Atom) -> int:
+        if atom not in self.atoms:
+            self.atoms[atom] = len(self.atoms)
+        return 1 << self.atoms[atom]
+
+    def get_mask(self, literals: Iterable[Literal], truth: bool) -> int:
+        mask = 0
+        for literal in literals:
+            if literal.truth == truth:
+                mask |= self.get_bit(literal.atom)
+        return mask
+
+    def ground(self):
+        candidates = []
+        for schema in self.domain.actions:
+            for binding in itertools.product(
+                self.domain.symbols, repeat=len(schema.params)
+            ):
+                mapping = dict(zip(schema.params, binding))
+                candidates.append(
+                    (
+                        schema.name,
+                        binding,
+                        substitute(schema.preconditions, mapping),
+                        substitute(schema.effects, mapping),
+                    )
+                )
+
+        # delete relaxed reachability, negative preconditions are assumed satisfiable
+        reachable = {atom for truth, atom in self.domain.initial if truth}
+        remaining = candidates
+        changed = True
+        kept = []
+        while changed:
+            changed = False
+            pending = []
+            for candidate in remaining:
+                _, _, preconditions, effects = candidate
+                if all(
+                    atom in reachable for truth, atom in preconditions if truth
+                ):
+                    kept.append(candidate)
+                    for truth, atom in effects:
+                        if truth and atom not in reachable:
+                            reachable.add(atom)
+                            changed = True
+                else:
+                    pending.append(candidate)
+            remaining = pending
+
+        for atom in sorted(reachable):
+            self.get_bit(atom)
+        for name, args, preconditions, effects in kept:
+            self.actions.append(
+                GroundedAction(
+                    name,
+                    args,
+                    pre_true=self.get_mask(preconditions, True),
+                    pre_false=self.get_mask(preconditions, False),
+                    add=self.get_mask(effects, True),
+                    delete=self.get_mask(effects, False),
+                )
+            )
+        logging.debug(
+            "grounded {} of {} actions over {} atoms".format(
+                len(self.actions), len(candidates), len(self.atoms)
+            )
+        )
+
+    def plan(
+        self, goal: Optional[Iterable[Literal]] = None
+    ) -> Optional[List[GroundedAction]]:
+        """
+        Plans from the initial conditions to goal, the domain's goal by default,
+        returns None if the goal is unreachable
+
+        A* with the number of unsatisfied goal conditions as heuristic, like
+        planner.cpp, so plans come out the same length as its plans.
+        """
+        goal = self.domain.goal if goal is None else tuple(goal)
+        for literal in goal:
+            if literal.truth and literal.atom not in self.atoms:
+                return None
+        goal_true = self.get_mask(goal, True)
+        goal_false = self.get_mask(goal, False)
+        start = self.get_mask(self.domain.initial, True)
+
+        def heuristic(state: int) -> int:
+            unsatisfied = (goal_true & ~state) | (goal_false & state)
+            return bin(unsatisfied).count("1")
+
+        parents: Dict[int, Tuple[int, Optional[GroundedAction]]] = {}
+        costs = {start: 0}
+        queue = [(heuristic(start), 0, start, start, None)]
+        expansions = 0
+        while len(queue) > 0:
+            _, cost, state, parent, action = heapq.heappop(queue)
+            if state in parents:
+                continue
+            parents[state] = (parent, action)
+            expansions += 1
+
+            if goal_true & ~state == 0 and goal_false & state == 0:
+                logging.debug("found plan after {} expansions".format(expansions))
+                plan = []
+                while state != start:
+                    state, action = parents[state]
+                    plan.append(action)
+                return plan[::-1]
+
+            for action in self.actions:
+                if state & action.pre_true != action.pre_true:
+                    continue
+                if state & action.pre_false != 0:
+                    continue
+                successor = (state & ~action.delete) | action.add
+                if successor in parents:
+                    continue
+                if cost + 1 < costs.get(successor, cost + 2):
+                    costs[successor] = cost + 1
+                    heapq.heappush(
+                        queue,
+                        (
+                            cost + 1 + heuristic(successor),
+                            # prefer deeper nodes on ties, as planner.cpp does
+                            -(cost + 1),
+                            successor,
+                            state,
+                            action,
+                        ),
+                    )
+        logging.warning("no plan found after {} expansions".format(expansions))
+        return None
+
+
+class PlanCache:
+    """On-disk memo of plans, keyed by the hash of the parsed domain"""
+
+    def __init__(self, root: str = ".plan_cache"):
+        self.root = root
+
+    def get_path(self, domain: Domain) -> str:
+        return os.path.join(self.root, "{}.json".format(domain.get_hash()))
+
+    def load(self, domain: Domain) -> Optional[List[str]]:
+        path = self.get_path(domain)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)["plan"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("ignoring unreadable plan cache {}: {}".format(path, e))
+            return None
+
+    def save(self, domain: Domain, plan: List[str]):
+        path = self.get_path(domain)
+        os.makedirs(self.root, exist_ok=True)
+        # write then rename, so concurrent readers never see a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(dict(plan=plan), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def plan_domain(
+    domain_file: str, plan_cache: Optional[str] = ".plan_cache"
+) -> Optional[List[str]]:
+    """
+    Returns the plan for the domain in domain_file as steps like PutSlice(BS1,plate),
+    None if there is none
+    """
+    domain = parse_domain(domain_file)
+    cache = PlanCache(plan_cache) if plan_cache is not None else None
+    if cache is not None:
+        plan = cache.load(domain)
+        if plan is not None:
+            logging.info("loaded plan for {} from cache".format(domain_file))
+            return plan
+
+    actions = SymbolicPlanner(domain).plan()
+    if actions is None:
+        return None
+    plan = [str(action) for action in actions]
+    if cache is not None:
+        cache.save(domain, plan)
+    return plan
+
+
+def load_plan(plan_file: str) -> List[str]:
+    """
+    Returns the steps of a plan file as written by planner.cpp, or plans them if
+    plan_file is a domain instead
+    """
+    with open(plan_file) as f:
+        lines = f.readlines()
+    stripped = [line.strip() for line in lines]
+    if "Plan:" in stripped:
+        return [line for line in stripped[stripped.index("Plan:") + 1 :] if line]
+    plan = plan_domain(plan_file)
+    if plan is None:
+        raise ValueError("no plan found for {}".format(plan_file))
+    return plan
+
+
+def load_domain(plan_file: str) -> Optional[Domain]:
+    """
+    Returns the domain of plan_file, read from the environment file named in its
+    header if it is a plan written by planner.cpp, None if that file is missing
+    """
+    with open(plan_file) as f:
+        lines = [line.strip() for line in f]
+    if "Plan:" not in lines:
+        return parse_domain(plan_file)
+    for line in lines:
+        if line.startswith("Environment:"):
+            domain_file = line[len("Environment:") :].strip()
+            # relative to the plan file, or to the working directory like planner.cpp
+            for path in (
+                os.path.join(os.path.dirname(plan_file), domain_file),
+                domain_file,
+            ):
+                if os.path.isfile(path):
+                    return parse_domain(path)
+    return None
+
+
+def main(domain_file: str):
+    """Prints the plan for domain_file in the format of planner.cpp's output"""
+    plan = plan_domain(domain_file)
+    print("Environment: {}\n".format(domain_file))
+    print("Plan:")
+    for step in plan or []:
+        print(step)
+
+
+if __name__ == "__main__":
+    Fire(main)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    """Pose files and plans are read relative to the working directory"""
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def env():
+    """Env over a MockController with the FloorPlan3 layout"""
+    from benchmark import make_env
+
+    env = make_env(1)
+    yield env
+    env.controller.stop()
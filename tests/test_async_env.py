@@ -0,0 +1,34 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from async_env import AsyncEnv, run_episode
+from interface import Compute
+
+
+def blocking_steps():
+    """Steps asking for the thread they compute in and for a finished future"""
+    thread = yield Compute(threading.get_ident)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = yield executor.submit(sum, [1, 2, 3])
+    event = yield dict(action="Done")
+    return thread, future.result(), event.metadata["lastActionSuccess"]
+
+
+def test_env_computes_inline(env):
+    assert env.run(blocking_steps()) == (threading.get_ident(), 6, True)
+
+
+def test_computations_leave_the_event_loop(env):
+    async def run():
+        thread, total, success = await AsyncEnv(env).run(blocking_steps())
+        return thread != threading.get_ident() and total == 6 and success
+
+    assert asyncio.run(run())
+
+
+def test_episode_runs_on_the_loop(env):
+    result = asyncio.run(run_episode(AsyncEnv(env), "plan.txt"))
+    assert result["error"] is None
+    assert result["success"]
+    assert result["path_length"] > 0
@@ -0,0 +1,40 @@
+import signal
+import time
+from functools import partial
+
+import pytest
+
+import batch
+from main import Agent
+from mock_controller import MockController
+
+FLOORPLAN = "MockFloorPlan3x1"
+
+
+@pytest.fixture
+def worker():
+    """This process as a batch worker over MockControllers"""
+    previous = signal.getsignal(signal.SIGALRM)
+    controller_class = partial(MockController, pose_file="poses/FloorPlan3.json")
+    batch._init_worker(dict(controller_class=controller_class, pacing="none"), "INFO")
+    yield
+    batch._discard_env()
+    signal.signal(signal.SIGALRM, previous)
+
+
+def test_timeout_starts_a_new_controller(worker, monkeypatch):
+    result = batch.run_episode("plan.txt", FLOORPLAN, None, "field", None)
+    assert result["success"]
+    controller = batch._env.controller
+    stopped = []
+    monkeypatch.setattr(controller, "stop", lambda: stopped.append(True))
+
+    with monkeypatch.context() as patched:
+        patched.setattr(Agent, "run_plan", lambda self, plan_file: time.sleep(5))
+        result = batch.run_episode("plan.txt", FLOORPLAN, None, "field", 1)
+    assert result["error"] == "timeout after 1s"
+    assert stopped and batch._env is None
+
+    result = batch.run_episode("plan.txt", FLOORPLAN, 0, "field", 10)
+    assert result["success"]
+    assert batch._env.controller is not controller
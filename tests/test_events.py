@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from benchmark import make_env
+from events import LeanEvent, encode_segmentation, has_frames
+
+
+def rendered_event(env):
+    """A full event of the mock scene with a few objects in view"""
+    env.api_step(action="RotateRight", degrees=180)
+    return env.event
+
+
+def test_segmentation_labels_round_trip():
+    rng = np.random.default_rng(0)
+    palette = rng.integers(0, 256, size=(5, 3), dtype=np.uint8)
+    segmentation = palette[rng.integers(0, 5, size=(40, 30))]
+    labels, colors = encode_segmentation(segmentation)
+    assert labels.shape == (40, 30) and labels.dtype == np.uint8
+    assert np.array_equal(colors[labels], segmentation)
+
+
+def test_lean_events_keep_the_segmentation_only(env):
+    event = rendered_event(env)
+    lean = LeanEvent.from_event(event)
+    assert lean.frame is None and has_frames(lean)
+    segmentation = lean.instance_segmentation_frame
+    assert np.array_equal(segmentation, event.instance_segmentation_frame)
+    assert lean.instance_masks.keys() == event.instance_masks.keys()
+    for object_id, mask in event.instance_masks.items():
+        assert np.array_equal(lean.instance_masks[object_id], mask)
+    assert lean.metadata["agent"] == event.metadata["agent"]
+
+    bare = LeanEvent.from_event(event, keep_frames=False)
+    assert not has_frames(bare) and bare.instance_masks == {}
+
+
+@pytest.mark.parametrize("retention", ("lean", "metadata"))
+def test_policies_analyze_frames_like_full(env, retention: str):
+    rendered_event(env)
+    expected = {key: value.area for key, value in env.analyze_frame().objects.items()}
+    lean_env = make_env(1, retention=retention)
+    rendered_event(lean_env)
+    calls = sum(lean_env.controller.call_counts.values())
+
+    objects = lean_env.analyze_frame().objects
+    assert {key: value.area for key, value in objects.items()} == expected
+    assert isinstance(lean_env.event, LeanEvent)
+    added = sum(lean_env.controller.call_counts.values()) - calls
+    if retention == "lean":
+        assert added == 0 and has_frames(lean_env.event)
+    else:
+        assert added == 1 and not has_frames(lean_env.event)
+    assert lean_env.analyze_frame().objects is objects
@@ -0,0 +1,166 @@
+import heapq
+
+import numpy as np
+import pytest
+
+from coarse import CoarseGrid
+from grid import OFFSETS, ReachableGrid
+
+STEP = 0.05
+
+
+def make_grid(occupancy: np.ndarray) -> ReachableGrid:
+    """Grid with a reachable position in every True cell of occupancy"""
+    return ReachableGrid(
+        [dict(x=i * STEP, y=0.9, z=j * STEP) for i, j in zip(*np.nonzero(occupancy))]
+    )
+
+
+def make_obstacles(size: int, count: int, seed: int) -> np.ndarray:
+    """Open square with count random rectangular obstacles"""
+    rng = np.random.default_rng(seed)
+    occupancy = np.ones((size, size), dtype=bool)
+    for _ in range(count):
+        i, j = rng.integers(0, size - 4, size=2)
+        h, w = rng.integers(1, 6, size=2)
+        occupancy[i : i + h, j : j + w] = False
+    return occupancy
+
+
+def dijkstra(grid: ReachableGrid, sources) -> np.ndarray:
+    """Reference shortest path lengths from the closest of sources"""
+    dists = np.full(len(grid), np.inf)
+    queue = [(0.0, int(source)) for source in sources]
+    for _, source in queue:
+        dists[source] = 0.0
+    heapq.heapify(queue)
+    while queue:
+        dist, idx = heapq.heappop(queue)
+        if dist > dists[idx]:
+            continue
+        for succ, cost in zip(grid.neighbors[idx], grid.step_costs):
+            if succ >= 0 and dist + cost < dists[succ]:
+                dists[succ] = dist + cost
+                heapq.heappush(queue, (dist + cost, int(succ)))
+    return dists
+
+
+def shortest_path(grid: ReachableGrid, start: int, goal: int):
+    """Path of reachable indices from start to goal along the reference distances"""
+    dists = dijkstra(grid, [goal])
+    if not np.isfinite(dists[start]):
+        return None
+    path = [start]
+    while path[-1] != goal:
+        succs = grid.neighbors[path[-1]]
+        values = [
+            dists[succ] + cost if succ >= 0 else np.inf
+            for succ, cost in zip(succs, grid.step_costs)
+        ]
+        path.append(int(succs[int(np.argmin(values))]))
+    return path
+
+
+def test_neighbors_in_open_space():
+    grid = make_grid(np.ones((3, 3), dtype=bool))
+    center = grid.lookup(STEP, STEP)
+    neighbors = grid.neighbors[center]
+    assert np.all(neighbors >= 0)
+    for d, (di, dj) in enumerate(OFFSETS):
+        assert np.array_equal(grid.cells[neighbors[d]], grid.cells[center] + (di, dj))
+
+
+def test_diagonals_never_cut_corners():
+    occupancy = np.ones((3, 3), dtype=bool)
+    occupancy[2, 1] = False
+    grid = make_grid(occupancy)
+    neighbors = grid.neighbors[grid.lookup(STEP, STEP)]
+    assert neighbors[0] == -1
+    # both diagonals past the missing cell go around its corners
+    assert neighbors[4] == -1 and neighbors[5] == -1
+    assert neighbors[6] >= 0 and neighbors[7] >= 0
+
+
+def test_no_neighbors_outside_the_grid():
+    grid = make_grid(np.ones((1, 1), dtype=bool))
+    assert np.all(grid.neighbors == -1)
+
+
+def test_multi_source_distances_match_dijkstra():
+    grid = make_grid(make_obstacles(30, 25, seed=0))
+    rng = np.random.default_rng(1)
+    regions = [rng.choice(len(grid), size=size, replace=False) for size in (1, 3, 8)]
+    regions.append(np.zeros(0, dtype=np.int64))
+    dists = grid.multi_source_distances(regions)
+    for k, region in enumerate(regions):
+        expected = dijkstra(grid, region)
+        assert np.array_equal(np.isinf(dists[:, k]), np.isinf(expected))
+        finite = np.isfinite(expected)
+        np.testing.assert_allclose(dists[finite, k], expected[finite])
+
+
+def test_line_of_sight_is_blocked_by_walls():
+    occupancy = np.ones((9, 9), dtype=bool)
+    occupancy[4, :7] = False
+    grid = make_grid(occupancy)
+    below, above = grid.lookup(2 * STEP, 2 * STEP), grid.lookup(6 * STEP, 2 * STEP)
+    assert grid.line_of_sight(below, below)
+    assert not grid.line_of_sight(below, above)
+    assert grid.line_of_sight(grid.lookup(0, 8 * STEP), grid.lookup(8 * STEP, 8 * STEP))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_shortcut_stays_on_reachable_cells(seed: int):
+    grid = make_grid(make_obstacles(40, 30, seed))
+    rng = np.random.default_rng(seed)
+    for _ in range(10):
+        start, goal = (int(idx) for idx in rng.integers(len(grid), size=2))
+        path = shortest_path(grid, start, goal)
+        if path is None:
+            continue
+        corners = grid.shortcut(path)
+        assert corners[0] == start and corners[-1] == goal
+        assert len(corners) <= len(grid.turning_points(path))
+        for a, b in zip(corners, corners[1:]):
+            samples = grid.cells[a] + np.outer(
+                np.linspace(0, 1, 1000), grid.cells[b] - grid.cells[a]
+            )
+            cells = np.rint(samples).astype(np.int64)
+            assert np.all(grid.index[cells[:, 0], cells[:, 1]] >= 0)
+
+
+def test_coarse_nodes_split_cells_at_walls():
+    occupancy = np.ones((10, 10), dtype=bool)
+    # a wall through the middle of the first coarse row of cells, open at the end
+    occupancy[2, :9] = False
+    grid = make_grid(occupancy)
+    coarse = CoarseGrid(grid)
+    below, above = grid.lookup(STEP, STEP), grid.lookup(3 * STEP, STEP)
+    assert coarse.node_of[below] != coarse.node_of[above]
+    # every node is connected within its coarse cell
+    for node in range(len(coarse)):
+        members = np.nonzero(coarse.node_of == node)[0]
+        blocks = grid.cells[members] // coarse.factor
+        assert len(np.unique(blocks, axis=0)) == 1
+        inside = np.zeros(len(grid), dtype=bool)
+        inside[members] = True
+        reached = {int(members[0])}
+        frontier = [int(members[0])]
+        while frontier:
+            for succ in grid.neighbors[frontier.pop()]:
+                if succ >= 0 and inside[succ] and int(succ) not in reached:
+                    reached.add(int(succ))
+                    frontier.append(int(succ))
+        assert len(reached) == len(members)
+
+
+def test_coarse_search_corridor_holds_a_path():
+    grid = make_grid(make_obstacles(40, 30, seed=5))
+    coarse = CoarseGrid(grid)
+    start, goal = 0, len(grid) - 1
+    in_goal = np.zeros(len(grid), dtype=bool)
+    in_goal[goal] = True
+    nodes, _ = coarse.search(start, in_goal, np.zeros(len(coarse)))
+    assert nodes[0] == coarse.node_of[start] and nodes[-1] == coarse.node_of[goal]
+    corridor = coarse.corridor(nodes)
+    assert corridor[start] and corridor[goal]
@@ -0,0 +1,61 @@
+import numpy as np
+
+from interaction import MAX_HORIZON, MIN_HORIZON
+from main import Agent
+
+
+def first_of(env, object_type: str) -> str:
+    return env.index.by_type[object_type][0]["objectId"]
+
+
+def test_region_poses_face_the_object(env):
+    obj_info = env.index.by_type["Bread"][0]
+    region = env.interaction_poses.get(env.index, obj_info["objectId"])
+    assert region is not None and len(region.indices)
+    assert np.all((region.horizons >= MIN_HORIZON) & (region.horizons <= MAX_HORIZON))
+
+    target = obj_info["position"]
+    for idx in region.indices:
+        pose = region.pose(env.grid, idx)
+        x, z = env.grid.positions[idx]
+        yaw = np.radians(pose.yaw)
+        direction = np.array([target["x"] - x, target["z"] - z])
+        heading = np.array([np.sin(yaw), np.cos(yaw)])
+        assert np.allclose(heading * np.linalg.norm(direction), direction)
+
+    outside = np.setdiff1d(np.arange(len(env.grid)), region.indices)
+    assert region.pose(env.grid, outside[0]) is None
+
+
+def test_regions_are_recomputed_for_moved_objects(env):
+    knife, bread = first_of(env, "Knife"), first_of(env, "Bread")
+    poses = env.interaction_poses
+    knife_region = poses.get(env.index, knife)
+    bread_region = poses.get(env.index, bread)
+    assert poses.get(env.index, knife) is knife_region
+
+    position = dict(env.index.get(knife)["position"], x=bread_region.center.x)
+    env.api_step(action="TeleportObject", objectId=knife, position=position)
+    moved = poses.get(env.index, knife)
+    assert moved is not knife_region and moved.center.x == bread_region.center.x
+    assert poses.get(env.index, bread) is bread_region
+
+
+def test_go_to_pose_turns_into_the_object(env, monkeypatch):
+    bread = first_of(env, "Bread")
+    requests = []
+    step = env.controller.step
+    monkeypatch.setattr(
+        env.controller, "step", lambda action: requests.append(action) or step(action)
+    )
+    with Agent(env) as agent:
+        assert agent.go_to_pose(bread)
+
+    region = env.interaction_poses.get(env.index, bread)
+    agent_info = env.event.metadata["agent"]
+    idx = env.grid.lookup(agent_info["position"]["x"], agent_info["position"]["z"])
+    pose = region.pose(env.grid, idx)
+    assert pose is not None
+    assert requests[-1] == pose.teleport()
+    assert np.isclose(agent_info["rotation"]["y"], pose.yaw)
+    assert np.isclose(agent_info["cameraHorizon"], pose.horizon)
@@ -0,0 +1,92 @@
+from main import Agent
+from utils import get_obj_in_frame
+
+
+def test_frame_analysis_is_kept_until_the_next_step(env):
+    env.api_step(action="RotateRight", degrees=180)
+    analysis = env.analyze_frame()
+    assert analysis.objects
+    assert env.analyze_frame() is analysis
+    object_id, frame_object = next(iter(analysis.objects.items()))
+    assert get_obj_in_frame(env.analyze_frame(), object_id) == frame_object.centroid
+
+    env.api_step(action="RotateRight", degrees=90)
+    assert env.analyze_frame() is not analysis
+
+
+def first_of(env, object_type: str) -> str:
+    return env.index.by_type[object_type][0]["objectId"]
+
+
+def test_reset_moves_back_only_what_moved(env):
+    initial = env.snapshot()
+    knife, plate = first_of(env, "Knife"), first_of(env, "Plate")
+    env.api_step(action="PickupObject", objectId=knife, forceAction=True)
+    env.api_step(action="PutObject", objectId=plate, forceAction=True)
+    x, z = env.grid.positions[0]
+    env.api_step(action="Teleport", position=dict(x=x, y=0.9, z=z))
+    env.controller.call_counts.clear()
+    env.metrics.clear()
+    path_length = env.path_length
+
+    env.reset()
+    assert env.controller.call_counts == {"TeleportObject": 1, "Teleport": 1}
+    assert env.snapshot() == initial
+    assert env.metrics.other.calls == {"TeleportObject": 1, "Teleport": 1}
+    assert env.path_length > path_length
+
+
+def test_restore_picks_the_held_object_up_again(env):
+    knife, plate = first_of(env, "Knife"), first_of(env, "Plate")
+    env.api_step(action="PickupObject", objectId=knife, forceAction=True)
+    snapshot = env.snapshot()
+    env.api_step(action="PutObject", objectId=plate, forceAction=True)
+    env.api_step(action="RotateRight", degrees=90)
+
+    assert env.restore(snapshot)
+    assert env.snapshot() == snapshot
+    assert env.event.metadata["inventoryObjects"][0]["objectId"] == knife
+
+
+def test_reset_after_slicing_keeps_the_grid(env, monkeypatch):
+    initial, grid = env.snapshot(), env.grid
+    knife, bread = first_of(env, "Knife"), first_of(env, "Bread")
+    env.api_step(action="PickupObject", objectId=knife, forceAction=True)
+    env.api_step(action="SliceObject", objectId=bread, forceAction=True)
+    assert frozenset(env.index.by_id) != initial.object_ids
+    resets = []
+    reset = env.controller.reset
+    monkeypatch.setattr(
+        env.controller, "reset", lambda **kwargs: resets.append(1) or reset(**kwargs)
+    )
+    env.controller.call_counts.clear()
+
+    env.reset()
+    assert len(resets) == 1
+    assert "GetReachablePositions" not in env.controller.call_counts
+    assert env.grid is grid
+    assert env.snapshot() == initial
+
+
+def test_frames_are_only_rendered_on_demand(env):
+    with env.rendering_disabled():
+        env.api_step(action="RotateRight", degrees=180)
+    assert not env.rendered and env.event.frame is None
+    assert env.rendering
+
+    env.controller.call_counts.clear()
+    assert env.ensure_rendered().frame is not None
+    assert env.ensure_rendered() is env.event
+    assert env.controller.call_counts == {"Done": 1}
+
+
+def test_navigation_does_not_render(env, monkeypatch):
+    requests = []
+    step = env.controller.step
+    monkeypatch.setattr(
+        env.controller, "step", lambda action: requests.append(action) or step(action)
+    )
+    with Agent(env) as agent:
+        assert agent.go_to_obj(first_of(env, "Bread"))
+    assert requests and all(not action["renderImage"] for action in requests)
+    assert env.rendering and not env.rendered
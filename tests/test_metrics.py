@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from metrics import Metrics
+
+
+def test_rotation_counts_yaw_and_horizon(env):
+    env.metrics.clear()
+    with env.metrics.section("Look(Knife)"):
+        env.api_step(action="RotateRight", degrees=90)
+        env.api_step(action="LookDown", degrees=30)
+        env.api_step(action="LookUp", degrees=30)
+        env.api_step(action="RotateLeft", degrees=270)
+    (section,) = env.metrics.sections
+    assert section.rotation == pytest.approx(90 + 30 + 30 + 90)
+    assert sum(section.calls.values()) == 4
+
+
+def test_sim_time_only_counts_the_controller(env, monkeypatch):
+    retain = env.retain
+
+    def slow_retain(event):
+        time.sleep(0.05)
+        return retain(event)
+
+    monkeypatch.setattr(env, "retain", slow_retain)
+    env.metrics.clear()
+    start = time.perf_counter()
+    env.api_step(action="Done")
+    assert time.perf_counter() - start >= 0.05
+    assert env.metrics.other.sim_time < 0.05
+
+
+def test_sections_sum_up_per_skill():
+    metrics = Metrics()
+    for name in ("PickSlice(BS1)", "PutObject(Plate)", "PickSlice(BS2)"):
+        with metrics.section(name):
+            metrics.record("Teleport", True, 0.5, 0.25, 90.0, 1.0)
+            metrics.record("PickupObject", name.startswith("Put"), 0.5, 0.0, 0.0, 0.0)
+    skills = {section.skill: section for section in metrics.by_skill()}
+    assert list(skills) == ["PickSlice", "PutObject"]
+    assert skills["PickSlice"].calls == {"Teleport": 2, "PickupObject": 2}
+    assert skills["PickSlice"].failures == {"PickupObject": 2}
+    assert skills["PickSlice"].teleports == 2
+    assert skills["PickSlice"].rotation == 180.0
+    assert skills["PutObject"].sim_time == 1.0
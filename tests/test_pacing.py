@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from pacing import Pacer
+
+INTERVAL = 0.05
+
+
+def test_rejects_unknown_modes():
+    with pytest.raises(ValueError):
+        Pacer("Fixed")
+
+
+def test_none_never_sleeps():
+    pacer = Pacer("none", INTERVAL)
+    pacer.record(time.perf_counter(), time.perf_counter())
+    pacer.wait()
+    assert pacer.sleep_time == 0.0
+
+
+def test_fixed_sleeps_the_whole_interval():
+    pacer = Pacer("fixed", INTERVAL)
+    for _ in range(2):
+        now = time.perf_counter()
+        pacer.record(now, now)
+        pacer.wait()
+    assert pacer.sleep_time >= 2 * INTERVAL
+
+
+def test_adaptive_sleeps_what_is_left_of_the_interval():
+    pacer = Pacer("adaptive", INTERVAL)
+    assert pacer.delay() == 0.0
+    # the last step was sent 30 ms ago and took 10 ms
+    start = time.perf_counter() - 0.03
+    pacer.record(start, start + 0.01)
+    assert 0.0 < pacer.delay() <= INTERVAL - 0.03
+    pacer.wait()
+    assert time.perf_counter() - start >= INTERVAL
+    assert pacer.sleep_time < INTERVAL - 0.02
+    assert pacer.sim_time == pytest.approx(0.01)
+
+    # planning for longer than the interval is not paid for again
+    pacer.record(time.perf_counter() - 2 * INTERVAL, time.perf_counter())
+    assert pacer.delay() == 0.0
+
+
+def test_async_wait_counts_the_sleep():
+    pacer = Pacer("fixed", INTERVAL)
+    asyncio.run(pacer.wait_async())
+    assert pacer.sleep_time >= INTERVAL
+
+
+def test_env_paces_its_steps(env):
+    env.pacer = Pacer("fixed", INTERVAL)
+    env.metrics.clear()
+    for _ in range(3):
+        env.api_step(action="Done")
+    assert env.metrics.other.sleep_time == pytest.approx(env.pacer.sleep_time)
+    assert env.pacer.sleep_time >= 3 * INTERVAL
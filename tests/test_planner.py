@@ -0,0 +1,116 @@
+import signal
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from main import Agent
+from planner import NavigationPlanner
+from utils import NavigationState, Pos2D
+
+PATH_MODES = ("astar", "field", "hierarchical")
+
+
+class Timeout(Exception):
+    pass
+
+
+@contextmanager
+def deadline(seconds: int):
+    """Fails a navigation that does not terminate instead of hanging the suite"""
+
+    def on_alarm(signum, frame):
+        raise Timeout("no result after {}s".format(seconds))
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def teleport(env, x: float, z: float):
+    position = dict(x=x, y=env.reachables[0]["y"], z=z)
+    env.api_step(action="Teleport", position=position)
+
+
+@pytest.mark.parametrize("mode", PATH_MODES + ("lrta",))
+def test_reaches_the_goal(env, mode: str):
+    goal = Pos2D(*env.grid.positions[len(env.grid) // 3])
+    with deadline(60):
+        planner = NavigationPlanner(env, goal, mode)
+    assert planner.reached
+    assert planner.is_goal(NavigationState.from_event(env.event))
+
+
+@pytest.mark.parametrize("mode", PATH_MODES)
+@pytest.mark.parametrize("offset", (-0.004, 0.004))
+def test_terminates_at_the_goal_boundary(env, mode: str, offset: float):
+    """The agent's cell is 2 mm within the radius, the agent itself 4 mm off it"""
+    idx = len(env.grid) // 2
+    x, z = env.grid.positions[idx]
+    radius = NavigationPlanner.goal_radius
+    goal = Pos2D(x + radius - 0.002, z)
+    teleport(env, x + offset, z)
+    with deadline(30):
+        planner = NavigationPlanner(env, goal, mode)
+    assert planner.reached
+
+
+@pytest.mark.parametrize("mode", PATH_MODES)
+def test_terminates_next_to_the_goal_boundary(env, mode: str):
+    """The agent's cell is 2 mm outside the radius, the agent itself within it"""
+    idx = len(env.grid) // 2
+    x, z = env.grid.positions[idx]
+    radius = NavigationPlanner.goal_radius
+    goal = Pos2D(x + radius + 0.002, z)
+    teleport(env, x + 0.004, z)
+    with deadline(30):
+        planner = NavigationPlanner(env, goal, mode)
+    assert planner.reached
+    assert planner.steps > 0
+
+
+@pytest.mark.parametrize("mode", PATH_MODES)
+def test_paths_end_in_the_region(env, mode: str):
+    goal = Pos2D(*env.grid.positions[len(env.grid) // 4])
+    region = env.grid.within(goal.x, goal.z, 0.3)
+    start = env.grid.nearest(
+        env.event.metadata["agent"]["position"]["x"],
+        env.event.metadata["agent"]["position"]["z"],
+    )
+    planner = NavigationPlanner(env, goal, mode, region, execute=False)
+    path = planner.find_path(start)
+    assert path[0] == start and np.isin(path[-1], region)
+    steps = np.diff(env.grid.cells[path], axis=0)
+    assert np.all(np.abs(steps) <= 1)
+
+
+def test_rejects_unknown_modes(env):
+    goal = Pos2D(*env.grid.positions[0])
+    with pytest.raises(ValueError):
+        NavigationPlanner(env, goal, "Astar", execute=False)
+
+
+@pytest.mark.parametrize("k", (8, 64))
+def test_lrta_scores_k_successors(env, k: int):
+    goal = Pos2D(*env.grid.positions[len(env.grid) // 3])
+    planner = NavigationPlanner(env, goal, "lrta", execute=False, k=k)
+    current = NavigationState.from_event(env.event)
+    heuristics = np.zeros(len(env.grid))
+    indices, headings, f_values = planner.score_successors(current, k, heuristics)
+    assert len(indices) == len(headings) == len(f_values) == k
+    distances = np.hypot(*(env.grid.positions[indices] - (current.x, current.z)).T)
+    assert np.all(np.diff(distances) >= 0)
+    with deadline(60):
+        env.run(planner.navigate(env.event))
+    assert planner.reached
+
+
+def test_agent_threads_k_to_lrta(env):
+    with Agent(env, nav_mode="lrta", lrta_k=40) as agent:
+        goal = Pos2D(*env.grid.positions[len(env.grid) // 3])
+        planner = agent.navigate(goal)
+    assert planner.k == 40 and planner.reached
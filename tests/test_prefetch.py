@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from main import Agent
+from planner import PathPrefetcher
+from utils import Pos2D
+
+
+@pytest.fixture
+def prefetcher(env):
+    prefetcher = PathPrefetcher(env)
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+def goal_and_start(env):
+    goal = Pos2D(*env.grid.positions[len(env.grid) // 3])
+    region = env.grid.within(goal.x, goal.z, 0.3)
+    return goal, region, len(env.grid) // 2
+
+
+def test_hands_out_the_path_planned_for_the_same_goal_and_start(env, prefetcher):
+    goal, region, start = goal_and_start(env)
+    prefetcher.submit(goal, region, start)
+    path, expansions = env.run(prefetcher.take_steps(goal, region, start))
+    assert path == prefetcher.plan(goal, region, start)[0]
+    assert path[0] == start and expansions > 0
+    assert (prefetcher.hits, prefetcher.misses) == (1, 0)
+    assert env.run(prefetcher.take_steps(goal, region, start)) == (None, 0)
+
+
+@pytest.mark.parametrize("moved", ("goal", "start"))
+def test_drops_paths_planned_for_something_else(env, prefetcher, moved: str):
+    goal, region, start = goal_and_start(env)
+    prefetcher.submit(goal, region, start)
+    if moved == "goal":
+        goal, region = Pos2D(*env.grid.positions[0]), None
+    else:
+        start += 1
+    assert env.run(prefetcher.take_steps(goal, region, start)) == (None, 0)
+    assert (prefetcher.hits, prefetcher.misses) == (0, 1)
+
+
+def test_failed_prefetches_are_replanned(env, prefetcher, monkeypatch):
+    def fail(goal, region, start):
+        raise RuntimeError("planning failed")
+
+    monkeypatch.setattr(prefetcher, "plan", fail)
+    goal, region, start = goal_and_start(env)
+    prefetcher.submit(goal, region, start)
+    assert env.run(prefetcher.take_steps(goal, region, start)) == (None, 0)
+    assert prefetcher.misses == 1
+
+
+def test_closing_the_agent_cancels_queued_prefetches(env):
+    agent = Agent(env)
+    release = threading.Event()
+    busy = agent.prefetcher.executor.submit(release.wait)
+    goal, region, start = goal_and_start(env)
+    agent.prefetcher.submit(goal, region, start)
+    queued = agent.prefetcher.pending[-1]
+
+    closing = threading.Thread(target=agent.close)
+    closing.start()
+    release.set()
+    closing.join(timeout=10)
+    assert not closing.is_alive()
+    assert busy.done() and queued.cancelled()
+    assert agent.prefetcher.pending is None
+    assert not any(thread.is_alive() for thread in agent.prefetcher.executor._threads)
+
+
+def test_plans_use_prefetched_paths(env):
+    with Agent(env, nav_mode="field", pipeline=True) as agent:
+        assert agent.run_plan("plan.txt")
+    assert agent.prefetcher.hits > 0
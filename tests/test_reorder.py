@@ -0,0 +1,46 @@
+import numpy as np
+
+from main import Agent
+from reorder import get_predecessors, get_travel, order_steps
+from symbolic import SymbolicPlanner, load_domain, load_plan
+
+# locations 0..3 on a line at x = 0, 3, 1, 2
+COSTS = np.abs(np.subtract.outer([0, 3, 1, 2], [0, 3, 1, 2])).astype(float)
+
+
+def test_orders_independent_steps_by_travel():
+    assert order_steps([0, 0, 0], [1, 2, 3], COSTS) == [1, 2, 0]
+
+
+def test_keeps_predecessors_before_their_steps():
+    # the first step has to stay before the second one
+    order = order_steps([0, 0b001, 0], [1, 2, 3], COSTS)
+    assert order.index(0) < order.index(1)
+    assert get_travel([[1, 2, 3][i] for i in order], COSTS) == 5
+
+
+def test_ties_keep_the_original_order():
+    assert order_steps([0, 0, 0], [1, None, 1], COSTS) == [0, 1, 2]
+
+
+def test_too_many_states_keeps_the_original_order():
+    assert order_steps([0, 0, 0], [1, 2, 3], COSTS, max_states=2) == [0, 1, 2]
+
+
+def test_reordered_plan_respects_the_domain(env):
+    domain = load_domain("plan.txt")
+    plan = load_plan("plan.txt")
+    with Agent(env) as agent:
+        reordered = agent.reorder_plan("plan.txt", plan)
+    assert sorted(reordered) == sorted(plan)
+
+    actions = {str(action): action for action in SymbolicPlanner(domain).actions}
+    predecessors = get_predecessors(
+        [actions.get(step.replace(" ", "")) for step in plan]
+    )
+    assert any(predecessors)
+    position = {step: i for i, step in enumerate(reordered)}
+    for j, mask in enumerate(predecessors):
+        for i in range(j):
+            if mask >> i & 1:
+                assert position[plan[i]] < position[plan[j]]
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pytest
+
+from scene_cache import SceneCache, SceneData, load_poses
+
+POSES = [
+    dict(
+        objectName="Knife_1",
+        position=dict(x=0.5, y=0.9, z=-1.25),
+        rotation=dict(x=0.0, y=90.0, z=0.0),
+    )
+]
+
+
+@pytest.fixture
+def pose_file(tmp_path) -> str:
+    path = tmp_path / "FloorPlan3.json"
+    path.write_text(json.dumps(POSES))
+    return str(path)
+
+
+@pytest.fixture
+def scene(env) -> SceneData:
+    return SceneData(POSES, env.reachables, env.grid)
+
+
+def test_scenes_round_trip(tmp_path, pose_file, scene):
+    cache = SceneCache(str(tmp_path / "cache"))
+    assert cache.load("FloorPlan3", pose_file) is None
+    cache.save("FloorPlan3", pose_file, scene)
+
+    loaded = cache.load("FloorPlan3", pose_file)
+    assert loaded.poses == load_poses(pose_file)
+    assert loaded.reachables == scene.reachables
+    assert loaded.grid.fingerprint == scene.grid.fingerprint
+    assert np.array_equal(loaded.grid.neighbors, scene.grid.neighbors)
+    assert cache.load("FloorPlan4", pose_file) is None
+
+
+def test_edited_pose_files_miss(tmp_path, pose_file, scene):
+    cache = SceneCache(str(tmp_path / "cache"))
+    cache.save("FloorPlan3", pose_file, scene)
+    with open(pose_file, "w") as f:
+        json.dump(POSES + POSES, f)
+    assert cache.load("FloorPlan3", pose_file) is None
+
+
+def test_unreadable_files_miss(tmp_path, pose_file):
+    cache = SceneCache(str(tmp_path / "cache"))
+    path = cache.get_path("FloorPlan3", pose_file)
+    (tmp_path / "cache").mkdir()
+    with open(path, "wb") as f:
+        f.write(b"not a cache")
+    assert cache.load("FloorPlan3", pose_file) is None
+
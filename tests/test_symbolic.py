@@ -0,0 +1,26 @@
+from symbolic import Literal, SymbolicPlanner, parse_domain, substitute
+
+
+def test_sandwich_plan_reaches_the_goal():
+    domain = parse_domain("Sandwich.txt")
+    plan = SymbolicPlanner(domain).plan()
+    assert plan is not None
+
+    # replay the plan on sets of atoms, independent of the planner's bitsets
+    schemas = {schema.name: schema for schema in domain.actions}
+    state = {literal.atom for literal in domain.initial if literal.truth}
+    for action in plan:
+        schema = schemas[action.name]
+        mapping = dict(zip(schema.params, action.args))
+        for literal in substitute(schema.preconditions, mapping):
+            assert (literal.atom in state) == literal.truth, str(action)
+        effects = substitute(schema.effects, mapping)
+        state -= {literal.atom for literal in effects if not literal.truth}
+        state |= {literal.atom for literal in effects if literal.truth}
+    for literal in domain.goal:
+        assert (literal.atom in state) == literal.truth
+
+
+def test_unreachable_goal_has_no_plan():
+    planner = SymbolicPlanner(parse_domain("Sandwich.txt"))
+    assert planner.plan([Literal(True, ("On", ("plate", "plate")))]) is None
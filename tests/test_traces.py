@@ -0,0 +1,41 @@
+import pytest
+
+from benchmark import make_env
+from interface import Env
+from main import Agent
+from traces import ReplayDivergence, TraceReader, get_scene
+
+
+@pytest.fixture
+def trace_file(tmp_path) -> str:
+    """Trace of plan.txt run on the mock controller"""
+    trace_file = str(tmp_path / "episode.jsonl")
+    env = make_env(1, record=trace_file)
+    with Agent(env, nav_mode="astar") as agent:
+        assert agent.run_plan("plan.txt")
+    env.controller.stop()
+    return trace_file
+
+
+def test_trace_records_every_step(trace_file: str):
+    reader = TraceReader(trace_file)
+    actions = reader.actions()
+    reader.close()
+    assert actions[0]["action"] == "Initialize"
+    assert get_scene(trace_file) == "MockFloorPlan3x1"
+    assert any(action["action"] == "Teleport" for action in actions)
+
+
+def test_replay_round_trip(trace_file: str):
+    env = Env(replay=trace_file)
+    with Agent(env, nav_mode="astar") as agent:
+        assert agent.run_plan("plan.txt")
+    assert env.controller.finished
+    env.controller.stop()
+
+
+def test_replay_reports_divergence(trace_file: str):
+    env = Env(replay=trace_file)
+    with pytest.raises(ReplayDivergence):
+        env.controller.step(action="RotateLeft", degrees=90)
+    env.controller.stop()
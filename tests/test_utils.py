@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from grid import ReachableGrid
+from utils import Action, NavigationState
+
+
+def test_states_are_keyed_by_cell():
+    step = NavigationState.step_size
+    state = NavigationState(1.0, 2.0, 90)
+    assert state == NavigationState(1.0 + step / 4, 2.0 - step / 4, 90)
+    assert hash(state) == hash(NavigationState(1.0 + step / 4, 2.0, 90))
+    assert state != NavigationState(1.0 + step, 2.0, 90)
+
+
+def test_cells_on_an_anti_diagonal_do_not_collide():
+    step = NavigationState.step_size
+    states = [NavigationState(i * step, (10 - i) * step) for i in range(11)]
+    assert len({hash(state) for state in states}) == len(states)
+    assert len({state.key for state in states}) == len(states)
+
+
+def test_grid_indexes_states_by_cell():
+    step = NavigationState.step_size
+    grid = ReachableGrid(
+        [dict(x=i * step, y=0.9, z=j * step) for i in range(5) for j in range(4)]
+    )
+    for idx, (x, z) in enumerate(grid.positions):
+        assert grid.index_of(NavigationState(x + step / 3, z - step / 3)) == idx
+    assert grid.index_of(NavigationState(10 * step, 0)) == -1
+    assert np.array_equal(grid.positions[grid.index_of(NavigationState(0, 0))], (0, 0))
+
+
+def test_states_from_events_round_the_yaw():
+    agent = dict(position=dict(x=1.0000001, y=0.9, z=-0.9999999))
+    agent["rotation"] = dict(x=0.0, y=359.99998, z=0.0)
+    state = NavigationState.from_event(SimpleNamespace(metadata=dict(agent=agent)))
+    assert state.theta == 0
+    assert state == NavigationState(1.0, -1.0)
+
+
+def test_object_index_is_built_once_per_event(env):
+    index = env.index
+    assert env.index is index
+    objects = env.event.metadata["objects"]
+    assert set(index.by_id) == {obj_info["objectId"] for obj_info in objects}
+    for obj_info in objects:
+        assert index.get(obj_info["objectId"]) is obj_info
+        assert index.by_name[obj_info["name"]] is obj_info
+        assert obj_info in index.by_type[obj_info["objectType"]]
+    assert index.visible_ids == {
+        obj_info["objectId"] for obj_info in objects if obj_info["visible"]
+    }
+    assert index.get("Missing|+00.00|+00.00|+00.00") is None
+
+    env.api_step(action="RotateRight", degrees=90)
+    assert env.index is not index and env.index.event is env.event
+
+
+def test_coalescing_merges_turns_and_teleports():
+    position = dict(x=1.0, y=0.9, z=2.0)
+    action = Action(
+        [
+            dict(action="RotateRight", degrees=90),
+            dict(action="RotateLeft", degrees=30),
+            dict(action="LookDown", degrees=30),
+            dict(action="LookUp", degrees=45),
+            dict(action="Teleport", rotation=dict(x=0, y=90, z=0)),
+            dict(action="Teleport", position=position),
+            dict(action="Teleport", position=position),
+            dict(action="PickupObject", objectId="Knife"),
+        ]
+    )
+    api_actions, sources = action.coalesced()
+    assert api_actions == [
+        dict(action="RotateRight", degrees=60),
+        dict(action="LookUp", degrees=15),
+        dict(action="Teleport", rotation=dict(x=0, y=90, z=0), position=position),
+        dict(action="Teleport", position=position),
+        dict(action="PickupObject", objectId="Knife"),
+    ]
+    assert sources == [[0, 1], [2, 3], [4, 5], [6], [7]]
+    # split into rotate_angle steps when fine grained
+    assert len(action.api_actions) == 6 + 2 + 2 + 3 + 4
+
+
+def test_coalesced_steps_end_in_the_same_pose(env):
+    turns = [
+        dict(action="RotateRight", degrees=45),
+        dict(action="LookDown", degrees=30),
+    ]
+    start = env.snapshot()
+    calls = {}
+    for fine_grained in (True, False):
+        env.restore(start)
+        env.fine_grained = fine_grained
+        env.controller.call_counts.clear()
+        assert env.step(Action(turns * 2))
+        calls[fine_grained] = sum(env.controller.call_counts.values())
+        agent = env.event.metadata["agent"]
+        assert agent["rotation"]["y"] == (start.agent_rotation["y"] + 90) % 360
+        assert agent["cameraHorizon"] == start.agent_horizon + 60
+    assert calls == {True: 2 * (3 + 2), False: 4}
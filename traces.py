@@ -0,0 +1,222 @@
+import json
+import os
+import struct
+from typing import Any, Callable, Iterator, List, Optional
+
+import numpy as np
+from fire import Fire
+
+from events import Event, LeanEvent
+
+# byte offset of every record of a trace, little endian uint64
+INDEX_FORMAT = "<Q"
+
+
+def get_index_path(trace_file: str) -> str:
+    return trace_file + ".idx"
+
+
+def to_json(value: Any) -> Any:
+    """json.dumps default for the numpy values actions may carry"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("cannot serialize {}".format(type(value).__name__))
+
+
+def normalize_action(action=None, **kwargs) -> dict:
+    """The request of a controller.step call as a single dict, like ai2thor does"""
+    if isinstance(action, dict):
+        kwargs = dict(action, **kwargs)
+    elif action is not None:
+        kwargs["action"] = action
+    return kwargs
+
+
+def dump_action(action: dict) -> str:
+    return json.dumps(action, sort_keys=True, default=to_json)
+
+
+class TraceWriter:
+    """
+    Appends the requests sent to a controller and the metadata of its responses to
+    a trace, one JSON line per step, with a binary index of the record offsets next
+    to it, see TraceReader
+    """
+
+    def __init__(self, trace_file: str):
+        self.trace_file = trace_file
+        directory = os.path.dirname(trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(trace_file, "wb")
+        self.index = open(get_index_path(trace_file), "wb")
+
+    def write(self, action: dict, event: Optional[Event]):
+        metadata = None
+        if event is not None:
+            metadata = LeanEvent.from_event(event, keep_frames=False).metadata
+        line = json.dumps(dict(action=action, metadata=metadata), default=to_json)
+        self.index.write(struct.pack(INDEX_FORMAT, self.file.tell()))
+        self.file.write(line.encode() + b"\n")
+        # keep what was recorded so far readable if the episode crashes
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class TraceReader:
+    """Random access to the records of a trace, through its memory mapped index"""
+
+    def __init__(self, trace_file: str):
+        self.trace_file = trace_file
+        self.file = open(trace_file, "rb")
+        index_path = get_index_path(trace_file)
+        if os.path.getsize(index_path) > 0:
+            self.offsets = np.memmap(index_path, dtype=INDEX_FORMAT, mode="r")
+        else:
+            self.offsets = np.zeros(0, dtype=INDEX_FORMAT)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> dict:
+        self.file.seek(int(self.offsets[i]))
+        return json.loads(self.file.readline())
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def actions(self) -> List[dict]:
+        return [record["action"] for record in self]
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingController:
+    """
+    Creates a controller with controller_class and kwargs and records its
+    initialization, then every step and reset, into a trace
+    """
+
+    def __init__(self, controller_class: Callable, trace_file: str, **kwargs):
+        self.controller = controller_class(**kwargs)
+        self.writer = TraceWriter(trace_file)
+        self.writer.write(
+            dict(kwargs, action="Initialize"),
+            getattr(self.controller, "last_event", None),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.controller, name)
+
+    def step(self, action=None, **kwargs) -> Event:
+        request = normalize_action(action, **kwargs)
+        event = self.controller.step(request)
+        self.writer.write(request, event)
+        return event
+
+    def reset(self, *args, **kwargs) -> Event:
+        event = self.controller.reset(*args, **kwargs)
+        self.writer.write(dict(kwargs, action="Reset"), event)
+        return event
+
+    def stop(self):
+        self.writer.close()
+        self.controller.stop()
+
+
+class ReplayDivergence(Exception):
+    """A replayed episode sent another request than the recorded one"""
+
+
+class ReplayController:
+    """
+    Stand-in for ai2thor.controller.Controller that serves the responses of a trace
+    in order, as LeanEvents without frames
+
+    With strict set, every request has to be the recorded one, otherwise
+    ReplayDivergence is raised, so the first decision that changed since the
+    recording is reported instead of replaying responses that don't belong to it.
+    """
+
+    def __init__(self, trace_file: str, strict: bool = True, **kwargs):
+        """kwargs: the arguments the recorded controller was created with"""
+        self.reader = TraceReader(trace_file)
+        self.strict = strict
+        self.position = 0
+        self.last_event: Optional[LeanEvent] = None
+        self.next_event(dict(kwargs, action="Initialize"))
+
+    def next_event(self, request: dict) -> LeanEvent:
+        if self.position >= len(self.reader):
+            raise ReplayDivergence(
+                "step {} is past the end of {}: {}".format(
+                    self.position, self.reader.trace_file, dump_action(request)
+                )
+            )
+        record = self.reader[self.position]
+        if self.strict and dump_action(record["action"]) != dump_action(request):
+            raise ReplayDivergence(
+                "step {} of {} diverged, recorded {}, got {}".format(
+                    self.position,
+                    self.reader.trace_file,
+                    dump_action(record["action"]),
+                    dump_action(request),
+                )
+            )
+        self.position += 1
+        if record["metadata"] is not None:
+            self.last_event = LeanEvent(record["metadata"])
+        return self.last_event
+
+    def step(self, action=None, **kwargs) -> LeanEvent:
+        return self.next_event(normalize_action(action, **kwargs))
+
+    def reset(self, *args, **kwargs) -> LeanEvent:
+        return self.next_event(dict(kwargs, action="Reset"))
+
+    @property
+    def finished(self) -> bool:
+        return self.position == len(self.reader)
+
+    def stop(self):
+        self.reader.close()
+
+
+def get_scene(trace_file: str) -> str:
+    """The scene the controller of a trace was initialized with"""
+    reader = TraceReader(trace_file)
+    try:
+        return reader[0]["action"]["scene"]
+    finally:
+        reader.close()
+
+
+def diff(trace_a: str, trace_b: str, context: int = 3) -> Optional[int]:
+    """
+    Prints the first request two traces differ at with the requests before it,
+    returns its step or None if both traces send the same requests
+    """
+    a, b = TraceReader(trace_a), TraceReader(trace_b)
+    for i in range(max(len(a), len(b))):
+        action_a = dump_action(a[i]["action"]) if i < len(a) else "<end of trace>"
+        action_b = dump_action(b[i]["action"]) if i < len(b) else "<end of trace>"
+        if action_a != action_b:
+            for j in range(max(i - context, 0), i):
+                print("  {:6d} {}".format(j, dump_action(a[j]["action"])))
+            print("- {:6d} {}".format(i, action_a))
+            print("+ {:6d} {}".format(i, action_b))
+            return i
+    print("{} steps, no differences".format(len(a)))
+    return None
+
+
+if __name__ == "__main__":
+    Fire(diff)
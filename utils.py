@@ -2,10 +2,11 @@ import logging
 import math
 from collections import namedtuple
 from pprint import pformat
-from typing import Iterator, List, Optional, Tuple
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 import numpy as np
-from ai2thor.server import Event
+
+from events import Event
 
 orientation_bindings = {
     0: (0, 1),
@@ -38,12 +39,17 @@ def get_rotation(degrees: float) -> dict:
 
 class Action:
     rotate_angle: int = 15
+    rotate_cost: float = 1.0
+    teleport_cost: float = 2.0
+    default_cost: float = 0.5
 
     def __init__(self, actions: List[dict]):
 
         self.actions = actions
         self.api_actions = []
-        for api_action in actions:
+        # index of the logical action in self.actions each api action comes from
+        self.sources = []
+        for i, api_action in enumerate(actions):
             if api_action["action"].startswith("Rotate") or api_action[
                 "action"
             ].startswith("Look"):
@@ -55,12 +61,37 @@ class Action:
                             degrees=round(self.rotate_angle, 1),
                         )
                     )
+                    self.sources.append([i])
                     degrees -= self.rotate_angle
                 self.api_actions.append(
                     dict(action=api_action["action"], degrees=round(degrees, 1))
                 )
             else:
                 self.api_actions.append(api_action)
+            self.sources.append([i])
+
+    def coalesced(self) -> Tuple[List[dict], List[List[int]]]:
+        """
+        Merges consecutive compatible logical actions into the fewest api actions,
+        rotations and horizon changes are sent in one piece instead of being split
+        into rotate_angle steps. Returns the api actions and, for each of them, the
+        indices of the logical actions it covers
+        """
+        api_actions = []
+        sources = []
+        for i, api_action in enumerate(self.actions):
+            family = _action_family(api_action)
+            if api_actions and family and family == _action_family(api_actions[-1]):
+                merged = _merge_actions(api_actions[-1], api_action)
+                if merged is not None:
+                    api_actions[-1] = merged
+                    sources[-1].append(i)
+                    continue
+            if family in ("Rotate", "Look"):
+                api_action = dict(api_action, degrees=api_action.get("degrees", 90))
+            api_actions.append(api_action)
+            sources.append([i])
+        return api_actions, sources
 
     def __str__(self) -> str:
         return "Action:\n" + pformat(self.api_actions, indent=2)
@@ -71,16 +102,58 @@ class Action:
         res = 0
         for api_action in self.actions:
             if api_action["action"].startswith("Rotate"):
-                res += 1.0
+                res += self.rotate_cost
             elif api_action["action"].startswith("Teleport"):
-                res += 2.0
+                res += self.teleport_cost
             else:
-                res += 0.5
+                res += self.default_cost
 
         return res
 
 
+def _action_family(api_action: dict) -> Optional[str]:
+    for family in ("Rotate", "Look", "Teleport"):
+        if api_action["action"].startswith(family):
+            return family
+    return None
+
+
+def _merge_actions(first: dict, second: dict) -> Optional[dict]:
+    """
+    Merges two api actions of the same family into one, returns None if they can't
+    be merged
+    """
+    family = _action_family(first)
+    if family == "Teleport":
+        # teleports are absolute, they merge as long as they set different things
+        if first.keys() & second.keys() - {"action"}:
+            return None
+        return dict(first, **second)
+
+    positive = {"Rotate": "RotateRight", "Look": "LookDown"}[family]
+    degrees = 0
+    for api_action in (first, second):
+        sign = 1 if api_action["action"] == positive else -1
+        degrees += sign * api_action.get("degrees", 90)
+    if family == "Rotate":
+        return get_rotation(degrees)
+    if degrees >= 0:
+        return dict(action="LookDown", degrees=degrees)
+    return dict(action="LookUp", degrees=-degrees)
+
+
+def quantize(value: float, step_size: float) -> int:
+    """Returns the index of the grid line of spacing step_size closest to value"""
+    return int(round(value / step_size))
+
+
 class NavigationState:
+    """
+    Agent position on the navigation grid, identified by its integer cell (i, j) so
+    that states reported with float noise by the simulator compare and hash equal
+    """
+
+    __slots__ = ("x", "z", "theta", "i", "j")
     step_size = 0.05
     invalid_positions = set()
 
@@ -88,17 +161,28 @@ class NavigationState:
         self.x = x
         self.z = z
         self.theta = theta
+        self.i = quantize(x, self.step_size)
+        self.j = quantize(z, self.step_size)
+
+    @property
+    def cell(self) -> Tuple[int, int]:
+        return self.i, self.j
+
+    @property
+    def key(self) -> int:
+        """Packs the cell into one integer, unique for |i|, |j| < 2 ** 31"""
+        return (self.i << 32) | (self.j & 0xFFFFFFFF)
 
     def __eq__(self, other) -> bool:
         """Only considers the position, no rotation"""
         return (
             isinstance(other, NavigationState)
-            and other.x == self.x
-            and other.z == self.z
+            and other.i == self.i
+            and other.j == self.j
         )
 
     def __hash__(self) -> int:
-        return hash(self.x + self.z)
+        return hash(self.key)
 
     def __str__(self) -> str:
         return "<NavigationState ({}, {})@{}>".format(self.x, self.z, self.theta)
@@ -133,7 +217,8 @@ class NavigationState:
         return NavigationState(
             event.metadata["agent"]["position"]["x"],
             event.metadata["agent"]["position"]["z"],
-            int(event.metadata["agent"]["rotation"]["y"]),
+            # rotations come back as e.g. 89.99998, truncating would give 89
+            int(round(event.metadata["agent"]["rotation"]["y"])) % 360,
         )
 
     @staticmethod
@@ -160,7 +245,7 @@ class NavigationState:
     @staticmethod
     def add_invalid(state: "NavigationState"):
 
-        NavigationState.invalid_positions.add((state.x, state.z))
+        NavigationState.invalid_positions.add(state.cell)
 
     # def get_successors(self) -> Iterator[Tuple["NavigationState", Action]]:
     #     """
@@ -214,45 +299,152 @@ class NavigationState:
 #
 
 
-def get_obj_loc(event: Event, object_id: str) -> Optional[Pos2D]:
+class ObjectIndex:
+    """Lookup tables over the object metadata of a single event"""
+
+    def __init__(self, event: Event):
+        self.event = event
+        self.by_id = {}
+        self.by_name = {}
+        self.by_type = {}
+        self.visible_ids = set()
+        for obj_info in event.metadata["objects"]:
+            self.by_id.setdefault(obj_info["objectId"], obj_info)
+            self.by_name.setdefault(obj_info["name"], obj_info)
+            self.by_type.setdefault(obj_info["objectType"], []).append(obj_info)
+            if obj_info["visible"]:
+                self.visible_ids.add(obj_info["objectId"])
+
+    def get(self, object_id: str) -> Optional[dict]:
+        return self.by_id.get(object_id)
+
+
+def get_obj_loc(index: ObjectIndex, object_id: str) -> Optional[Pos2D]:
 
     pos = None
-    for object_info in event.metadata["objects"]:
-        if object_info["objectId"] == object_id:
-            center = object_info["axisAlignedBoundingBox"]["center"]
-            pos = Pos2D(center["x"], center["z"])
+    object_info = index.get(object_id)
+    if object_info is not None:
+        center = object_info["axisAlignedBoundingBox"]["center"]
+        pos = Pos2D(center["x"], center["z"])
     if pos is None:
         logging.warning("{} not found in scene".format(object_id))
     return pos
 
 
-def get_obj_loc3d(event: Event, object_id: str) -> Optional[Pos3D]:
+def get_obj_loc3d(index: ObjectIndex, object_id: str) -> Optional[Pos3D]:
 
     pos = None
-    for object_info in event.metadata["objects"]:
-        if object_info["objectId"] == object_id:
-            # center = object_info["axisAlignedBoundingBox"]["center"]
-            center = object_info["position"]
-            pos = Pos3D(center["x"], center["y"], center["z"])
-            break
+    object_info = index.get(object_id)
+    if object_info is not None:
+        # center = object_info["axisAlignedBoundingBox"]["center"]
+        center = object_info["position"]
+        pos = Pos3D(center["x"], center["y"], center["z"])
     if pos is None:
         logging.warning("{} not found in scene".format(object_id))
     return pos
 
 
-def get_obj_in_frame(event: Event, object_id: str) -> Optional[Pos2D]:
+class FrameObject(NamedTuple):
+    """
+    An object instance in the segmentation frame, positions are fractions of the
+    frame height (rows) and width (columns)
+    """
+
+    centroid: Pos2D
+    # number of pixels
+    area: int
+    # row_min, col_min, row_max, col_max in pixels, inclusive
+    bbox: Tuple[int, int, int, int]
+
+
+class FrameAnalysis:
+    """
+    Centroid, area and bounding box of every object instance of an event's
+    segmentation frame, computed in one vectorized pass over the frame
+
+    With downsample > 1 only every downsample-th row and column is read, which
+    divides the work by its square at the cost of precision on small instances.
+    """
+
+    def __init__(self, event: Event, downsample: int = 1):
+        self.downsample = downsample
+        self.objects: Dict[str, FrameObject] = {}
+        segmentation = getattr(event, "instance_segmentation_frame", None)
+        if segmentation is not None:
+            self.analyze(segmentation, event.color_to_object_id)
+        else:
+            for object_id, mask in event.instance_masks.items():
+                self.add(object_id, mask[::downsample, ::downsample], mask.shape)
+
+    def analyze(self, segmentation: np.ndarray, color_to_object_id: dict):
+        step = self.downsample
+        height, width = segmentation.shape[:2]
+        pixels = segmentation[::step, ::step].astype(np.int32)
+        codes = (pixels[..., 0] << 16 | pixels[..., 1] << 8 | pixels[..., 2]).ravel()
+
+        # one sort groups the pixels by instance, in scan order within an instance
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(
+            np.concatenate(([True], sorted_codes[1:] != sorted_codes[:-1]))
+        )
+        ends = np.append(starts[1:], len(codes))
+        colors, counts = sorted_codes[starts], ends - starts
+        rows, cols = np.divmod(order, pixels.shape[1])
+        rows *= step
+        cols *= step
+
+        bounds = [
+            rows[starts],
+            np.minimum.reduceat(cols, starts),
+            rows[ends - 1],
+            np.maximum.reduceat(cols, starts),
+        ]
+        row_means = np.add.reduceat(rows, starts) / counts
+        col_means = np.add.reduceat(cols, starts) / counts
+
+        for i, code in enumerate(colors.tolist()):
+            color = (code >> 16, code >> 8 & 255, code & 255)
+            object_id = color_to_object_id.get(color)
+            if object_id is None:
+                continue
+            self.objects[object_id] = FrameObject(
+                centroid=Pos2D(row_means[i] / height, col_means[i] / width),
+                area=int(counts[i]) * step * step,
+                bbox=tuple(int(bound[i]) for bound in bounds),
+            )
+
+    def add(self, object_id: str, mask: np.ndarray, shape: Tuple[int, int]):
+        """Adds an object from its (downsampled) boolean mask of a frame of shape"""
+        rows, cols = mask.nonzero()
+        if len(rows) == 0:
+            return
+        step = self.downsample
+        rows, cols = rows * step, cols * step
+        self.objects[object_id] = FrameObject(
+            centroid=Pos2D(rows.mean() / shape[0], cols.mean() / shape[1]),
+            area=len(rows) * step * step,
+            bbox=(int(rows.min()), int(cols.min()), int(rows.max()), int(cols.max())),
+        )
 
-    try:
-        mask = event.instance_masks[object_id]
-    except KeyError:
-        if object_id.count("|") > 3:
-            trimed_id = "|".join(object_id.split("|")[:-1])
-            res = get_obj_in_frame(event, trimed_id)
-            if res is not None:
-                return res
+    def get(self, object_id: str) -> Optional[FrameObject]:
+        """
+        Returns the instance of object_id, or of the object it was sliced from, as
+        ids of slices have an extra component
+        """
+        frame_object = self.objects.get(object_id)
+        if frame_object is None and object_id.count("|") > 3:
+            frame_object = self.get("|".join(object_id.split("|")[:-1]))
+        return frame_object
+
+
+def get_obj_in_frame(analysis: FrameAnalysis, object_id: str) -> Optional[Pos2D]:
+    """
+    Relative centroid of object_id in an analyzed frame, pass Env.analyze_frame() to
+    share the analysis of the current event between lookups
+    """
+    frame_object = analysis.get(object_id)
+    if frame_object is None:
         logging.warning("{} not found in frame".format(object_id))
         return None
-    else:
-        size = mask.shape[0]
-        xs, zs = mask.nonzero()
-        return Pos2D(xs.mean() / size, zs.mean() / size)
+    return frame_object.centroid